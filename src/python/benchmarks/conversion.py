@@ -0,0 +1,241 @@
+import argparse
+import atexit
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from rdflib import Graph, URIRef
+
+from benchmarks import fixtures
+
+# Benchmarks of the conversion hot paths, compared with saved baselines.
+# Each case measures an operation repeated over a fixture and reports its cost per item. A case is a regression when its median cost
+# is above the baseline by more than the threshold. The baselines depend on the machine, they are saved with --save-baseline.
+# Usage: python -m benchmarks.conversion [--only sanitize_uri,pwc_process] [--pwc-records 100000] [--threshold 0.2] [--save-baseline]
+baseline_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'conversion.json')
+default_threshold = 0.2
+
+@dataclass
+class BenchmarkCase:
+    name: str
+    description: str
+    # Returns the number of items and the function to time, given the options of the run
+    setup: Callable[[argparse.Namespace], tuple[int, Callable[[], object]]]
+    repeats: int | None = None
+
+benchmark_cases: dict[str, BenchmarkCase] = {}
+
+def benchmark(name: str, description: str, repeats: int | None = None):
+    def register(setup):
+        benchmark_cases[name] = BenchmarkCase(name, description, setup, repeats)
+        return setup
+    return register
+
+def hal_source():
+    from kg.knowledge import Source
+    return Source(URIRef('http://api.archives-ouvertes.fr/ref/author/'))
+
+@benchmark('sanitize_uri', 'sanitize_uri on URIs from the sources, per URI')
+def sanitize_uri_case(options):
+    from util.utilities import sanitize_uri
+    uris = fixtures.synthetic_uris(options.items)
+    return len(uris), lambda: [ sanitize_uri(uri) for uri in uris ]
+
+@benchmark('create_uri', 'create_uri on URIs from the sources, per URI')
+def create_uri_case(options):
+    from util.utilities import create_uri
+    uris = fixtures.synthetic_uris(options.items)
+    return len(uris), lambda: [ create_uri(uri) for uri in uris ]
+
+@benchmark('hal_author', 'hal_json_author_to_person and to_rdf, per author record')
+def hal_author_case(options):
+    from hal_source.hal import hal_json_author_to_person
+    authors = fixtures.recorded_hal_docs('data/hal/author/', options.items) if options.recorded else []
+    if len(authors) == 0:
+        authors = fixtures.synthetic_hal_authors(options.items)
+    source = hal_source()
+    query_url = 'http://api.archives-ouvertes.fr/ref/author/?wt=json&rows=100&start=0'
+    def convert():
+        graph = Graph()
+        for author in authors:
+            author_obj = hal_json_author_to_person(author, query_url, source)
+            if author_obj != None:
+                author_obj.to_rdf(graph)
+        return graph
+    return len(authors), convert
+
+@benchmark('hal_software', 'hal_software_to_software_obj and to_rdf, per software record')
+def hal_software_case(options):
+    from hal_source.hal import hal_software_to_software_obj
+    software_records = fixtures.recorded_hal_docs('data/hal/software/', options.items // 10) if options.recorded else []
+    if len(software_records) == 0:
+        software_records = fixtures.synthetic_hal_software(options.items // 10)
+    source = hal_source()
+    query_url = 'https://api.archives-ouvertes.fr/search/?wt=json&fq=docType_s:SOFTWARE&rows=100&start=0'
+    def convert():
+        graph = Graph()
+        for software in software_records:
+            hal_software_to_software_obj(software, query_url, source).to_rdf(graph)
+        return graph
+    return len(software_records), convert
+
+@benchmark('paper_to_rdf', 'Paper.to_rdf of papers with 200 authors, per paper')
+def paper_to_rdf_case(options):
+    from kg.knowledge import Source
+    source = Source(URIRef('https://dblp.org/'))
+    papers = [ fixtures.synthetic_paper(200, source, index) for index in range(max(options.items // 1000, 1)) ]
+    def convert():
+        graph = Graph()
+        for paper in papers:
+            paper.to_rdf(graph)
+        return graph
+    return len(papers), convert
+
+# The whole conversion of process_paper_with_code, from the links dump to the Turtle files, in a temporary working directory
+@benchmark('pwc_process', 'process_paper_with_code on a synthetic links dump, per record', repeats=1)
+def pwc_process_case(options):
+    import paper_with_code_source.paper_with_code as paper_with_code
+    from util.lazy_graph import LazyGraph
+    working_directory = tempfile.mkdtemp(prefix='pwc_benchmark_')
+    atexit.register(shutil.rmtree, working_directory, ignore_errors=True)
+    fixtures.write_synthetic_paper_with_code_file(os.path.join(working_directory, paper_with_code.paper_and_code_filename), options.pwc_records)
+    for graph_filename in (paper_with_code.g_pwc_paper_filename, paper_with_code.g_pwc_code_filename):
+        os.makedirs(os.path.join(working_directory, os.path.dirname(graph_filename)), exist_ok=True)
+    def process():
+        previous_directory = os.getcwd()
+        os.chdir(working_directory)
+        paper_with_code.g_pwc_paper = LazyGraph()
+        paper_with_code.g_pwc_code = LazyGraph()
+        try:
+            paper_with_code.process_paper_with_code(num_workers=options.pwc_workers)
+        finally:
+            os.chdir(previous_directory)
+    return options.pwc_records, process
+
+def paper_with_code_graph(num_records: int) -> Graph:
+    from paper_with_code_source.paper_with_code import convert_paper_with_code_record, paper_with_code_source
+    graph = Graph()
+    source = paper_with_code_source()
+    for record in fixtures.synthetic_paper_with_code_records(num_records):
+        convert_paper_with_code_record(record, source, graph, graph)
+    return graph
+
+@benchmark('serialize_turtle', 'Turtle serialization of a Papers with Code graph, per triple')
+def serialize_turtle_case(options):
+    graph = paper_with_code_graph(options.items // 10)
+    return len(graph), lambda: graph.serialize(destination=io.BytesIO(), format='turtle', encoding='utf-8')
+
+@benchmark('serialize_ntriples', 'N-Triples serialization of a Papers with Code graph, per triple')
+def serialize_ntriples_case(options):
+    graph = paper_with_code_graph(options.items // 10)
+    return len(graph), lambda: graph.serialize(destination=io.BytesIO(), format='nt', encoding='utf-8')
+
+# Median and minimum time of the repeats, after a warm-up run for the cases repeated more than once
+def run_case(case: BenchmarkCase, options: argparse.Namespace) -> dict:
+    num_items, function = case.setup(options)
+    repeats = case.repeats if case.repeats != None else options.repeats
+    if repeats > 1:
+        function()
+    durations = []
+    for _ in range(repeats):
+        gc.collect()
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    median_duration = statistics.median(durations)
+    return {
+        'items': num_items,
+        'repeats': repeats,
+        'median_s': median_duration,
+        'min_s': min(durations),
+        'per_item_us': median_duration / max(num_items, 1) * 1e6,
+        'items_per_s': num_items / median_duration if median_duration > 0 else 0.0,
+    }
+
+def load_baselines(filename: str) -> dict:
+    if not os.path.exists(filename):
+        return {}
+    baseline_file = open(filename, 'r')
+    baselines = json.load(baseline_file)
+    baseline_file.close()
+    return baselines
+
+def save_baselines(filename: str, baselines: dict):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    baseline_file = open(filename, 'w')
+    json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+    baseline_file.write('\n')
+    baseline_file.close()
+
+# Compares the cost per item of each case with its baseline, returns the names of the regressed cases
+def compare_with_baselines(results: dict, baselines: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f'{"case":<20} {"items":>8} {"per item":>12} {"baseline":>12} {"change":>8}')
+    for name, result in results.items():
+        baseline = baselines.get('cases', {}).get(name)
+        line = f'{name:<20} {result["items"]:>8} {result["per_item_us"]:>10.2f}us'
+        if baseline is None:
+            print(f'{line} {"-":>12} {"-":>8}')
+            continue
+        change = result['per_item_us'] / baseline['per_item_us'] - 1
+        status = ''
+        if change > threshold:
+            status = ' REGRESSION'
+            regressions.append(name)
+        print(f'{line} {baseline["per_item_us"]:>10.2f}us {change:>+8.1%}{status}')
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the conversion hot paths and compare them with the saved baselines')
+    parser.add_argument('--only', help='comma-separated names of the cases to run, among ' + ', '.join(benchmark_cases))
+    parser.add_argument('--items', type=int, default=10000, help='size of the in-memory fixtures')
+    parser.add_argument('--pwc-records', type=int, default=100000, help='number of records of the links dump of pwc_process')
+    parser.add_argument('--pwc-workers', type=int, default=1, help='worker processes of pwc_process')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--recorded', action='store_true', help='use the HAL answers cached under data/hal/ when there are some')
+    parser.add_argument('--threshold', type=float, default=default_threshold, help='relative slowdown above which a case is a regression')
+    parser.add_argument('--baseline', default=baseline_filename)
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baselines')
+    parser.add_argument('--output', help='JSON file of the results')
+    options = parser.parse_args()
+    # The sources read and write their data relative to src/python
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logging.basicConfig(level=logging.WARNING)
+
+    names = options.only.split(',') if options.only else list(benchmark_cases)
+    unknown_names = [ name for name in names if name not in benchmark_cases ]
+    if len(unknown_names) > 0:
+        parser.error(f'Unknown benchmark cases: {", ".join(unknown_names)}')
+    results = {}
+    for name in names:
+        print(f'Running {name}: {benchmark_cases[name].description}', file=sys.stderr)
+        results[name] = run_case(benchmark_cases[name], options)
+
+    baselines = load_baselines(options.baseline)
+    regressions = compare_with_baselines(results, baselines, options.threshold)
+    if options.output:
+        save_baselines(options.output, { 'machine': platform.platform(), 'python': platform.python_version(), 'cases': results })
+    if options.save_baseline:
+        # Only the cases run are replaced, so that a baseline can be updated one case at a time
+        baselines.setdefault('cases', {}).update(results)
+        baselines.update({ 'machine': platform.platform(), 'python': platform.python_version() })
+        save_baselines(options.baseline, baselines)
+        print(f'Baselines saved to {options.baseline}')
+        return 0
+    if len(regressions) > 0:
+        print(f'{len(regressions)} regressions above {options.threshold:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import glob
+import json
+import os
+import random
+
+from rdflib import URIRef
+
+from kg.knowledge import Paper, Person, Source, UniqueIdentifier
+
+# Fixtures of the conversion benchmarks.
+# The synthetic fixtures are generated from a fixed seed, with the fields and value shapes of the HAL API and of the Papers with Code dump.
+# The recorded fixtures are the HAL answers cached by previous runs under data/hal/, used instead of the synthetic ones when they are available.
+fixture_seed = 42
+
+first_names = [ 'Jean', 'Marie', 'Pierre', 'Camille', 'Nicolas', 'Léa', 'Olivier', 'Chloé', 'François', 'Zoë' ]
+last_names = [ 'Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau' ]
+words = [ 'graph', 'knowledge', 'learning', 'neural', 'semantic', 'embedding', 'query', 'ontology', 'data', 'model', 'inference', 'reasoning' ]
+
+def random_name(rng: random.Random) -> tuple[str, str]:
+    return rng.choice(first_names), rng.choice(last_names)
+
+def random_title(rng: random.Random, num_words: int = 6) -> str:
+    return ' '.join(rng.choice(words) for _ in range(num_words)).capitalize()
+
+def random_orcid(rng: random.Random) -> str:
+    return '-'.join(f'{rng.randrange(10000):04d}' for _ in range(4))
+
+# URIs as they are found in the sources: mostly well formed, some with repeated domains, spaces, fragments or no scheme
+def synthetic_uris(count: int, seed: int = fixture_seed) -> list[str]:
+    rng = random.Random(seed)
+    uris = []
+    for index in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            uris.append(f'https://github.com/{rng.choice(last_names).lower()}/{rng.choice(words)}-{index}')
+        elif kind < 0.7:
+            uris.append(f'https://doi.org/https://doi.org/10.{rng.randrange(1000, 9999)}/{index}')
+        elif kind < 0.8:
+            uris.append(f'http://www.example.org/{rng.choice(words)}?id={index}&page=2#section{index % 7}')
+        elif kind < 0.9:
+            uris.append(f'https://gitlab.inria.fr/{rng.choice(words)}/{rng.choice(words)} project {index}')
+        else:
+            uris.append(f'{rng.choice(words)} {index}')
+    return uris
+
+def synthetic_hal_authors(count: int, seed: int = fixture_seed) -> list[dict]:
+    rng = random.Random(seed)
+    authors = []
+    for index in range(count):
+        first_name, last_name = random_name(rng)
+        author = {
+            'idHal_s': f'{first_name.lower()}-{last_name.lower()}-{index}',
+            'fullName_s': f'{first_name} {last_name}',
+            'firstName_s': first_name,
+            'lastName_s': last_name,
+            'fullName_sci': f'{last_name}, {first_name}',
+        }
+        if rng.random() < 0.5:
+            author['orcidId_s'] = [ f'https://orcid.org/{random_orcid(rng)}' ]
+        if rng.random() < 0.2:
+            author['google scholarId_s'] = [ f'https://scholar.google.com/citations?user={index:012d}' ]
+        if rng.random() < 0.3:
+            author['idrefId_s'] = [ f'https://www.idref.fr/{rng.randrange(10**8, 10**9)}' ]
+        authors.append(author)
+    return authors
+
+def synthetic_hal_software(count: int, seed: int = fixture_seed) -> list[dict]:
+    rng = random.Random(seed)
+    software_records = []
+    for index in range(count):
+        num_authors = rng.randint(1, 8)
+        names = [ random_name(rng) for _ in range(num_authors) ]
+        software = {
+            'halId_s': f'hal-{index:08d}',
+            'docid': str(index),
+            'label_s': random_title(rng),
+            'uri_s': f'https://inria.hal.science/hal-{index:08d}',
+            'title_s': [ random_title(rng) ],
+            'abstract_s': [ ' '.join(random_title(rng, 12) for _ in range(4)) ],
+            'keyword_s': [ rng.choice(words) for _ in range(rng.randint(1, 6)) ],
+            'authFullName_s': [ f'{first_name} {last_name}' for first_name, last_name in names ],
+            'authIdHal_s': [ f'{first_name.lower()}-{last_name.lower()}' for first_name, last_name in names[:num_authors // 2] ],
+            'authORCIDIdExt_s': [ random_orcid(rng) for _ in range(num_authors // 3) ],
+            'softCodeRepository_s': [ f'https://gitlab.inria.fr/{rng.choice(words)}/{rng.choice(words)}-{index}' ],
+            'softProgrammingLanguage_s': [ rng.choice([ 'Python', 'C++', 'Java', 'OCaml', 'Rust' ]) ],
+            'softPlatform_s': [ rng.choice([ 'Linux', 'Windows', 'Mac OS X' ]) ],
+            'modifiedDate_tdate': '2024-03-01T10:00:00Z',
+            'releasedDate_tdate': '2023-11-15T00:00:00Z',
+            'publicationDate_tdate': '2023-11-15T00:00:00Z',
+            'structRorIdExt_s': [ f'https://ror.org/0{rng.randrange(10**7, 10**8)}' for _ in range(rng.randint(0, 2)) ],
+            'structIdrefIdExtUrl_s': [ f'https://www.idref.fr/{rng.randrange(10**8, 10**9)}' for _ in range(rng.randint(0, 2)) ],
+            'labStructRorIdExt_s': [ f'https://ror.org/0{rng.randrange(10**7, 10**8)}' ],
+            'labStructIdrefIdExtUrl_s': [ f'https://www.idref.fr/{rng.randrange(10**8, 10**9)}' ],
+            'openAccess_bool': rng.random() < 0.7,
+        }
+        software_records.append(software)
+    return software_records
+
+# A paper with the given number of authors, each with an ORCID and an affiliation-free identifier
+def synthetic_paper(num_authors: int, source: Source, index: int = 0, seed: int = fixture_seed) -> Paper:
+    rng = random.Random(seed + index)
+    paper = Paper(source, URIRef(f'https://dblp.org/rec/journals/synthetic/{index}'))
+    paper.set_title(random_title(rng, 10))
+    paper.set_abstract(' '.join(random_title(rng, 12) for _ in range(6)))
+    paper.set_doi(URIRef(f'https://doi.org/10.{rng.randrange(1000, 9999)}/{index}'))
+    for keyword in rng.sample(words, 4):
+        paper.add_keyword(keyword)
+    for author_index in range(num_authors):
+        first_name, last_name = random_name(rng)
+        author = Person(source, URIRef(f'https://dblp.org/pid/{index}/{author_index}'))
+        author.set_label(f'{first_name} {last_name}')
+        author.set_first_name(first_name)
+        author.set_last_name(last_name)
+        author.add_identifier(UniqueIdentifier(source, URIRef(f'https://orcid.org/{random_orcid(rng)}')))
+        paper.add_author(author)
+    return paper
+
+def synthetic_paper_with_code_record(rng: random.Random, index: int) -> dict:
+    arxiv_id = f'{rng.randrange(15, 25)}{rng.randrange(1, 13):02d}.{index:05d}'
+    return {
+        'paper_url': f'https://paperswithcode.com/paper/{random_title(rng, 4).lower().replace(" ", "-")}-{index}',
+        'paper_title': random_title(rng, 8),
+        'paper_arxiv_id': arxiv_id if rng.random() < 0.9 else None,
+        'paper_url_abs': f'https://arxiv.org/abs/{arxiv_id}',
+        'paper_url_pdf': f'https://arxiv.org/pdf/{arxiv_id}v1.pdf' if rng.random() < 0.9 else None,
+        'repo_url': f'https://github.com/{rng.choice(last_names).lower()}/{rng.choice(words)}-{index}',
+        'is_official': rng.random() < 0.4,
+        'mentioned_in_paper': rng.random() < 0.3,
+        'mentioned_in_github': rng.random() < 0.8,
+        'framework': rng.choice([ 'pytorch', 'tf', 'jax', 'none' ]),
+    }
+
+def synthetic_paper_with_code_records(count: int, seed: int = fixture_seed) -> list[dict]:
+    rng = random.Random(seed)
+    return [ synthetic_paper_with_code_record(rng, index) for index in range(count) ]
+
+# Writes a links dump of count records, one record at a time
+def write_synthetic_paper_with_code_file(filename: str, count: int, seed: int = fixture_seed):
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as dump_file:
+        dump_file.write('[')
+        for index in range(count):
+            if index > 0:
+                dump_file.write(',\n')
+            json.dump(synthetic_paper_with_code_record(rng, index), dump_file)
+        dump_file.write(']')
+
+# Documents of the HAL answers cached by api_cached_query in a cache directory, e.g. data/hal/author/
+def recorded_hal_docs(cache_directory: str, limit: int | None = None) -> list[dict]:
+    docs = []
+    for filename in sorted(glob.glob(os.path.join(cache_directory, '**', '*.json'), recursive=True)):
+        answer_file = open(filename, 'r')
+        try:
+            answer = json.load(answer_file)
+        except json.JSONDecodeError:
+            continue
+        finally:
+            answer_file.close()
+        if isinstance(answer, dict) and isinstance(answer.get('response'), dict):
+            docs.extend(answer['response'].get('docs', []))
+        if limit != None and len(docs) >= limit:
+            return docs[:limit]
+    return docs
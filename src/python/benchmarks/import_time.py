@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Import time benchmark of the CLI and of the source modules.
+# Each measure runs a fresh interpreter from src/python. The CLI startup (a dry run of the whole pipeline, which loads the .env, configures the logging
+# and declares the stages, without running them) must stay under the target.
+# Usage: python -m benchmarks.import_time [--target-ms 150] [--runs 5]
+
+benchmarked_modules = [
+    'main',
+    'dblp_source.dblp',
+    'hal_source.hal',
+    'gitlab_source.gitlab',
+    'paper_with_code_source.paper_with_code',
+    'crossref_source.crossref',
+    'github_source.github',
+]
+
+def timed_run(command: list[str]) -> float:
+    start_time = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start_time
+
+def median_time(command: list[str], runs: int) -> float:
+    return statistics.median(timed_run(command) for _ in range(runs))
+
+# Modules with the largest cumulative import time, from the output of python -X importtime
+def slowest_imports(module: str, count: int = 5) -> list[tuple[str, int]]:
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], check=True, capture_output=True, text=True)
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, imported_module = line[len('import time:'):].split('|')
+        imports.append((imported_module.strip(), int(cumulative)))
+    return sorted(imports, key=lambda imported: imported[1], reverse=True)[1:count + 1]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Measure the startup time of the CLI and the import time of the sources')
+    parser.add_argument('--target-ms', type=float, default=150, help='maximum startup time of the CLI, in milliseconds')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='JSON file of the measures')
+    arguments = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    interpreter_time = median_time([sys.executable, '-c', 'pass'], arguments.runs)
+    cli_time = median_time([sys.executable, 'cli.py', '--dry-run', 'run'], arguments.runs)
+    measures = { 'interpreter_ms': interpreter_time * 1000, 'cli_startup_ms': cli_time * 1000, 'modules': {} }
+    print(f'Interpreter startup: {interpreter_time * 1000:.0f} ms')
+    print(f'CLI startup: {cli_time * 1000:.0f} ms (target {arguments.target_ms:.0f} ms)')
+    for module in benchmarked_modules:
+        module_time = median_time([sys.executable, '-c', f'import {module}'], arguments.runs) - interpreter_time
+        measures['modules'][module] = { 'import_ms': module_time * 1000, 'slowest_imports_us': slowest_imports(module) }
+        slowest = ', '.join(f'{imported} {cumulative / 1000:.0f} ms' for imported, cumulative in measures['modules'][module]['slowest_imports_us'][:3])
+        print(f'  {module}: {module_time * 1000:.0f} ms ({slowest})')
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(measures, output_file, indent=2)
+    if cli_time * 1000 > arguments.target_ms:
+        print(f'CLI startup above the target of {arguments.target_ms:.0f} ms')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
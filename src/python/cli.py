@@ -0,0 +1,71 @@
+import argparse
+import sys
+
+# Command line entry point, e.g. "python cli.py gitlab" or "python cli.py run export github".
+# Only argparse is imported before the command is parsed: the pipeline and the modules of the selected stages are imported when the command runs.
+
+# Stages run by each command, with the stages they depend on
+cli_commands = {
+    'dblp': (['dblp'], 'Retrieve the most cited papers of each year from DBLP'),
+    'hal': (['hal_people', 'hal_software'], 'Harvest the people, organizations and software of HAL'),
+    'gitlab': (['gitlab'], 'Harvest the public projects of the Gitlab instance'),
+    'gitlab_federation': (['gitlab_federation'], 'Harvest the public projects of the other Gitlab instances of data/gitlab/instances.json'),
+    'pwc': (['pwc'], 'Convert the Papers with Code links'),
+    'crossref': (['crossref'], 'Harvest the articles of the topics of interest from Crossref'),
+    'github': (['github'], 'Search the GitHub accounts of the known people'),
+    'enrich': (['enrich'], 'Complete the most cited papers with Crossref and HAL'),
+    'export': (['export'], 'Write the final graph of the most cited papers'),
+    'dataset': (['dataset'], 'Concatenate the named graphs of all the sources into the N-Quads dataset'),
+    'text_index': (['text_index'], 'Index the titles, abstracts and keywords of the papers and software for the full-text search'),
+    'team_index': (['team_index'], 'Join the organizations, their people, papers, software and repositories into the team index'),
+    'statistics': (['statistics'], 'Write the VoID description and the statistics of the output files'),
+}
+
+def cli_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Build the knowledge graph from its sources')
+    parser.add_argument('--force', action='store_true', help='run the stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='print the stages of the command without running them')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, (_, command_help) in cli_commands.items():
+        subparsers.add_parser(command, help=command_help)
+    run_parser = subparsers.add_parser('run', help='Run the given stages, or the whole pipeline')
+    run_parser.add_argument('stages', nargs='*', help='stages to run with the stages they depend on')
+    serve_parser = subparsers.add_parser('serve', help='Serve the knowledge graph over HTTP, read-only')
+    serve_parser.add_argument('graphs', nargs='*', help='files or directories of the graph (data/rdf/ by default)')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--rebuild', action='store_true', help='load the graph files even if the persisted index is up to date')
+    return parser
+
+def cli(argv: list[str] | None = None) -> int:
+    parser = cli_parser()
+    arguments = parser.parse_args(argv)
+
+    import signal
+    from dotenv import load_dotenv
+    from util.logging_setup import configure_logging
+    load_dotenv()
+    configure_logging()
+    if arguments.command == 'serve':
+        from service.server import serve
+        serve(arguments.graphs or None, host=arguments.host, port=arguments.port, rebuild=arguments.rebuild)
+        return 0
+    from main import pipeline_plan, run_exit_status, run_pipeline, signal_handler
+    targets = arguments.stages if arguments.command == 'run' else cli_commands[arguments.command][0]
+    if arguments.dry_run:
+        try:
+            print('\n'.join(pipeline_plan(targets or None)))
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    try:
+        statuses = run_pipeline(targets, force=True if arguments.force else None)
+    except ValueError as e:
+        parser.error(str(e))
+    return run_exit_status(statuses)
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1 @@
+# The modules of src/python are imported as top-level packages (util, kg, postprocessing...), by the tests too
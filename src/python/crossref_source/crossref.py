@@ -5,68 +5,86 @@ from rdflib import Graph, Literal, Namespace, URIRef
 from rdflib.namespace import RDF, RDFS, FOAF, XSD, OWL, DCAT, DCTERMS
 from kg.knowledge import CitationCount, Organization, Paper, Person, Source, UniqueIdentifier
 from util.utilities import create_uri, create_bnode
+from util.dataset import write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.pipeline import check_cancelled
+from util.metrics import metrics
+from util.rate_limit import RateLimitedSession, RateLimiter
+from util.cache import cache_filepath, cache_stats, read_cached_json, request_fingerprint, write_cached_json
 from kg.CONSTANTS import DOI
+import concurrent.futures
 import json
-import hashlib
-
-from habanero import Crossref
-cr = Crossref(mailto="pierre.maillot@inria.fr", timeout=10000)
+import threading
+from typing import Iterator
+import requests
+
+crossref_mailto = "pierre.maillot@inria.fr"
+# The API can be replaced by a local stand-in such as mock_server.crossref_api, the source of the data staying Crossref
+crossref_api_url = "https://api.crossref.org"
+crossref_base_url = os.getenv('crossref_base_url', crossref_api_url)
+crossref_client_lock = threading.Lock()
+crossref_client_instance = None
+
+# The habanero client is created on first use, so that importing the module does not import habanero
+def crossref_client():
+    global crossref_client_instance
+    with crossref_client_lock:
+        if crossref_client_instance is None:
+            from habanero import Crossref
+            crossref_client_instance = Crossref(base_url=crossref_base_url, mailto=crossref_mailto, timeout=10000)
+        return crossref_client_instance
 
 
 data_path="data/crossref/"
+cursor_path="data/crossref/cursors/"
+page_path="data/crossref/pages/"
+
+# Deep paging parameters, within the limits of the Crossref polite pool
+crossref_rows = 1000
+crossref_max_concurrent_topics = 3
+crossref_requests_per_second = 10
+crossref_limiter = RateLimiter(crossref_requests_per_second)
 
-g_c_papers = Graph()
+g_c_papers = memory_budget.register('crossref_Papers', LazyGraph())
+g_c_papers_lock = threading.Lock()
 g_c_papers_filename = 'data/rdf/paper/crossref_Papers.ttl'
-uri_c_source: URIRef = URIRef(cr.base_url)
+uri_c_source: URIRef = URIRef(crossref_api_url)
 crossref_source_obj = Source(uri_c_source)
 
 # List of topics of interests
 topics = [ "Data science"]
 # topics = [ "Data science", "Machine learning", "Artificial intelligence", "Deep learning", "Natural language processing", "Knowledge Graph", "Knowledge Graph Embedding", "Graph embedding", "Knowledge Graph Completion", "Knowledge Graph Construction" , "Data wrangling", "Explicability"]
 
-logging.basicConfig(filename='app.log', level=logging.INFO)
-
+# Cache key of a works query, from its parameters as they are sent to the Crossref API
 def create_crossref_query_id(ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None = None , limit: int | None = None, order : str | None = None) -> str:
-    crossref_query_id = ""
-    if ids != None:
-        crossref_query_id += str(ids)
-    if query != None:
-        crossref_query_id += query
-    if start_date != None:
-        crossref_query_id += start_date
-    if end_date != None:
-        crossref_query_id += end_date
-    if sort != None:
-        crossref_query_id += sort
-    if limit != None:
-        crossref_query_id += str(limit)
-    if order != None:
-        crossref_query_id += order
-    return crossref_query_id
-
+    crossref_query_parameters = {
+        'ids': sorted(ids) if ids != None else None,
+        'query': query,
+        'from-pub-date': start_date,
+        'until-pub-date': end_date,
+        'sort': sort,
+        'rows': limit,
+        'order': order,
+    }
+    return request_fingerprint('GET', f'{crossref_base_url}/works', crossref_query_parameters)
+
+def crossref_answer_filepath(ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None = None , limit: int | None = None, order : str | None = None) -> str:
+    return cache_filepath(data_path, create_crossref_query_id(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order))
 
 def store_crossref_answer(crossref_answer: dict, ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None = None , limit: int | None = None, order : str | None = None):
-    crossref_query_id=create_crossref_query_id(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
-    crossref_data_filepath=f'{data_path}{hashlib.md5(crossref_query_id.encode()).hexdigest()}.json'
-    crossref_query_file = open(crossref_data_filepath, 'w')
-    json.dump(crossref_answer, crossref_query_file)
-    crossref_query_file.close()
+    crossref_data_filepath = crossref_answer_filepath(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
+    write_cached_json('crossref', crossref_data_filepath, crossref_answer)
 
 def retrieve_crossref_answer(ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None = None , limit: int | None = None, order : str | None = None):
-    crossref_query_id=create_crossref_query_id(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
-    crossref_data_filepath=f'{data_path}{hashlib.md5(crossref_query_id.encode()).hexdigest()}.json'
-    if os.path.exists(crossref_data_filepath):
-        crossref_query_file = open(crossref_data_filepath, 'r')
-        crossref_answer = json.load(crossref_query_file)
-        crossref_query_file.close()
-        return crossref_answer
-    else:
+    crossref_data_filepath = crossref_answer_filepath(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
+    crossref_answer = read_cached_json('crossref', crossref_data_filepath)
+    if crossref_answer == None:
         return {}
+    return crossref_answer
 
 def check_crossref_answer_exists(ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None = None , limit: int | None  = None, order : str | None = None):
-    crossref_query_id = create_crossref_query_id(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
-    crossref_data_filepath=f'{data_path}{hashlib.md5(crossref_query_id.encode()).hexdigest()}.json'
-    return os.path.exists(crossref_data_filepath)
+    return os.path.exists(crossref_answer_filepath(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order))
 
 def retrieve_articles_from_crossref(ids: list[str] | None = None, query: str | None = None, start_date: str | None = None, end_date: str | None = None, sort : str | None  = None, limit: int | None = None, order=None) -> dict:
     filter = {}
@@ -74,42 +92,162 @@ def retrieve_articles_from_crossref(ids: list[str] | None = None, query: str | N
         filter["from-pub-date"] = start_date
     if end_date != None:
         filter["until-pub-date"] = end_date
-    if check_crossref_answer_exists(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order):
-        crossref_answer = retrieve_crossref_answer(query=query, start_date=start_date, end_date=end_date, limit=limit, order=order)
-    else:
+    crossref_answer = read_cached_json('crossref', crossref_answer_filepath(ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order))
+    if crossref_answer == None:
         try:
-            crossref_answer = cr.works(
+            crossref_answer = crossref_client().works(
                    ids=ids,
                    query=query,
                    filter=filter,
                    sort=sort,
                    limit=limit,
                    order=order)
-            store_crossref_answer(crossref_answer=crossref_answer, query=query, start_date=start_date, end_date=end_date, limit=limit, order=order)
+            store_crossref_answer(crossref_answer=crossref_answer, ids=ids, query=query, start_date=start_date, end_date=end_date, sort=sort, limit=limit, order=order)
         except:
             return dict()
     
-    # Ensure the result is a list of dictionaries
+    # Ensure the result is a list of dictionaries, habanero returning the work itself when there is only one id
+    if isinstance(crossref_answer, dict) and 'message' in crossref_answer:
+        return [ crossref_answer ]
     return crossref_answer
 
+def crossref_works_parameters(query: str, filter: dict, sort: str | None, order: str | None) -> dict:
+    parameters = { 'query': query, 'sort': sort, 'order': order }
+    if len(filter) > 0:
+        parameters['filter'] = ",".join(f'{key}:{value}' for key, value in sorted(filter.items()))
+    return parameters
+
+def crossref_page_filepath(query: str, filter: dict, sort: str | None, order: str | None, cursor: str) -> str:
+    page_parameters = dict(crossref_works_parameters(query, filter, sort, order), cursor=cursor)
+    return cache_filepath(page_path, request_fingerprint('GET', f'{crossref_base_url}/works', page_parameters))
+
+def load_cursor_state(cursor_filepath: str) -> dict:
+    if os.path.exists(cursor_filepath):
+        cursor_file = open(cursor_filepath, 'r')
+        cursor_state = json.load(cursor_file)
+        cursor_file.close()
+        return cursor_state
+    return { 'cursors': [], 'next_cursor': '*', 'items': 0, 'done': False }
+
+def save_cursor_state(cursor_filepath: str, cursor_state: dict):
+    cursor_file = open(cursor_filepath + '.tmp', 'w')
+    json.dump(cursor_state, cursor_file)
+    cursor_file.close()
+    os.replace(cursor_filepath + '.tmp', cursor_filepath)
+
+def retrieve_crossref_works_page(session: requests.Session, query: str, filter: dict, sort: str | None, order: str | None, rows: int, cursor: str) -> dict:
+    parameters = { key: value for key, value in crossref_works_parameters(query, filter, sort, order).items() if value != None }
+    parameters.update({ 'rows': rows, 'cursor': cursor, 'mailto': crossref_mailto })
+    response = session.get(f'{crossref_base_url}/works', params=parameters, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+# Yields the pages of items of a Crossref works query, using cursor deep paging.
+# Each page is cached, and the cursors are persisted after each page so that an interrupted harvest replays the cached pages and resumes from the last cursor.
+def iter_crossref_works_pages(query: str, filter: dict, sort: str | None = None, order: str | None = None, limit: int | None = None, rows: int = crossref_rows) -> Iterator[list[dict]]:
+    os.makedirs(cursor_path, exist_ok=True)
+    os.makedirs(page_path, exist_ok=True)
+    cursor_filepath = cache_filepath(cursor_path, request_fingerprint('GET', f'{crossref_base_url}/works', crossref_works_parameters(query, filter, sort, order)))
+    cursor_state = load_cursor_state(cursor_filepath)
+    session = RateLimitedSession(crossref_limiter)
+    num_items = 0
+
+    # Replay of the pages retrieved by a previous run
+    for cursor in list(cursor_state['cursors']):
+        items = read_cached_json('crossref', crossref_page_filepath(query, filter, sort, order, cursor))
+        if items == None:
+            logging.warning('Missing cached Crossref page for %s, restarting the harvest', query)
+            cursor_state = { 'cursors': [], 'next_cursor': '*', 'items': 0, 'done': False }
+            num_items = 0
+            break
+        if limit != None and num_items + len(items) >= limit:
+            yield items[:limit - num_items]
+            return
+        num_items += len(items)
+        yield items
+    if cursor_state['done']:
+        return
+
+    cursor = cursor_state['next_cursor']
+    resumed = cursor != '*'
+    # Items already yielded by the replay, skipped if the harvest restarts from the first page
+    skipped_items = 0
+    while limit == None or num_items < limit:
+        page_rows = rows if limit == None else min(rows, limit - num_items)
+        try:
+            crossref_answer = retrieve_crossref_works_page(session, query, filter, sort, order, page_rows, cursor)
+        except requests.RequestException as e:
+            logging.error('Error while retrieving Crossref works for %s: %s', query, e)
+            if resumed:
+                # Crossref cursors expire after a few minutes without use, the harvest starts over from the first page
+                logging.warning('The Crossref cursor of %s could not be resumed, restarting from the first page', query)
+                cursor_state = { 'cursors': [], 'next_cursor': '*', 'items': 0, 'done': False }
+                save_cursor_state(cursor_filepath, cursor_state)
+                cursor = '*'
+                resumed = False
+                skipped_items = num_items
+                num_items = 0
+                continue
+            return
+        resumed = False
+        message = crossref_answer['message']
+        items = message.get('items', [])
+        cache_stats.record_miss('crossref')
+        write_cached_json('crossref', crossref_page_filepath(query, filter, sort, order, cursor), items)
+        new_items = items[skipped_items:]
+        skipped_items -= len(items) - len(new_items)
+
+        num_items += len(items)
+        next_cursor = message.get('next-cursor')
+        cursor_state['cursors'].append(cursor)
+        cursor_state['items'] = num_items
+        cursor_state['done'] = len(items) < page_rows or next_cursor == None
+        cursor_state['next_cursor'] = next_cursor
+        save_cursor_state(cursor_filepath, cursor_state)
+        logging.info('Retrieved %d of %s Crossref works for %s', num_items, message.get('total-results'), query)
+        if len(new_items) > 0:
+            yield new_items
+        if cursor_state['done']:
+            return
+        cursor = next_cursor
+
+# Harvests the most cited articles of a topic, converting the items of each page as soon as it arrives
+def harvest_crossref_topic(topic: str, start_date: str, end_date: str, limit: int | None = None) -> int:
+    filter = { 'from-pub-date': start_date, 'until-pub-date': end_date }
+    num_articles = 0
+    for items in iter_crossref_works_pages(topic, filter, sort="is-referenced-by-count", order="desc", limit=limit):
+        for article in items:
+            article_obj = process_crossref_article_to_obj(article)
+            if article_obj != None:
+                with g_c_papers_lock:
+                    article_obj.to_rdf(g_c_papers)
+                num_articles += 1
+        metrics.record_entities('crossref_articles', len(items))
+        # The topics share the graph, which is only spilled while no other topic adds to it
+        with g_c_papers_lock:
+            memory_budget.check(g_c_papers)
+        check_cancelled()
+    logging.info('Processed %d articles for domain %s', num_articles, topic)
+    return num_articles
+
 def process_top_articles_by_domains(domains, nb_years, limit):
     logging.info(f"Processing the top {limit} articles for domains: {domains} of the last {nb_years} years")
-    for domain in domains:
-        end_date = datetime.now()
-        start_date = end_date.replace(year=end_date.year - nb_years)
-        start_date_str = start_date.strftime("%Y-%m-%d")
-        end_date_str = end_date.strftime("%Y-%m-%d")
-        top_domain_articles = retrieve_articles_from_crossref(domain, start_date_str, end_date_str, limit, sort="is-referenced-by-count")
-
-        logging.info(f'Processing {len(top_domain_articles)} articles for domain {domain}')
-
-        # Process article to RDF
-        for article in top_domain_articles["message"]["items"]:
-            process_crossref_article_to_obj(article)
+    end_date = datetime.now()
+    start_date = end_date.replace(year=end_date.year - nb_years)
+    start_date_str = start_date.strftime("%Y-%m-%d")
+    end_date_str = end_date.strftime("%Y-%m-%d")
+    # The topics are harvested concurrently, within the number of concurrent requests allowed in the polite pool
+    with concurrent.futures.ThreadPoolExecutor(max_workers=crossref_max_concurrent_topics) as executor:
+        futures = { executor.submit(harvest_crossref_topic, domain, start_date_str, end_date_str, limit): domain for domain in domains }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logging.error('Error while processing domain %s: %s', futures[future], e)
 
 def crossref_expand_article_obj(article_obj : Paper) -> Paper:
     id_list = list(filter( lambda id_str: "doi.org" in id_str, [ str(uid.uri) for uid in article_obj.identifiers ]))
-    logging.debug(f"Expanding for article with ids {id_list}")
+    logging.debug('Expanding for article with ids %s', id_list)
     article_from_crossref = retrieve_articles_from_crossref(ids=id_list)
     for article_json_message in article_from_crossref:
         article_json = article_json_message["message"]
@@ -163,9 +301,11 @@ def process_crossref_article_to_obj(article) -> Paper | None:
         doi_string = article["DOI"]
         article_uri = create_uri(DOI + doi_string)
         article_obj = Paper(crossref_source_obj, article_uri)
-        article_obj.set_doi(doi_string)
+        article_obj.set_doi(article_uri)
         article_obj.set_created(datetime.now().isoformat())
-        if "titles" in article:
+        titles = []
+        citation_count = None
+        if "title" in article:
             titles = article["title"]
             for title in titles:
                 title_str = title
@@ -191,7 +331,9 @@ def process_crossref_article_to_obj(article) -> Paper | None:
                     funder_obj.set_label(funder_name)
                     if "DOI" in funder:
                         funder_doi = funder["DOI"]
-                        funder_id = UniqueIdentifier(crossref_source_obj, funder_doi)
+                        if "http://" not in funder_doi:
+                            funder_doi = DOI + funder_doi
+                        funder_id = UniqueIdentifier(crossref_source_obj, URIRef(funder_doi))
                         funder_obj.add_identifier(funder_id)
                     article_obj.add_related(funder_obj)
 
@@ -208,7 +350,7 @@ def process_crossref_article_to_obj(article) -> Paper | None:
             for author in article['author']:
                 add_authors_to_article(author, article_obj)
 
-        logging.info(f"Processing article {doi_string} with title {titles} and citation count {citation_count}")
+        logging.debug('Processing article %s with title %s and citation count %s', doi_string, titles, citation_count)
         return article_obj
 
 
@@ -251,9 +393,10 @@ def crossref_datepart_to_datetime(datepart: list[int]) -> datetime | None:
 def write_crossref_graph():
     if len(g_c_papers) > 0:
         logging.info(f"Writing {len(g_c_papers)} papers to {g_c_papers_filename}")
-        g_c_papers.serialize(destination=g_c_papers_filename, format="turtle")
+        write_source_graph(g_c_papers, g_c_papers_filename)
 
 def process_crossref():
     logging.info("Processing Crossref")
-    process_top_articles_by_domains(topics, limit=10, nb_years=5)
+    topic_limit = os.getenv('crossref_topic_limit', '10')
+    process_top_articles_by_domains(topics, limit=int(topic_limit) if topic_limit != '' else None, nb_years=5)
     write_crossref_graph()
\ No newline at end of file
@@ -1,90 +1,86 @@
 from datetime import datetime
 import logging
-from rdflib import  URIRef, Variable
-from rdflib.plugins.sparql import prepareQuery
-from rdflib.plugins.sparql.results.jsonresults import JSONResultParser, JSONResultSerializer
-from rdflib.query import Result, ResultRow
+import os
+from rdflib import  URIRef
 
 from kg.knowledge import CitationCount, UniqueIdentifier, Source, Paper
-from util.utilities import sparql_cached
+from dblp_source.dblp_dump import dblp_dump_most_cited_articles
+from opencitations_source.opencitations import load_citation_counter, normalize_doi, normalize_omid, opencitations_source_obj
+from util.sparql_client import SparqlClient, SparqlResult
 
-logging.basicConfig(filename='app.log', level=logging.INFO)
+dblp_sparql_endpoint = "https://sparql.dblp.org/sparql"
+dblp_source_obj = Source(URIRef(dblp_sparql_endpoint))
+# The endpoint can be replaced by a local stand-in such as mock_server.sparql_endpoint
+dblp_sparql_client = SparqlClient(os.getenv('dblp_sparql_endpoint', dblp_sparql_endpoint))
 
-dblp_source_obj = Source(URIRef("https://sparql.dblp.org/sparql"))
-
-def get_article_per_year_sparql_result(publication_year: int, limit: int = 1000, offset: int = 0) -> Result:
+def get_article_per_year_sparql_result(publication_year: int, limit: int = 1000, offset: int = 0) -> SparqlResult:
     dblp_article_per_year_query = f"""
     ## Most cited publications
     PREFIX dblp: <https://dblp.org/rdf/schema#>
     PREFIX cito: <http://purl.org/spar/cito/>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
     PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX owl: <http://www.w3.org/2002/07/owl#>
-    SELECT ?publ ?title ?doi ?cites {{
-        SERVICE <https://sparql.dblp.org/sparql> {{
-            {{
-                SELECT ?publ ?title (COUNT(?citation) as ?cites) ?doi WHERE {{
-                    ?publ rdf:type dblp:Publication .
-                    ?publ dblp:title ?title .
-                    ?publ dblp:yearOfPublication "{str(publication_year)}"^^<http://www.w3.org/2001/XMLSchema#gYear> .
-                    ?publ dblp:omid ?omid .
-                    ?citation rdf:type cito:Citation .
-                    ?citation cito:hasCitedEntity ?omid .
-                    OPTIONAL {{
-                        ?publ dblp:doi ?doi .
-                    }}
-                }}
-                GROUP BY ?publ ?title ?doi 
-                ORDER BY DESC(?cites)
-                LIMIT {limit}
-                OFFSET {offset}
-            }}
+    SELECT ?publ ?title (COUNT(?citation) as ?cites) ?doi WHERE {{
+        ?publ rdf:type dblp:Publication .
+        ?publ dblp:title ?title .
+        ?publ dblp:yearOfPublication "{str(publication_year)}"^^<http://www.w3.org/2001/XMLSchema#gYear> .
+        ?publ dblp:omid ?omid .
+        ?citation rdf:type cito:Citation .
+        ?citation cito:hasCitedEntity ?omid .
+        OPTIONAL {{
+            ?publ dblp:doi ?doi .
         }}
     }}
+    GROUP BY ?publ ?title ?doi
+    ORDER BY DESC(?cites)
+    LIMIT {limit}
+    OFFSET {offset}
     """
     logging.debug(dblp_article_per_year_query)
-    return sparql_cached(dblp_article_per_year_query)
+    return dblp_sparql_client.select(dblp_article_per_year_query)
+
+# Publications of a year with their omid, without the citation aggregation, for the citations to be counted locally.
+# The rows are sent by pages of page_size.
+def get_publication_per_year_sparql_result(publication_year: int, page_size: int = 10000):
+    dblp_publication_per_year_query = f"""
+    PREFIX dblp: <https://dblp.org/rdf/schema#>
+    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+    SELECT ?publ ?title ?doi ?omid WHERE {{
+        ?publ rdf:type dblp:Publication .
+        ?publ dblp:title ?title .
+        ?publ dblp:yearOfPublication "{str(publication_year)}"^^<http://www.w3.org/2001/XMLSchema#gYear> .
+        ?publ dblp:omid ?omid .
+        OPTIONAL {{
+            ?publ dblp:doi ?doi .
+        }}
+    }}
+    ORDER BY ?publ
+    """
+    logging.debug(dblp_publication_per_year_query)
+    return dblp_sparql_client.select_pages(dblp_publication_per_year_query, page_size=page_size)
 
-def get_article_same_as_sparql_result(article_list: list[Paper]) -> Result:
+def get_article_same_as_sparql_result(article_list: list[Paper]) -> SparqlResult:
     value_list = ""
     for articl_obj in article_list:
         value_list += '<' + articl_obj.uri + '> '
     dblp_article_sameAs_query = f"""
     PREFIX owl: <http://www.w3.org/2002/07/owl#>
-    SELECT ?paper ?sameAs {{
-        SERVICE <https://sparql.dblp.org/sparql> {{
-            {{
-                SELECT DISTINCT ?paper ?sameAs WHERE {{
-                    ?paper owl:sameAs ?sameAs .
-                    VALUES ?paper {{ { value_list }}}
-                }}
-                LIMIT 1000
-            }}
-        }}
+    SELECT DISTINCT ?paper ?sameAs WHERE {{
+        ?paper owl:sameAs ?sameAs .
+        VALUES ?paper {{ { value_list }}}
     }}
+    LIMIT 1000
     """
     logging.debug(dblp_article_sameAs_query)
-    return sparql_cached(dblp_article_sameAs_query)
+    return dblp_sparql_client.select(dblp_article_sameAs_query)
 
 def get_article_same_as(papers: dict[URIRef, Paper]) -> set[Paper]:
-    sameas_variable = Variable("sameAs")
-    paper_variable = Variable("paper")
     paper_list = list(set(papers.values()))
     split_papers = [paper_list[i:i + 5] for i in range(0, len(paper_list), 5)] # split paper set into chunks of 5
     for paper_chunk in split_papers:
-        paper_sameas_result = get_article_same_as_sparql_result(paper_chunk)
-        for binding in paper_sameas_result.bindings:
-            if paper_sameas_result.vars is None:
-                logging.info("No results found")
-                continue
-            paper_uri = None
-            paper_identifier = None
-            for variable in paper_sameas_result.vars:
-                if variable == paper_variable:
-                    paper_uri = binding[paper_variable]
-                if variable == sameas_variable:
-                    paper_identifier = UniqueIdentifier(dblp_source_obj, URIRef(binding[sameas_variable]))
-            if paper_uri != None and paper_identifier != None:
+        for binding in get_article_same_as_sparql_result(paper_chunk):
+            paper_uri = binding.get("paper")
+            if paper_uri != None and "sameAs" in binding and paper_uri in papers:
+                paper_identifier = UniqueIdentifier(dblp_source_obj, URIRef(binding["sameAs"]))
                 papers[paper_uri].add_identifier(paper_identifier) # type: ignore
     return set(papers.values())
 
@@ -92,51 +88,67 @@ def get_article_same_as(papers: dict[URIRef, Paper]) -> set[Paper]:
 
 def get_article_per_year(year: int, limit: int, offset=0)-> set[Paper]:
     result_dict: dict[URIRef, Paper] = {}
-    sparql_results: Result = get_article_per_year_sparql_result(publication_year=year, limit=limit, offset=offset)
-    publ_variable = Variable("publ")
-    title_variable = Variable("title")
-    cites_variable = Variable("cites")
-    doi_variable = Variable("doi")
-
-    logging.debug(f"{len(sparql_results.bindings)} articles found.")
-
-    for binding in sparql_results.bindings:
-        if sparql_results.vars is None:
-            logging.info("No results found")
+    num_articles = 0
+    for binding in get_article_per_year_sparql_result(publication_year=year, limit=limit, offset=offset):
+        num_articles += 1
+        if "publ" not in binding or "title" not in binding or "cites" not in binding:
             continue
-        paper_uri = None
-        paper_title = None
-        paper_cites = None
-        paper_doi = None
-        for variable in sparql_results.vars:
-            if variable == publ_variable:
-                paper_uri = URIRef(binding[variable])
-            elif variable == title_variable:
-                paper_title = binding[variable]
-            elif variable == cites_variable:
-                paper_cites = int(binding[variable])
-            elif variable == doi_variable and doi_variable in binding:
-                paper_doi = binding[variable]
-        if paper_uri is None or paper_title is None or paper_cites is None:
-            pass
+        paper_uri = URIRef(binding["publ"])
+        paper_cites = int(binding["cites"])
+        article_citation_count = CitationCount(source=dblp_source_obj,count=paper_cites)
+        if paper_uri not in result_dict:
+            article_obj = Paper(dblp_source_obj, paper_uri)
+            article_obj.set_title(binding["title"])
+            article_obj.add_citation_count(article_citation_count)
+            if "doi" in binding:
+                article_obj.set_doi(URIRef(binding["doi"]))
+            result_dict[paper_uri] = article_obj
         else:
-            article_citation_count = CitationCount(source=dblp_source_obj,count=paper_cites)
-            if paper_uri not in result_dict:
-                article_obj = Paper(dblp_source_obj, URIRef(paper_uri))
-                article_obj.set_title(paper_title)
-                article_citation_count = CitationCount(source=dblp_source_obj,count=paper_cites)
-                article_citation_count = article_citation_count
-                article_obj.add_citation_count(article_citation_count)
-                if paper_doi != None:
-                    article_obj.set_doi(URIRef(paper_doi))
-                result_dict[paper_uri] = article_obj
-            else:
-                result_dict[paper_uri].add_citation_count(article_citation_count)
+            result_dict[paper_uri].add_citation_count(article_citation_count)
+    logging.debug('%d articles found.', num_articles)
 
     result = get_article_same_as(result_dict)
     return result
 
+# Most cited articles of each year, with the citations counted in an OpenCitations dump instead of the aggregation query of the DBLP SPARQL endpoint
+def get_article_per_year_local_counts(start_year: int, limit: int, opencitations_dump: str) -> set[Paper]:
+    current_year = datetime.now().year
+    publications: dict[str, tuple[str, str, str | None, int]] = {}
+    for year in range(start_year, current_year + 1):
+        for binding in get_publication_per_year_sparql_result(publication_year=year):
+            paper_doi = binding.get("doi")
+            publications[str(binding["publ"])] = (str(binding["title"]), str(binding["omid"]), str(paper_doi) if paper_doi != None else None, year)
+    logging.info(f"{len(publications)} DBLP publications from {start_year} to {current_year}")
+
+    publication_keys = set()
+    for _, paper_omid, paper_doi, _ in publications.values():
+        publication_keys.add(normalize_omid(paper_omid))
+        if paper_doi != None:
+            publication_keys.add(normalize_doi(paper_doi))
+    citation_counter = load_citation_counter(opencitations_dump, only=publication_keys)
+
+    result_dict: dict[URIRef, Paper] = {}
+    top_per_year = citation_counter.top_per_year(((paper_uri, paper_omid, paper_doi, year) for paper_uri, (_, paper_omid, paper_doi, year) in publications.items()), limit)
+    for year_articles in top_per_year.values():
+        for paper_uri, paper_cites in year_articles:
+            paper_title, _, paper_doi, _ = publications[paper_uri]
+            article_obj = Paper(dblp_source_obj, URIRef(paper_uri))
+            article_obj.set_title(paper_title)
+            article_obj.add_citation_count(CitationCount(source=opencitations_source_obj, count=paper_cites))
+            if paper_doi != None:
+                article_obj.set_doi(URIRef(paper_doi))
+            result_dict[URIRef(paper_uri)] = article_obj
+    return get_article_same_as(result_dict)
+
+# The articles are read from the local dump given by the dblp_dump variable if it is set, instead of the DBLP SPARQL endpoint.
+# The citations are counted in the OpenCitations dump given by the opencitations_dump variable if it is set.
 def dblp_most_cited_articles(start_year:int, sparql_limit = 1000) -> set[Paper]:
+    dump_filename = os.getenv('dblp_dump')
+    opencitations_dump = os.getenv('opencitations_dump') or None
+    if dump_filename != None and dump_filename != '':
+        return dblp_dump_most_cited_articles(dump_filename, start_year=start_year, limit=sparql_limit, opencitations_dump=opencitations_dump)
+    if opencitations_dump != None:
+        return get_article_per_year_local_counts(start_year, sparql_limit, opencitations_dump)
     current_year = datetime.now().year
     dblp_results: set[Paper] = get_article_per_year(year=start_year, limit=sparql_limit)
     for inter_year in range(start_year+1, current_year+1):
@@ -0,0 +1,212 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from html.entities import name2codepoint
+import heapq
+import logging
+import re
+import xml.etree.ElementTree as ET
+
+from rdflib import OWL, URIRef
+
+from kg.CONSTANTS import CITO, DBLP, DOI
+from kg.knowledge import CitationCount, UniqueIdentifier, Source, Paper
+from opencitations_source.opencitations import load_citation_counter, normalize_doi, normalize_omid
+from util.files import open_binary_file
+from util.ntriples import iri_value, is_iri, iter_ntriples_file, literal_value, term_value
+
+# Offline backend of dblp_source.dblp, reading a local DBLP dump instead of querying the DBLP SPARQL endpoint.
+# The dump is either the XML dump (dblp.xml.gz) or the RDF N-Triples dump (dblp.nt.gz), both read as a stream.
+dblp_xml_dump_source_obj = Source(URIRef("https://dblp.org/xml/dblp.xml.gz"))
+dblp_rdf_dump_source_obj = Source(URIRef("https://dblp.org/rdf/dblp.nt.gz"))
+dblp_record_ns = "https://dblp.org/rec/"
+
+dblp_year_predicate = f'<{DBLP.yearOfPublication}>'
+dblp_title_predicate = f'<{DBLP.title}>'
+dblp_doi_predicate = f'<{DBLP.doi}>'
+dblp_omid_predicate = f'<{DBLP.omid}>'
+owl_same_as_predicate = f'<{OWL.sameAs}>'
+cito_cited_entity_predicate = f'<{CITO.hasCitedEntity}>'
+
+# Publication elements of the XML dump, the www elements are the person pages
+dblp_xml_record_tags = { 'article', 'inproceedings', 'proceedings', 'book', 'incollection', 'phdthesis', 'mastersthesis', 'data' }
+dblp_xml_chunk_size = 1 << 20
+xml_entity_regex = re.compile(rb'&([A-Za-z][A-Za-z0-9]*);')
+xml_predefined_entities = { b'amp', b'lt', b'gt', b'quot', b'apos' }
+
+@dataclass(slots=True)
+class DblpPublication:
+    uri: str
+    year: int
+    title: str | None = None
+    doi: str | None = None
+    omid: str | None = None
+    same_as: list[str] = field(default_factory=list)
+    citations: int = 0
+
+# Publications of a dump, indexed by year
+class DblpDumpIndex:
+    def __init__(self, source: Source):
+        self.source = source
+        self.publications: dict[str, DblpPublication] = {}
+        self.by_year: dict[int, list[DblpPublication]] = {}
+
+    def add(self, publication: DblpPublication):
+        self.publications[publication.uri] = publication
+        self.by_year.setdefault(publication.year, []).append(publication)
+
+    # Most cited publications of a year, as ordered by the DBLP SPARQL query: publications without title or citation are left out
+    def most_cited(self, year: int, limit: int, offset: int = 0) -> list[DblpPublication]:
+        candidates = (publication for publication in self.by_year.get(year, []) if publication.title != None and publication.citations > 0)
+        return heapq.nlargest(offset + limit, candidates, key=lambda publication: (publication.citations, publication.uri))[offset:]
+
+    # Counts the citations of the publications in an OpenCitations dump, keeping only the counters of the indexed publications
+    def count_citations(self, opencitations_dump: str):
+        publication_keys = set()
+        for publication in self.publications.values():
+            if publication.omid != None:
+                publication_keys.add(normalize_omid(publication.omid))
+            if publication.doi != None:
+                publication_keys.add(normalize_doi(publication.doi))
+        citation_counter = load_citation_counter(opencitations_dump, only=publication_keys)
+        for publication in self.publications.values():
+            publication.citations = citation_counter.count_publication(omid=publication.omid, doi=publication.doi)
+
+    def to_paper(self, publication: DblpPublication) -> Paper:
+        article_obj = Paper(self.source, URIRef(publication.uri))
+        article_obj.set_title(publication.title) # type: ignore
+        article_obj.add_citation_count(CitationCount(source=self.source, count=publication.citations))
+        if publication.doi != None:
+            article_obj.set_doi(URIRef(publication.doi))
+        for same_as in publication.same_as:
+            article_obj.add_identifier(UniqueIdentifier(self.source, URIRef(same_as)))
+        return article_obj
+
+# N-Triples dump
+# The triples of a publication are not guaranteed to be contiguous, so the dump is read in three passes, each one keeping only what the next one needs:
+# the publications of the selected years, then their title, DOI, omid and sameAs, then the citations of their omid, unless they are counted from an OpenCitations dump.
+def load_dblp_ntriples_index(dump_filename: str, start_year: int, end_year: int, count_citations: bool = True) -> DblpDumpIndex:
+    index = DblpDumpIndex(dblp_rdf_dump_source_obj)
+    # Only the publications have a year of publication
+    for subject, _, year_term in iter_ntriples_file(dump_filename, { dblp_year_predicate }):
+        year = int(literal_value(year_term))
+        if start_year <= year <= end_year and is_iri(subject):
+            index.add(DblpPublication(uri=iri_value(subject), year=year))
+    logging.info(f'{len(index.publications)} DBLP publications from {start_year} to {end_year} in {dump_filename}')
+
+    publications_by_omid: dict[str, DblpPublication] = {}
+    for subject, predicate, object in iter_ntriples_file(dump_filename, { dblp_title_predicate, dblp_doi_predicate, dblp_omid_predicate, owl_same_as_predicate }):
+        publication = index.publications.get(iri_value(subject))
+        if publication is None:
+            continue
+        if predicate == dblp_title_predicate:
+            publication.title = term_value(object)
+        elif predicate == dblp_doi_predicate:
+            publication.doi = term_value(object)
+        elif predicate == dblp_omid_predicate:
+            publication.omid = term_value(object)
+            publications_by_omid[object] = publication
+        else:
+            publication.same_as.append(term_value(object))
+
+    if not count_citations:
+        return index
+    for _, _, cited_entity in iter_ntriples_file(dump_filename, { cito_cited_entity_predicate }):
+        publication = publications_by_omid.get(cited_entity)
+        if publication != None:
+            publication.citations += 1
+    return index
+
+# XML dump
+# The dump uses the character entities of dblp.dtd, they are replaced by character references before parsing so that the DTD is not needed.
+def replace_xml_entities(text: bytes) -> bytes:
+    def replace_entity(match: re.Match) -> bytes:
+        name = match.group(1)
+        if name in xml_predefined_entities:
+            return match.group(0)
+        codepoint = name2codepoint.get(name.decode('ascii'))
+        if codepoint is None:
+            return b''
+        return b'&#%d;' % codepoint
+    return xml_entity_regex.sub(replace_entity, text)
+
+# Yields the publication elements of the XML dump one at a time, each element being cleared once the next one is read
+def iter_dblp_xml_records(dump_filename: str, chunk_size: int = dblp_xml_chunk_size):
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+    remainder = b''
+    dump_file = open_binary_file(dump_filename)
+    try:
+        while True:
+            chunk = dump_file.read(chunk_size)
+            text = remainder + chunk
+            remainder = b''
+            # An entity cut by the end of the chunk is kept for the next one
+            ampersand_index = text.rfind(b'&')
+            if chunk and ampersand_index != -1 and b';' not in text[ampersand_index:]:
+                remainder = text[ampersand_index:]
+                text = text[:ampersand_index]
+            parser.feed(replace_xml_entities(text))
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = element
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    if element.tag in dblp_xml_record_tags:
+                        yield element
+                    root.clear() # type: ignore
+            if not chunk:
+                break
+        parser.close()
+    finally:
+        dump_file.close()
+
+def dblp_xml_publication(element: ET.Element) -> DblpPublication | None:
+    year_string = element.findtext('year')
+    key = element.get('key')
+    if year_string is None or key is None:
+        return None
+    publication = DblpPublication(uri=dblp_record_ns + key, year=int(year_string))
+    title_element = element.find('title')
+    if title_element != None:
+        publication.title = ''.join(title_element.itertext()).strip()
+    for electronic_edition in element.findall('ee'):
+        if electronic_edition.text != None and electronic_edition.text.startswith(str(DOI)):
+            publication.doi = electronic_edition.text
+            break
+    return publication
+
+def load_dblp_xml_index(dump_filename: str, start_year: int, end_year: int) -> DblpDumpIndex:
+    index = DblpDumpIndex(dblp_xml_dump_source_obj)
+    for element in iter_dblp_xml_records(dump_filename):
+        publication = dblp_xml_publication(element)
+        if publication is None or not (start_year <= publication.year <= end_year):
+            continue
+        index.add(publication)
+    logging.info(f'{len(index.publications)} DBLP publications from {start_year} to {end_year} in {dump_filename}')
+    return index
+
+# The citations are counted from the OpenCitations dump if one is given, which is the only source of citations for the XML dump
+def load_dblp_dump_index(dump_filename: str, start_year: int, end_year: int, opencitations_dump: str | None = None) -> DblpDumpIndex:
+    if '.xml' in dump_filename:
+        index = load_dblp_xml_index(dump_filename, start_year, end_year)
+        if opencitations_dump is None:
+            logging.warning(f'No OpenCitations dump given for the DBLP XML dump {dump_filename}, no publication will be selected')
+    else:
+        index = load_dblp_ntriples_index(dump_filename, start_year, end_year, count_citations=opencitations_dump is None)
+    if opencitations_dump != None:
+        index.count_citations(opencitations_dump)
+    return index
+
+# Same result as dblp_most_cited_articles, from a local dump
+def dblp_dump_most_cited_articles(dump_filename: str, start_year: int, limit: int = 1000, opencitations_dump: str | None = None) -> set[Paper]:
+    current_year = datetime.now().year
+    index = load_dblp_dump_index(dump_filename, start_year, current_year, opencitations_dump)
+    dblp_results: set[Paper] = set()
+    for year in range(start_year, current_year + 1):
+        for publication in index.most_cited(year, limit):
+            dblp_results.add(index.to_paper(publication))
+    return dblp_results
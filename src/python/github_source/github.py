@@ -1,40 +1,90 @@
 from rdflib import Graph, Literal, BNode, URIRef
-from rdflib.plugins.sparql import prepareQuery
 from rdflib.namespace import RDF, RDFS, DCTERMS, FOAF
-from rdflib.query import Result, ResultRow
-from github import Github
+from github.GithubException import GithubException
+from github_source.scheduler import GithubSearchResult, GithubSearchScheduler, SingleFlightTable, github_api_url
 from kg.knowledge import UniqueIdentifier, Organization, Person, Source
-from util.utilities import create_uri, json_encode_paginated_list
+from kg.person_names import iter_person_names
+from util.utilities import create_uri, json_dump_paginated_list
+from util.dataset import write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.progress import ProgressReporter
+from util.cache import cache_filepath, cache_stats, read_cached_json, request_fingerprint, write_cached_json
 from kg.CONSTANTS import ADMS, PAV , LOCAL
 import os
 import json
 import datetime
-import hashlib
+import re
+import unicodedata
 import logging
 
 # Limits
-# # Limit the number of results from github when looking for the ids of one person. Above this limit, the results are not added to the graph
-if os.getenv('github_user_results_limit') is None:
-    logging.error('No limit set for github results')
-    github_user_results_limit = 100 
-else:
-    github_user_results_limit = int(os.getenv('github_user_results_limit')) # type: ignore
-
-g_gh_Software = Graph()
+# # Limit the number of results from github when looking for the ids of one person. Above this limit, the results are not added to the graph.
+# The limit is read when the GitHub source is run, once the .env variables are loaded
+def get_github_user_results_limit() -> int:
+    if os.getenv('github_user_results_limit') is None:
+        logging.error('No limit set for github results')
+        return 100
+    return int(os.getenv('github_user_results_limit')) # type: ignore
+
+g_gh_Software = memory_budget.register('github_Software', LazyGraph())
 g_gh_software_filename = 'data/rdf/software/github_Software.ttl'
-g_gh_Person = Graph()
+g_gh_Person = memory_budget.register('github_Person', LazyGraph())
 g_gh_person_filename = 'data/rdf/person/github_Person.ttl'
-g_gh_Organization = Graph()
+g_gh_Organization = memory_budget.register('github_Organization', LazyGraph())
 g_gh_organization_filename = 'data/rdf/organization/github_Organization.ttl'
 
 
+# Tokens used in round-robin by the search scheduler, from the comma-separated github_tokens variable or the single github_token
+def get_github_tokens() -> list[str | None]:
+    github_tokens = os.getenv('github_tokens')
+    if github_tokens is not None and github_tokens.strip() != '':
+        return [ token.strip() for token in github_tokens.split(',') if token.strip() != '' ]
+    return [ os.getenv('github_token') ]
+
+# URIs of the people that are contributors of a paper or creators of a software in the existing graphs, and of their identifiers
+def load_linked_person_uris() -> set:
+    g_linked = Graph()
+    for directory in ['data/rdf/paper/', 'data/rdf/article/', 'data/rdf/software/']:
+        if not os.path.exists(directory):
+            continue
+        for file in os.listdir(directory):
+            if file.endswith('.ttl'):
+                g_linked.parse(directory + file, format='turtle')
+    linked_person_uris = set()
+    for predicate in [DCTERMS.contributor, DCTERMS.creator]:
+        for person in g_linked.objects(None, predicate):
+            linked_person_uris.add(person)
+            for identifier in g_linked.objects(person, ADMS.identifier):
+                linked_person_uris.add(identifier)
+    g_linked.close()
+    return linked_person_uris
+
+# Canonical form of the search query for a person: the names are normalized (case, spacing, word order) and deduplicated, the longest ones are kept, then sorted.
+# People whose names only differ by order, case or spacing get the same query, and thus the same cache entry.
+def canonical_person_query(person_names: list[str], max_terms: int = 5, max_query_length: int = 256) -> str:
+    terms = set()
+    for name in person_names:
+        term = unicodedata.normalize('NFKC', str(name)).casefold()
+        term = re.sub(r'["\\]', ' ', term)
+        # GitHub matches the words of a term in any order, so the order of the words is normalized too
+        term = " ".join(sorted(term.split()))
+        if term != '':
+            terms.add(term)
+    selected_terms = sorted(sorted(terms, key=lambda term: (-len(term), term))[:max_terms])
+    # Terms are removed, longest first, rather than cut in the middle when the query is too long
+    while len(" OR ".join(selected_terms)) > max_query_length and len(selected_terms) > 1:
+        selected_terms.remove(max(selected_terms, key=lambda term: (len(term), term)))
+    return " OR ".join(selected_terms)[:max_query_length]
+
 def process_github():
     max_query_length = 256
+    github_user_results_limit = get_github_user_results_limit()
 
 
     # Connect to the Github API
-    github_token = os.getenv('github_token')
-    g = Github(github_token)
+    scheduler = GithubSearchScheduler(get_github_tokens(), base_url=os.getenv('github_base_url', github_api_url))
+    g = scheduler.client()
     # enable_console_debug_logging() # Enable debug logging
     logging.info(f'Connected to Github as {g.get_user().login}')
 
@@ -47,97 +97,91 @@ def process_github():
             if file.endswith('.ttl'):
                 g_known_person.parse('data/rdf/person/' + file, format='turtle')
         logging.info(f'Loaded {len(g_known_person)} triples about people from the graph')
+        # People linked to papers or software are searched first
+        linked_person_uris = load_linked_person_uris()
+        logging.info(f'{len(linked_person_uris)} people linked to papers or software')
+        search_flights = SingleFlightTable()
+        progress = ProgressReporter('github_users')
 
         def search_for_person(current_person_uri, person_names: list[str]):
             # Search for the person in Github
-            person_query_string_list = [ f'{x}' for x in person_names ]
-            person_query_string_list = sorted(person_query_string_list, key=len, reverse=True)[:5]
-            person_query = " OR ".join(person_query_string_list)
-            if(len(person_query) > max_query_length):
-                person_query = person_query[:max_query_length - 1]
-            user_results_json_filename = 'data/github/' + hashlib.md5(person_query.encode()).hexdigest() + '.json'
-            user_results = None
-            if not os.path.exists(user_results_json_filename):
-                user_results = g.search_users(person_query)
-                user_results_json = ""
-                logging.info(f'Found {user_results.totalCount} users for {person_query}')
-                if(user_results.totalCount > github_user_results_limit):
-                    user_results = []
-                    user_results_json = json.JSONEncoder().encode(user_results)
-                else:
-                    user_results_json = json_encode_paginated_list(user_results)
-                user_results_json_file = open(user_results_json_filename, 'w')
-                user_results_json_file.write(user_results_json)
-                user_results_json_file.close()
+            person_query = canonical_person_query(person_names, max_query_length=max_query_length)
+            if person_query == '':
+                return
+            user_results_json_filename = cache_filepath('data/github/', request_fingerprint('GET', f'{github_api_url}/search/users', {'q': person_query}))
+            priority = 0 if current_person_uri in linked_person_uris else 1
+            if not search_flights.join(person_query, current_person_uri):
+                # The same search is already scheduled for another person, its results will be shared
+                scheduler.raise_priority(search_flights.get_request(person_query), priority)
+                return
+            user_results = read_cached_json('github', user_results_json_filename)
+            if user_results == None:
+                # The search is sent later by the scheduler, within the search quota. If it is abandoned, the search is removed from the table
+                # so that the people waiting for it are released and a later request sends it again.
+                request = scheduler.submit(person_query, lambda result: store_search_result(result, user_results_json_filename), priority=priority,
+                                           failure_callback=lambda: search_flights.complete(person_query))
+                search_flights.set_request(person_query, request)
             else:
-                user_results_json_file = open(user_results_json_filename, 'r')
-                user_results_json = user_results_json_file.read()
-                user_results_json_file.close()
-            user_results = json.JSONDecoder().decode(user_results_json)
+                add_users_to_graph(user_results, search_flights.complete(person_query))
 
-            gh_source_obj = Source.Builder(URIRef('https://github.com')).build()
+        def store_search_result(search_result: GithubSearchResult, user_results_json_filename: str):
+            logging.info('Found %d users for %s', search_result.total_count, search_result.query)
+            person_uris = search_flights.complete(search_result.query)
+            if(search_result.total_count > github_user_results_limit):
+                # Too many homonyms, the results are discarded before fetching any other page
+                write_cached_json('github', user_results_json_filename, [])
+                return
+            # The users are written to the cache as the pages arrive, the pages after the limit are never fetched.
+            # A page that can not be fetched leaves the search uncached, it is sent again by the next run.
+            try:
+                json_dump_paginated_list(search_result.paginated_list, user_results_json_filename, limit=github_user_results_limit, first_page=search_result.first_page, fetch_page=lambda page: scheduler.fetch_page(search_result, page))
+            except GithubException as e:
+                logging.error('GitHub search results of %s incomplete: %s', search_result.query, e)
+                return
+            cache_stats.record_write('github', os.path.getsize(user_results_json_filename))
+            user_results_json_file = open(user_results_json_filename, 'r')
+            add_users_to_graph(json.load(user_results_json_file), person_uris)
+            user_results_json_file.close()
+
+        # Adds the users found by a search to the graph, as candidate accounts of each person that requested the search
+        def add_users_to_graph(user_results, person_uris: list):
+            gh_source_obj = Source(URIRef('https://github.com'))
             for user in user_results:
                 user_github_id_uri = create_uri(user['url'])
-                gh_person_obj_builder = Person.Builder(gh_source_obj, user_github_id_uri)
-                gh_person_id = UniqueIdentifier.Builder(gh_source_obj, user_github_id_uri).build()
-                logging.info(f'Adding user {user["login"]} to the graph')
-                gh_person_obj_builder.add_identifier(gh_person_id)
-                gh_person_obj_builder.add_alternative(user['login'])
-                if(user['name'] != None):
-                    gh_person_obj_builder.set_label(user['name'])
-                if(user['blog'] != None):
-                    gh_person_obj_builder.add_contact(Literal(user['blog']))
-                if(user['email'] != None):
-                    gh_person_obj_builder.add_contact(Literal(user['email']))
-                if(user['bio'] != None):
-                    gh_person_obj_builder.add_comment(user['bio'])
-                if(user['company'] != None):
-                    user_company_node = BNode()
-                    user_org_obj_builder = Organization.Builder(gh_source_obj, user_company_node)
-                    user_org_obj_builder.set_label(user['company'])
-                    gh_person_obj_builder.add_affiliation(user_org_obj_builder.build())
-                if(user['location'] != None):
-                    gh_person_obj_builder.add_location(Literal(user['location']))
-                gh_person_obj = gh_person_obj_builder.build()
+                for person_uri in person_uris:
+                    g_gh_Person.add((person_uri, RDFS.seeAlso, user_github_id_uri))
+                gh_person_obj = Person(gh_source_obj, user_github_id_uri)
+                gh_person_id = UniqueIdentifier(gh_source_obj, user_github_id_uri)
+                logging.debug('Adding user %s to the graph', user['login'])
+                gh_person_obj.add_identifier(gh_person_id)
+                gh_person_obj.add_alternative(user['login'])
+                if(user.get('name') != None):
+                    gh_person_obj.set_label(user['name'])
+                if(user.get('blog') != None):
+                    gh_person_obj.add_contact(Literal(user['blog']))
+                if(user.get('email') != None):
+                    gh_person_obj.add_contact(Literal(user['email']))
+                if(user.get('bio') != None):
+                    gh_person_obj.add_comment(user['bio'])
+                if(user.get('company') != None):
+                    user_org_obj = Organization(gh_source_obj)
+                    user_org_obj.set_label(user['company'])
+                    gh_person_obj.add_affiliation(user_org_obj)
+                if(user.get('location') != None):
+                    gh_person_obj.add_location(Literal(user['location']))
                 gh_person_obj.to_rdf(g_gh_Person)
+                progress.update()
+            memory_budget.check(g_gh_Person)
 
-        # Retrieve the list of users from the graph
-        query = prepareQuery('''
-            SELECT DISTINCT ?person ?name
-            WHERE {
-                ?person a foaf:Person .
-                { ?person foaf:firstName ?first ;
-                                foaf:lastName ?last .
-                    BIND( CONCAT(CONCAT(?first, " "), ?last) AS ?name )
-                }
-            } ORDER BY DESC(?name)
-        ''', initNs={'foaf': FOAF})
-        current_person_uri = None
-        current_person_names = []
-
-        iterator = iter(g_known_person.query(query))
-        # Iterate over the results
-        while True:
-            try:
-                row = next(iterator)
-                if isinstance(row, ResultRow):
-                    if(current_person_uri == None):
-                        current_person_uri = row.person
-                        current_person_names.append(row.name)
-                    if(current_person_uri != row.person or current_person_uri == None):
-                        if(len(current_person_names) > 0):
-                            # We have a person with at least some known names
-                            # prepare the query to the Github API
-                            search_for_person(current_person_uri, current_person_names)
-                        current_person_uri = row.person
-                        current_person_names = []
-                        current_person_names.append(row.name)
-                    else:
-                        current_person_names.append(row.name)
-            except StopIteration:
-                if(len(current_person_names) > 0):
-                    search_for_person(current_person_uri, current_person_names)
-                break
+        # Retrieve the list of users from the graph, person by person
+        for current_person_uri, current_person_names in iter_person_names(g_known_person):
+            # We have a person with at least some known names
+            # prepare the query to the Github API
+            search_for_person(current_person_uri, current_person_names)
+
+        logging.info(f'{scheduler.pending()} GitHub searches scheduled')
+        scheduler.run()
+        progress.close()
 
     process_github_person()
 
@@ -145,16 +189,16 @@ def process_github():
 def write_github_graph():
     if len(g_gh_Person) > 0:
         logging.info(f"Writing github person graph to file, {len(g_gh_Person)} triples")
-        g_gh_Person.serialize(destination=g_gh_person_filename, format='turtle')
+        write_source_graph(g_gh_Person, g_gh_person_filename)
         logging.info("Github person graph written to file")
     g_gh_Person.close()
     if len(g_gh_Software) > 0:
         logging.info(f"Writing github software graph to file, {len(g_gh_Software)} triples")
-        g_gh_Software.serialize(destination=g_gh_software_filename, format='turtle')
+        write_source_graph(g_gh_Software, g_gh_software_filename)
         logging.info("Github software graph written to file")
     g_gh_Software.close()
     if len(g_gh_Organization) > 0:
         logging.info(f"Writing github organization graph to file, {len(g_gh_Organization)} triples")
-        g_gh_Organization.serialize(destination=g_gh_organization_filename, format='turtle')
+        write_source_graph(g_gh_Organization, g_gh_organization_filename)
         logging.info("Github organization graph written to file")
     g_gh_Organization.close()
\ No newline at end of file
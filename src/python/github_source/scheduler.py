@@ -0,0 +1,218 @@
+from github import Github, Auth
+from github.GithubException import GithubException, RateLimitExceededException
+from dataclasses import dataclass, field
+from typing import Any, Callable
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from util.metrics import metrics
+from util.pipeline import check_cancelled
+
+github_api_url = 'https://api.github.com'
+# Quota of the GitHub search API for authenticated requests, used until the first response gives the actual one
+default_search_requests_per_minute = 30
+
+@dataclass
+class GithubSearchResult:
+    query: str
+    total_count: int
+    first_page: list
+    paginated_list: Any
+    slot: Any = None
+
+@dataclass(order=True)
+class GithubSearchRequest:
+    priority: int
+    order: int
+    query: str = field(compare=False)
+    callback: Callable[[GithubSearchResult], None] = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+    # Called instead of the callback when the search is abandoned
+    failure_callback: Callable[[], None] | None = field(default=None, compare=False)
+
+# In-run table of the searches waiting for an answer, so that identical searches requested for different people are sent once.
+# The first requester of a key sends the search, the following ones are only added to the list of requesters of the key.
+class SingleFlightTable:
+    def __init__(self):
+        self.requesters: dict[str, list] = {}
+        self.requests: dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    # Returns True if the requester is the first one for this key
+    def join(self, key: str, requester) -> bool:
+        with self.lock:
+            if key in self.requesters:
+                self.requesters[key].append(requester)
+                return False
+            self.requesters[key] = [requester]
+            return True
+
+    def set_request(self, key: str, request):
+        with self.lock:
+            self.requests[key] = request
+
+    def get_request(self, key: str):
+        with self.lock:
+            return self.requests.get(key)
+
+    # Removes the key from the table and returns all its requesters
+    def complete(self, key: str) -> list:
+        with self.lock:
+            self.requests.pop(key, None)
+            return self.requesters.pop(key, [])
+
+# One Github client per token, with the time at which it is allowed to send its next search request
+class GithubTokenSlot:
+    def __init__(self, client: Github, name: str):
+        self.client = client
+        self.name = name
+        self.next_request_time = 0.0
+        self.remaining: int | None = None
+        self.reset_time: float | None = None
+
+    # Reads the rate limit headers of the last response and spaces the following requests to use exactly the remaining quota before the reset
+    def update_from_headers(self, requests_per_minute: int):
+        now = time.time()
+        remaining, limit = self.client.requester.rate_limiting
+        reset_time = self.client.requester.rate_limiting_resettime
+        if limit < 0 or reset_time == 0:
+            self.next_request_time = now + 60 / requests_per_minute
+            return
+        self.remaining = remaining
+        self.reset_time = reset_time
+        if remaining <= 0:
+            self.next_request_time = reset_time + 1
+        else:
+            self.next_request_time = now + max(0, reset_time - now) / remaining
+
+    def exhausted(self):
+        reset_time = self.client.requester.rate_limiting_resettime
+        if reset_time == 0 or reset_time < time.time():
+            reset_time = time.time() + 60
+        self.remaining = 0
+        self.reset_time = reset_time
+        self.next_request_time = reset_time + 1
+
+# Schedules the GitHub user searches over one or several tokens so that the search quota is saturated without being exceeded.
+# Requests with the lowest priority value are sent first.
+class GithubSearchScheduler:
+    def __init__(self, tokens: list[str | None], base_url: str = github_api_url, per_page: int = 100, requests_per_minute: int = default_search_requests_per_minute, max_attempts: int = 3):
+        if len(tokens) == 0:
+            tokens = [None]
+        self.slots: list[GithubTokenSlot] = []
+        for index, token in enumerate(tokens):
+            auth = Auth.Token(token) if token is not None else None
+            # Retries are disabled so that rate limit errors come back to the scheduler instead of blocking the client
+            client = Github(auth=auth, base_url=base_url, per_page=per_page, retry=None)
+            self.slots.append(GithubTokenSlot(client, f'token {index}'))
+        self.base_url = base_url
+        self.requests_per_minute = requests_per_minute
+        self.max_attempts = max_attempts
+        self.queue: list[GithubSearchRequest] = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+        self.next_slot = 0
+
+    def client(self) -> Github:
+        return self.slots[0].client
+
+    def submit(self, query: str, callback: Callable[[GithubSearchResult], None], priority: int = 1, failure_callback: Callable[[], None] | None = None) -> GithubSearchRequest:
+        request = GithubSearchRequest(priority, next(self.order), query, callback, failure_callback=failure_callback)
+        with self.lock:
+            heapq.heappush(self.queue, request)
+        return request
+
+    def raise_priority(self, request: GithubSearchRequest | None, priority: int):
+        if request is None:
+            return
+        with self.lock:
+            if priority < request.priority and request in self.queue:
+                request.priority = priority
+                heapq.heapify(self.queue)
+
+    def pending(self) -> int:
+        return len(self.queue)
+
+    # Waits for the earliest available token, in round-robin among the tokens available at the same time
+    def acquire(self) -> GithubTokenSlot:
+        with self.lock:
+            ordered_slots = self.slots[self.next_slot:] + self.slots[:self.next_slot]
+            slot = min(ordered_slots, key=lambda s: s.next_request_time)
+            self.next_slot = (self.slots.index(slot) + 1) % len(self.slots)
+        wait_time = slot.next_request_time - time.time()
+        if wait_time > 0:
+            logging.debug('Waiting %.2fs for GitHub search quota of %s', wait_time, slot.name)
+            time.sleep(wait_time)
+        return slot
+
+    # Records the latency of a request to the GitHub API, with the status of its error if it failed
+    def record_request(self, start_time: float, error: Exception | None = None):
+        status = 200 if error is None else getattr(error, 'status', 'error')
+        metrics.record_request(self.base_url, time.monotonic() - start_time, status)
+
+    def search(self, slot: GithubTokenSlot, query: str) -> GithubSearchResult:
+        paginated_list = slot.client.search_users(query)
+        start_time = time.monotonic()
+        try:
+            first_page = paginated_list.get_page(0)
+        except Exception as e:
+            self.record_request(start_time, e)
+            raise
+        finally:
+            slot.update_from_headers(self.requests_per_minute)
+        self.record_request(start_time)
+        return GithubSearchResult(query, paginated_list.totalCount, first_page, paginated_list, slot)
+
+    # Fetches a following page of a search result with the token of the search, once its quota allows it
+    def fetch_page(self, result: GithubSearchResult, page: int) -> list:
+        slot = result.slot
+        wait_time = slot.next_request_time - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        start_time = time.monotonic()
+        try:
+            page_items = result.paginated_list.get_page(page)
+        except Exception as e:
+            self.record_request(start_time, e)
+            raise
+        finally:
+            slot.update_from_headers(self.requests_per_minute)
+        self.record_request(start_time)
+        return page_items
+
+    def run(self):
+        while len(self.queue) > 0:
+            check_cancelled()
+            with self.lock:
+                request = heapq.heappop(self.queue)
+            slot = self.acquire()
+            try:
+                result = self.search(slot, request.query)
+            except RateLimitExceededException as e:
+                # The slot waits for the reset of its quota, the search itself did not fail and is requeued without counting an attempt
+                logging.warning('GitHub search quota exceeded for %s, rescheduling %s', slot.name, request.query)
+                slot.exhausted()
+                self.requeue(request)
+                continue
+            except GithubException as e:
+                logging.error('GitHub search error for %s: %s', request.query, e)
+                self.retry(request)
+                continue
+            request.callback(result)
+
+    def requeue(self, request: GithubSearchRequest):
+        with self.lock:
+            heapq.heappush(self.queue, request)
+
+    def retry(self, request: GithubSearchRequest):
+        request.attempts += 1
+        if request.attempts < self.max_attempts:
+            metrics.record_retry(self.base_url)
+            self.requeue(request)
+        else:
+            logging.error('GitHub search abandoned after %d attempts: %s', request.attempts, request.query)
+            if request.failure_callback != None:
+                request.failure_callback()
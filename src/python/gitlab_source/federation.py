@@ -0,0 +1,93 @@
+from gitlab_source.gitlab import harvest_gitlab_projects
+from util.dataset import write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import time
+
+# List of the Gitlab instances to crawl, as a JSON list of objects with the keys:
+#   url: base url of the instance
+#   token_env: name of the variable holding the token of the instance (optional)
+#   max_workers: number of concurrent requests to the instance (optional)
+#   requests_per_second: maximum request rate to the instance (optional)
+gitlab_instances_filename = 'data/gitlab/instances.json'
+gitlab_federation_report_filename = 'data/gitlab/federation_report.json'
+
+default_instances = [ { 'url': 'https://gitlab.inria.fr', 'token_env': 'gitlab_inria_token' } ]
+# Each instance is written to its own file, data/rdf/software/gitlab_<host>_Software.ttl, and its own named graph.
+# The instance crawled by the gitlab stage (gitlab_base_url), written to gitlab_Software.ttl, is left out so that its projects are not counted twice.
+
+@dataclass
+class GitlabInstance:
+    url: str
+    token: str | None = None
+    max_workers: int = 4
+    requests_per_second: float = 5
+
+    def name(self) -> str:
+        host = urlsplit(self.url).netloc
+        return re.sub(r'[^A-Za-z0-9]+', '_', host).strip('_')
+
+    def software_filename(self) -> str:
+        return f'data/rdf/software/gitlab_{self.name()}_Software.ttl'
+
+def load_gitlab_instances(filename: str = gitlab_instances_filename) -> list[GitlabInstance]:
+    instances_json = default_instances
+    if os.path.exists(filename):
+        instances_file = open(filename, 'r')
+        instances_json = json.load(instances_file)
+        instances_file.close()
+    instances = []
+    for instance_json in instances_json:
+        token = None
+        if 'token_env' in instance_json:
+            token = os.getenv(instance_json['token_env'])
+        instances.append(GitlabInstance(
+            url=instance_json['url'].rstrip('/'),
+            token=token,
+            max_workers=int(instance_json.get('max_workers', 4)),
+            requests_per_second=float(instance_json.get('requests_per_second', 5))))
+    return instances
+
+# Crawls one instance into its own graph and writes it to its own file
+def crawl_gitlab_instance(instance: GitlabInstance) -> dict:
+    start_time = time.time()
+    graph = memory_budget.register(f'gitlab_{instance.name()}_Software', LazyGraph())
+    num_projects = harvest_gitlab_projects(instance.url, instance.token, graph, max_workers=instance.max_workers, requests_per_second=instance.requests_per_second)
+    if len(graph) > 0:
+        logging.info('Writing software graph of %s to file %d triples', instance.url, len(graph))
+        write_source_graph(graph, instance.software_filename())
+    report = { 'url': instance.url, 'status': 'ok', 'graph': f'gitlab_{instance.name()}_Software', 'projects': num_projects, 'triples': len(graph), 'duration': time.time() - start_time }
+    graph.close()
+    return report
+
+# Crawls all the instances concurrently. Each instance has its own concurrency and rate limit, and the failure of one instance does not stop the others.
+def process_gitlab_federation(instances: list[GitlabInstance] | None = None, max_instances: int | None = None) -> list[dict]:
+    if instances is None:
+        single_instance_url = os.getenv('gitlab_base_url', 'https://gitlab.inria.fr').rstrip('/')
+        instances = [ instance for instance in load_gitlab_instances() if instance.url != single_instance_url ]
+    if max_instances is None:
+        max_instances = int(os.getenv('gitlab_max_instances', '4'))
+    logging.info(f'Crawling {len(instances)} Gitlab instances')
+    reports = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_instances)) as executor:
+        futures = { executor.submit(crawl_gitlab_instance, instance): instance for instance in instances }
+        for future in concurrent.futures.as_completed(futures):
+            instance = futures[future]
+            try:
+                reports.append(future.result())
+            except Exception as e:
+                logging.error('Crawl of Gitlab instance %s failed: %s', instance.url, e)
+                reports.append({ 'url': instance.url, 'status': 'failed', 'error': str(e) })
+    os.makedirs(os.path.dirname(gitlab_federation_report_filename), exist_ok=True)
+    report_file = open(gitlab_federation_report_filename + '.tmp', 'w')
+    json.dump(reports, report_file, indent=2)
+    report_file.close()
+    os.replace(gitlab_federation_report_filename + '.tmp', gitlab_federation_report_filename)
+    return reports
@@ -1,109 +1,167 @@
 from rdflib import URIRef, Graph, Literal
 from rdflib.namespace import RDF, RDFS, DCTERMS
 from util.utilities import create_uri
+from util.dataset import write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.pipeline import check_cancelled
+from util.progress import ProgressReporter
+from util.rate_limit import RateLimitedSession, RateLimiter
+from util.cache import cache_filepath, read_cached_json, request_fingerprint, write_cached_json
+from kg.CONSTANTS import ADMS, CC, LOCAL, PAV
 import gitlab
 from gitlab.exceptions import GitlabGetError
 
+import concurrent.futures
 import os
 import json
 import datetime
 import hashlib
 import logging
+import threading
 
-g_gl_Software = Graph()
+g_gl_Software = memory_budget.register('gitlab_Software', LazyGraph())
 g_gl_software_filename = 'data/rdf/software/gitlab_Software.ttl'
-g_gl_Person = Graph()
+g_gl_Person = memory_budget.register('gitlab_Person', LazyGraph())
 g_gl_person_filename = 'data/rdf/person/gitlab_Person.ttl'
 
-def process_gitlab(gitlab_instance_url = 'https://gitlab.inria.fr', gitlab_instance_token = os.getenv('gitlab_inria_token')):
+local_GitlabRepo = LOCAL.GitlabRepo
+local_repository_stars = LOCAL.repository_stars
+local_repository_forks = LOCAL.repository_forks
+pav_importedFrom = PAV.importedFrom
+pav_lastRefreshedOn = PAV.lastRefreshedOn
+pav_retrievedFrom = PAV.retrievedFrom
+adms_identifier = ADMS.identifier
+cc_License = CC.License
 
-    gitlab_forge_uri = create_uri(gitlab_instance_url)
+# Lists the public projects of the instance, filtered by the server, with keyset pagination
+def list_public_projects(gl: gitlab.Gitlab, per_page: int = 100):
+    return gl.projects.list(visibility='public', pagination='keyset', order_by='id', sort='asc', per_page=per_page, iterator=True)
+
+def project_query_filepath(project_query_string: str) -> str:
+    return cache_filepath('data/gitlab/', request_fingerprint('GET', project_query_string, {'license': True}))
+
+def legacy_project_query_filepath(project_query_string: str) -> str:
+    project_query_filename = hashlib.md5(project_query_string.encode()).hexdigest()
+    return f'data/gitlab/{project_query_filename}.json'
+
+# Returns the JSON description of a project, from the cache or from the project details endpoint, the only one that gives its license
+def get_project_json(gl: gitlab.Gitlab, project_attributes: dict, project_query_string: str) -> dict | None:
+    project_query_file = project_query_filepath(project_query_string)
+    # Cache handling
+    full_project_json = read_cached_json('gitlab', project_query_file, legacy_filepath=legacy_project_query_filepath(project_query_string))
+    if full_project_json != None:
+        return full_project_json
+    logging.debug('Querying project %s', project_query_string)
+    try:
+        full_project = gl.projects.get(project_attributes['id'], license=True)
+    except GitlabGetError as e:
+        logging.warning('Error querying project %s: %s', project_query_string, e)
+        return None
+    # Save the project details to a file
+    full_project_json = full_project.asdict()
+    write_cached_json('gitlab', project_query_file, full_project_json)
+    return full_project_json
+
+def add_project_to_graph(graph: Graph, full_project_json: dict, project_query_string: str, gitlab_forge_uri):
+    project_name_literal = Literal(full_project_json['name'])
+    project_description_literal = Literal(full_project_json.get('description'))
+    project_uri = create_uri(full_project_json['web_url'])
+    project_query_literal = Literal(project_query_string)
+
+    project_license_obj = full_project_json.get('license')
+    if(project_license_obj != None and project_license_obj['html_url'] != None):
+        # Add the project to the graph
+        graph.add((project_uri, RDF.type, local_GitlabRepo))
+        graph.add((project_uri, pav_importedFrom, project_query_literal))
+        graph.add((project_uri, pav_lastRefreshedOn, Literal(datetime.datetime.now().isoformat())))
+        graph.add((project_uri, pav_retrievedFrom, gitlab_forge_uri))
+        graph.add((project_uri, adms_identifier, project_uri))
+        graph.add((project_uri, RDFS.label, project_name_literal))
+        graph.add((project_uri, DCTERMS.abstract, project_description_literal))
+
+        if('last_activity_at' in full_project_json and full_project_json['last_activity_at'] != None):
+            project_last_activity_literal = Literal(full_project_json['last_activity_at'])
+            graph.add((project_uri, DCTERMS.modified, project_last_activity_literal))
+        if('star_count' in full_project_json and full_project_json['star_count'] != None):
+            project_star_count_literal = Literal(full_project_json['star_count'])
+            graph.add((project_uri, local_repository_stars, project_star_count_literal))
+        if('forks_count' in full_project_json and full_project_json['forks_count'] != None):
+            project_forks_count_literal = Literal(full_project_json['forks_count'])
+            graph.add((project_uri, local_repository_forks, project_forks_count_literal))
+        if('topics' in full_project_json and full_project_json['topics'] != None):
+            for topic in full_project_json['topics']:
+                topic_literal = Literal(topic)
+                graph.add((project_uri, DCTERMS.subject, topic_literal))
+
+        project_license_uri = create_uri(project_license_obj['html_url'])
+        graph.add((project_uri, DCTERMS.license, project_license_uri))
+        graph.add((project_license_uri, RDF.type, cc_License))
+        graph.add((project_license_uri, pav_importedFrom, project_query_literal))
+        graph.add((project_license_uri, pav_lastRefreshedOn, Literal(datetime.datetime.now().isoformat())))
+        graph.add((project_license_uri, pav_retrievedFrom, gitlab_forge_uri))
+        if(project_license_obj.get('name') != None):
+            project_license_name_literal = Literal(project_license_obj['name'])
+            graph.add((project_license_uri, RDFS.label, project_license_name_literal))
+        if(project_license_obj.get('nickname') != None):
+            project_license_alt_name = Literal(project_license_obj['nickname'])
+            graph.add((project_license_uri, DCTERMS.alternative, project_license_alt_name))
 
+# Lists the public projects of a Gitlab instance and fetches the missing details of the projects with a bounded pool of threads.
+# The graph is only modified by the calling thread.
+# The requests of all the clients of an instance share the same rate limiter
+def gitlab_client(gitlab_instance_url: str, gitlab_instance_token: str | None, limiter: RateLimiter) -> gitlab.Gitlab:
+    return gitlab.Gitlab(gitlab_instance_url, private_token=gitlab_instance_token, session=RateLimitedSession(limiter))
+
+def harvest_gitlab_projects(gitlab_instance_url: str, gitlab_instance_token: str | None, graph: Graph | LazyGraph, max_workers: int = 8, requests_per_second: float = 0) -> int:
+    gitlab_forge_uri = create_uri(gitlab_instance_url)
     gitlab_projects_ns = f"{gitlab_instance_url}/api/v4/projects/"
-    # Connect to the Gitlab API
-    gl = gitlab.Gitlab(gitlab_instance_url, private_token=gitlab_instance_token)
-    # enable_console_debug_logging() # Enable debug logging
-    logging.info(f'Connected to Gitlab as {gl.http_username}')
-
-    # Get all projects
-    projects_list = gl.projects.list(get_all=True, iterator=True)
-    logging.info(f'Found {len(projects_list)} projects')
-    # Iterate over the projects
-    for project in projects_list:
-        if(project.visibility != 'public'):
-            logging.info(f'Skipping project {project.name} ({project.id})')
-            continue
-        # Get the project details
-        project_id = project.id
-        project_name = project.name
-        project_name_literal = Literal(project_name)
-        project_description = project.description
-        project_description_literal = Literal(project_description)
-        project_url = project.web_url
-        project_uri = create_uri(project_url)
-
-        project_query_string = f'{gitlab_projects_ns}{project_id}'
-        project_query_literal = Literal(project_query_string)
-        logging.info(f'Querying project {project_query_string}')
-        project_query_filename = hashlib.md5(project_query_string.encode()).hexdigest()
-        project_query_filepath = f'data/gitlab/{project_query_filename}.json'
-
-        # Cache handling
-        if not os.path.exists(project_query_filepath):
-            try:
-                full_project = gl.projects.get(project_id, visibility='public', license=True, star_count=True, forks_count=True, topics=True, last_activity_at=True)
-            except GitlabGetError as e:
-                logging.warning(f'Error querying project {project_query_string}: {e}')
-                continue
-            # Save the project details to a file
-            full_project_json_file_string = full_project.to_json()
-            full_project_json_file = open(project_query_filepath, 'w')
-            full_project_json_file.write(full_project_json_file_string)
-            full_project_json_file.close()
-        else:
-            full_project_json_file = open(project_query_filepath, 'r')
-            full_project_json_file_string = full_project_json_file.read()
-            full_project_json_file.close()
-        full_project_json = json.JSONDecoder().decode(full_project_json_file_string)
-
-
-        project_license_obj = full_project_json['license']
-        if(project_license_obj != None and project_license_obj['html_url'] != None):
-            # Add the project to the graph
-            g_gl_Software.add((project_uri, RDF.type, local_GitlabRepo))
-            g_gl_Software.add((project_uri, pav_importedFrom, project_query_literal))
-            g_gl_Software.add((project_uri, pav_lastRefreshedOn, Literal(datetime.datetime.now().isoformat())))
-            g_gl_Software.add((project_uri, pav_retrievedFrom, gitlab_forge_uri))
-            g_gl_Software.add((project_uri, adms_identifier, project_uri))
-            g_gl_Software.add((project_uri, RDFS.label, project_name_literal))
-            g_gl_Software.add((project_uri, DCTERMS.abstract, project_description_literal))
-
-            if('last_activity_at' in full_project_json and full_project_json['last_activity_at'] != None):
-                project_last_activity_literal = Literal(full_project_json['last_activity_at'])
-                g_gl_Software.add((project_uri, DCTERMS.modified, project_last_activity_literal))
-            if('star_count' in full_project_json and full_project_json['star_count'] != None):
-                project_star_count_literal = Literal(full_project_json['star_count'])
-                g_gl_Software.add((project_uri, local_repository_stars, project_star_count_literal))
-            if('forks_count' in full_project_json and full_project_json['forks_count'] != None):
-                project_forks_count_literal = Literal(full_project_json['forks_count'])
-                g_gl_Software.add((project_uri, local_repository_forks, project_forks_count_literal))
-            if('topics' in full_project_json and full_project_json['topics'] != None):
-                for topic in full_project_json['topics']:
-                    topic_literal = Literal(topic)
-                    g_gl_Software.add((project_uri, DCTERMS.subject, topic_literal))
-
-            project_license_uri = create_uri(project_license_obj['html_url'])
-            g_gl_Software.add((project_uri, DCTERMS.license, project_license_uri))
-            g_gl_Software.add((project_license_uri, RDF.type, cc_License))
-            g_gl_Software.add((project_license_uri, pav_importedFrom, project_query_literal))
-            g_gl_Software.add((project_license_uri, pav_lastRefreshedOn, Literal(datetime.datetime.now().isoformat())))
-            g_gl_Software.add((project_license_uri, pav_retrievedFrom, gitlab_forge_uri))
-            if(project_license_obj['name'] != None):
-                project_license_name_literal = Literal(project_license_obj['name'])
-                g_gl_Software.add((project_license_uri, RDFS.label, project_license_name_literal))
-            if(project_license_obj['nickname'] != None):
-                project_license_alt_name = Literal(project_license_obj['nickname'])
-                g_gl_Software.add((project_license_uri, DCTERMS.alternative, project_license_alt_name))
+    limiter = RateLimiter(requests_per_second)
+
+    # One connection per thread, as the HTTP session of the Gitlab client is not meant to be shared between threads
+    thread_clients = threading.local()
+    def thread_client() -> gitlab.Gitlab:
+        if not hasattr(thread_clients, 'gl'):
+            thread_clients.gl = gitlab_client(gitlab_instance_url, gitlab_instance_token, limiter)
+        return thread_clients.gl
+
+    gl = gitlab_client(gitlab_instance_url, gitlab_instance_token, limiter)
+    logging.info(f'Connected to Gitlab instance {gitlab_instance_url}')
+
+    num_projects = 0
+    progress = ProgressReporter('gitlab_projects')
+    pending = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def add_done_projects(return_when):
+            done, not_done = concurrent.futures.wait(pending, return_when=return_when)
+            for future in done:
+                full_project_json, project_query_string = future.result()
+                if full_project_json != None:
+                    add_project_to_graph(graph, full_project_json, project_query_string, gitlab_forge_uri)
+                    progress.update()
+                    memory_budget.check(graph)
+                    check_cancelled()
+            return not_done
+
+        for project in list_public_projects(gl):
+            num_projects += 1
+            project_query_string = f'{gitlab_projects_ns}{project.id}'
+            pending.add(executor.submit(lambda attributes, query: (get_project_json(thread_client(), attributes, query), query), project.attributes, project_query_string))
+            # Bounds the number of listed projects waiting for their details
+            if len(pending) >= max_workers * 4:
+                pending = add_done_projects(concurrent.futures.FIRST_COMPLETED)
+        add_done_projects(concurrent.futures.ALL_COMPLETED)
+    progress.close()
+    logging.info(f'Processed {num_projects} public projects from {gitlab_instance_url}')
+    return num_projects
+
+def process_gitlab(gitlab_instance_url: str | None = None, gitlab_instance_token = None):
+    if gitlab_instance_url is None:
+        gitlab_instance_url = os.getenv('gitlab_base_url', 'https://gitlab.inria.fr')
+    if gitlab_instance_token is None:
+        gitlab_instance_token = os.getenv('gitlab_inria_token')
+    max_workers = int(os.getenv('gitlab_max_workers', '8'))
+    harvest_gitlab_projects(gitlab_instance_url, gitlab_instance_token, g_gl_Software, max_workers=max_workers)
 
     write_gitlab_graph()
 
@@ -111,11 +169,11 @@ def write_gitlab_graph():
     # Writing the graph to a file
     if len(g_gl_Software) > 0:
         logging.info(f'Writing software graph to file {len(g_gl_Software)} triples')
-        g_gl_Software.serialize(destination=g_gl_software_filename, format='turtle')
+        write_source_graph(g_gl_Software, g_gl_software_filename)
     g_gl_Software.close()
     if len(g_gl_Person) > 0:
         logging.info(f'Writing person graph to file {len(g_gl_Person)} triples')
-        g_gl_Person.serialize(destination=g_gl_person_filename, format='turtle')
+        write_source_graph(g_gl_Person, g_gl_person_filename)
     g_gl_Person.close()
     if (len(g_gl_Software) > 0) or (len(g_gl_Person) > 0):
         logging.info('Gitlab graph written to file')
@@ -1,28 +1,36 @@
 from rdflib import DCMITYPE, Graph, URIRef, Literal, BNode
-from rdflib.plugins.sparql import prepareQuery
 from rdflib.namespace import RDF, RDFS, OWL, DCTERMS, DCAT, FOAF
-from rdflib.query import Result, ResultRow
 from kg.knowledge import Paper, UniqueIdentifier, Organization, Person, Software, Source
-from util.utilities import api_cached_query, create_uri, sparql_cached
+from util.utilities import api_cached_query, create_uri
+from util.sparql_client import SparqlClient
+from util.dataset import write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.pipeline import check_cancelled
+from util.progress import ProgressReporter
 from kg.CONSTANTS import DOI, GSCHOLAR, HAL_AUTHOR, HAL, ORCID
 import os
 import logging
 import configparser
 import xml.etree.ElementTree as ET
 
-logging.basicConfig(filename='app.log', level=logging.DEBUG)
-
-g_h_person = Graph()
+g_h_person = memory_budget.register('hal_Person', LazyGraph())
 g_h_person_filename = 'data/rdf/person/hal_Person.ttl'
-g_h_organization = Graph()
+g_h_organization = LazyGraph()
 g_h_organization_filename = 'data/rdf/organization/hal_Organization.ttl'
-g_h_software = Graph()
+g_h_software = memory_budget.register('hal_Software', LazyGraph())
 g_h_software_filename = 'data/rdf/software/hal_Software.ttl'
-g_h_article = Graph()
+g_h_article = LazyGraph()
 g_h_article_filename = 'data/rdf/article/hal_Article.ttl'
 
 hal_sparql_endpoint = "http://sparql.archives-ouvertes.fr/sparql"
 hal_sparql_source_obj = Source(URIRef(hal_sparql_endpoint))
+# The HAL API and SPARQL endpoint can be replaced by local stand-ins such as mock_server.hal_api and mock_server.sparql_endpoint, the sources of the data staying the HAL ones
+hal_sparql_client = SparqlClient(os.getenv('hal_sparql_endpoint', hal_sparql_endpoint))
+hal_api_default_base_url = "https://api.archives-ouvertes.fr"
+
+def hal_api_url(path: str, default_base_url: str = hal_api_default_base_url) -> str:
+    return os.getenv('hal_api_base_url', default_base_url).rstrip('/') + path
 
 # config = configparser.ConfigParser()
 # page_size = config['HAL'].getint('page_size')
@@ -67,7 +75,7 @@ title_field = "title_s"
 xml_field = "label_xml"
 
 def hal_expand_article_ref(article_obj: Paper) -> Paper:
-    logging.info(f"HAL expanding {article_obj.uri}")
+    logging.info('HAL expanding %s', article_obj.uri)
     paper_api_query = "*"
     # If paper has a DOI, then look for it by DOI
     if article_obj.doi != None:
@@ -85,7 +93,7 @@ def hal_expand_article_ref(article_obj: Paper) -> Paper:
     # paper_api_filter = f"{doctype_field}:COM,ART,THESE,MEM,REPORT"
     paper_api_filter = "*:*"
     paper_api_sort = f"{docid_field}+asc"
-    paper_api_url = f"https://api.archives-ouvertes.fr/search/?wt=json&q={paper_api_query}&fq={paper_api_filter}&fl={paper_api_fields}&rows={page_size}&start={page * page_size}&sort={paper_api_sort}" # type: ignore
+    paper_api_url = hal_api_url(f"/search/?wt=json&q={paper_api_query}&fq={paper_api_filter}&fl={paper_api_fields}&rows={page_size}&start={page * page_size}&sort={paper_api_sort}") # type: ignore
         
     paper_api_uri = create_uri(f"https://api.archives-ouvertes.fr/search/?fq={paper_api_filter}")
     paper_api_source_obj = Source(paper_api_uri) # type: ignore
@@ -93,10 +101,10 @@ def hal_expand_article_ref(article_obj: Paper) -> Paper:
     paper_api_result = api_cached_query(api_url=paper_api_url, api_query_file_prefix="data/hal/paper/")
     num_papers = paper_api_result['response']['numFound']
 
-    logging.info(f"{num_papers} for {paper_api_url}")
+    logging.info('%s papers for %s', num_papers, paper_api_url)
 
     while page * page_size < num_papers: # type: ignore
-        logging.info(paper_api_url)
+        logging.debug('Reading papers from %s', paper_api_url)
 
         for paper_json in paper_api_result['response']['docs']:
             if uri_field in paper_json:
@@ -150,7 +158,7 @@ def hal_expand_article_ref(article_obj: Paper) -> Paper:
                     org_obj.set_uri(create_uri(author_organism))
                     article_obj.add_related(org_obj)
         page += 1
-        paper_api_url = f"https://api.archives-ouvertes.fr/search/?wt=json&q={paper_api_query}&fq={paper_api_filter}&fl={paper_api_fields}&rows={page_size}&start={page * page_size}&sort={paper_api_sort}" # type: ignore
+        paper_api_url = hal_api_url(f"/search/?wt=json&q={paper_api_query}&fq={paper_api_filter}&fl={paper_api_fields}&rows={page_size}&start={page * page_size}&sort={paper_api_sort}") # type: ignore
 
         paper_api_result = api_cached_query(api_query_file_prefix="data/hal/software/", api_url=paper_api_url)
     return article_obj
@@ -315,7 +323,8 @@ def hal_software_to_software_obj(hal_sofware_json, hal_api_url: str, source: Sou
     return software_obj
 
 # Uses the HAL api to download data about authors, structures and papers
-def process_hal():
+# The authors, software and organizations can be processed separately, to be run as separate stages
+def process_hal(authors: bool = True, software: bool = True, organizations: bool = True):
 
     def process_hal_authors():
         ## Prepare the HAL API query for authors
@@ -326,7 +335,7 @@ def process_hal():
         author_api_fields = f"{firstname_field},{fullname_sci_field},{firstname_field},{lastname_field},{idhal_field},{orcid_field},{gscholar_field.replace(' ', '+')},{idref_field}"
         author_api_filter = f"{idhal_field}:[\"\" TO *]"
         author_api_sort = f"{fullname_field}+asc"
-        author_api_endpoint = "http://api.archives-ouvertes.fr/ref/author/?wt=json"
+        author_api_endpoint = hal_api_url("/ref/author/?wt=json", "http://api.archives-ouvertes.fr")
         author_api_url = f'{author_api_endpoint}&fl={author_api_fields}&rows={page_size}&start={page * page_size}&sort={author_api_sort}&fq={author_api_filter}&q={author_api_query}' # type: ignore
         author_api_uri = URIRef("http://api.archives-ouvertes.fr/ref/author/")
         hal_author_api_source_obj = Source(author_api_uri)
@@ -337,18 +346,23 @@ def process_hal():
 
         # Add the source to the graph
         logging.info(f'Processing {num_authors} authors')
+        progress = ProgressReporter('hal_authors', total=num_authors)
         while page * page_size < num_authors: # type: ignore
-            logging.info(f'Processing authors {page * page_size} to {min((page + 1) * page_size, num_authors)} of {num_authors}') # type: ignore
+            logging.debug('Processing authors %d to %d of %d', page * page_size, min((page + 1) * page_size, num_authors), num_authors) # type: ignore
             # Add to the graph the info relevant to the authors
             for author in author_api_result['response']['docs']:
                 author_obj = hal_json_author_to_person(hal_json_author=author, hal_json_query_url=author_api_url, hal_api_source=hal_author_api_source_obj)
                 if author_obj != None:
                     author_obj.to_rdf(g_h_person)
+            progress.update(len(author_api_result['response']['docs']))
+            memory_budget.check(g_h_person)
+            check_cancelled()
             page += 1
 
             author_api_url = f'{author_api_endpoint}&fl={author_api_fields}&rows={page_size}&start={page * page_size}&sort={author_api_sort}&fq={author_api_filter}&q={author_api_query}' # type: ignore
             
             author_api_result = api_cached_query(api_url=author_api_url, api_query_file_prefix="data/hal/author/")
+        progress.close()
 
     def process_hal_software():
         # Prepare the HAL API query for softwares
@@ -358,7 +372,7 @@ def process_hal():
         software_api_fields = f"{halid_field},{docid_field},{label_field},{uri_field},{title_field},{abstract_field},{keyword_field},{author_fullname_field},{author_idhal_field},{author_orcid_field},{code_repo_field},{programming_language_field},{platform_field},{modified_date_field},{released_date_field},{publication_date_field},{struct_ror_field},{struct_idref_field},{lab_struct_ror_field},{lab_struct_idref_field},{oa_field},{xml_field}"
         software_api_filter = f"{doctype_field}:SOFTWARE"
         software_api_sort = f"{docid_field}+asc"
-        software_api_url = f"https://api.archives-ouvertes.fr/search/?wt=json&q={software_api_query}&fq={software_api_filter}&fl={software_api_fields}&rows={page_size}&start={page * page_size}&sort={software_api_sort}" # type: ignore
+        software_api_url = hal_api_url(f"/search/?wt=json&q={software_api_query}&fq={software_api_filter}&fl={software_api_fields}&rows={page_size}&start={page * page_size}&sort={software_api_sort}") # type: ignore
 
         software_api_uri = URIRef("https://api.archives-ouvertes.fr/search/?fq=docType_s:SOFTWARE")
         software_api_source_obj = Source(software_api_uri)
@@ -369,16 +383,21 @@ def process_hal():
 
         # Add the source to the graph
         logging.info(f'Processing {num_softwares} softwares')
+        progress = ProgressReporter('hal_software', total=num_softwares)
         while page * page_size < num_softwares: # type: ignore
-            software_api_url = f"https://api.archives-ouvertes.fr/search/?wt=json&fq={software_api_filter}&fl={software_api_fields}&rows={page_size}&start={page * page_size}&sort={software_api_sort}&q={software_api_query}" # type: ignore
+            software_api_url = hal_api_url(f"/search/?wt=json&fq={software_api_filter}&fl={software_api_fields}&rows={page_size}&start={page * page_size}&sort={software_api_sort}&q={software_api_query}") # type: ignore
 
             software_api_result = api_cached_query(api_query_file_prefix="data/hal/software/", api_url=software_api_url)
 
             for software in software_api_result['response']['docs']:
                 software_obj = hal_software_to_software_obj(hal_sofware_json=software, hal_api_url=software_api_url, source=software_api_source_obj)
                 software_obj.to_rdf(g_h_software)
-                logging.info(f'Added software {software_obj.label}')
+                logging.debug('Added software %s', software_obj.label)
+            progress.update(len(software_api_result['response']['docs']))
+            memory_budget.check(g_h_software)
+            check_cancelled()
             page += 1
+        progress.close()
 
     def process_hal_organization():
         # load existing organisations from the graph in rdf/organization
@@ -398,29 +417,24 @@ def process_hal():
         PREFIX foaf: <http://xmlns.com/foaf/0.1/>
         PREFIX halschema: <http://data.archives-ouvertes.fr/schema/>
 
-        SELECT DISTINCT ?org ?label ?acronym ?id ?superOrg ?superOrgId ?superOrgLabel {{
-            SERVICE <{hal_sparql_endpoint}> {{
-                ?org a org:Organization ;
-                    skos:prefLabel ?label ;
-                    owl:sameAs ?id .
-                OPTIONAL {{
-                    ?org org:unitOf ?superOrg .
-                    ?superOrg owl:sameAs ?superOrgId ;
-                        skos:prefLabel ?superOrgLabel .
-                }}
-                OPTIONAL {{
-                    ?org skos:altLabel ?acronym .
-                }}
+        SELECT DISTINCT ?org ?label ?acronym ?id ?superOrg ?superOrgId ?superOrgLabel WHERE {{
+            ?org a org:Organization ;
+                skos:prefLabel ?label ;
+                owl:sameAs ?id .
+            OPTIONAL {{
+                ?org org:unitOf ?superOrg .
+                ?superOrg owl:sameAs ?superOrgId ;
+                    skos:prefLabel ?superOrgLabel .
             }}
-        }}'''
-
-        hal_org_results = sparql_cached(hal_org_sparql_query_string)
-
+            OPTIONAL {{
+                ?org skos:altLabel ?acronym .
+            }}
+        }}
+        ORDER BY ?org ?id ?superOrg ?acronym'''
 
-        # Send GET request to the HAL API
-        for binding in hal_org_results:
-            if isinstance(binding, ResultRow):
-                binding = binding.asdict()
+        # The organizations are read by pages, the rows of each page being parsed one at a time
+        for binding in hal_sparql_client.select_pages(hal_org_sparql_query_string):
+            if 'org' in binding and 'id' in binding and 'label' in binding:
                 org_uri = create_uri(str(binding['org']))
                 org_id_uri = create_uri(str(binding['id']))
                 org_obj = Organization(hal_sparql_source_obj)
@@ -445,27 +459,24 @@ def process_hal():
                         org_obj.add_related(super_org_obj)
                 org_obj.to_rdf(g_h_organization)                
 
-    process_hal_authors()
-    process_hal_software()
-    process_hal_organization()
+    if authors:
+        process_hal_authors()
+    if software:
+        process_hal_software()
+    if organizations:
+        process_hal_organization()
     
-def write_hal_graph():
+def write_hal_graph(graph_names: list[str] | None = None):
     # writing g to a file
-    if len(g_h_software) > 0:
-        logging.info(f'Writing software graph to file {len(g_h_software)} triples')
-        g_h_software.serialize(destination=g_h_software_filename, format='turtle')
-    g_h_software.close()
-    if len(g_h_person) > 0:
-        logging.info(f'Writing person graph to file {len(g_h_person)} triples')
-        g_h_person.serialize(destination=g_h_person_filename, format='turtle')
-    g_h_person.close()
-    if len(g_h_organization) > 0:
-        logging.info(f'Writing organization graph to file {len(g_h_organization)} triples')
-        g_h_organization.serialize(destination=g_h_organization_filename, format='turtle')
-    g_h_organization.close()
-    if len(g_h_article) > 0:
-        logging.info(f'Writing article graph to file {len(g_h_article)} triples')
-        g_h_article.serialize(destination=g_h_article_filename, format='turtle')
-    g_h_article.close()
-    if len(g_h_software) > 0 or len(g_h_person) > 0 or len(g_h_organization) > 0 or len(g_h_article) > 0:
+    hal_graphs = { 'software': (g_h_software, g_h_software_filename), 'person': (g_h_person, g_h_person_filename), 'organization': (g_h_organization, g_h_organization_filename), 'article': (g_h_article, g_h_article_filename) }
+    num_written_graphs = 0
+    for graph_name, (hal_graph, hal_graph_filename) in hal_graphs.items():
+        if graph_names != None and graph_name not in graph_names:
+            continue
+        if len(hal_graph) > 0:
+            logging.info(f'Writing {graph_name} graph to file {len(hal_graph)} triples')
+            write_source_graph(hal_graph, hal_graph_filename)
+            num_written_graphs += 1
+        hal_graph.close()
+    if num_written_graphs > 0:
         logging.info('Hal graphs written to file')
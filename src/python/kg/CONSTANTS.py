@@ -22,4 +22,7 @@ PAV = Namespace('http://purl.org/pav/')
 ROH = Namespace('http://w3id.org/roh#')
 ROR = Namespace("https://ror.org/")
 WD = Namespace("http://www.wikidata.org/entity/")
-WDT = Namespace("http://www.wikidata.org/prop/direct/")
\ No newline at end of file
+WDT = Namespace("http://www.wikidata.org/prop/direct/")
+
+# Named graphs of the N-Quads dataset, one per source output
+GRAPH = Namespace('http://ns.inria.fr/kg/graph/')
@@ -0,0 +1,22 @@
+from rdflib import Graph, Literal
+from rdflib.namespace import RDF, DCTERMS, FOAF
+from rdflib.term import Node
+from typing import Iterator
+
+# Person.to_rdf writes missing names as the literal "None"
+def is_known_name(name) -> bool:
+    return isinstance(name, Literal) and str(name).strip() not in ('', 'None')
+
+# Yields each person of the graph with its names, in a single pass over the persons of the graph.
+# The names are the combinations of the first and last names of the person, followed by its alternative names.
+# The triples are accessed directly through the indexes of the store, without SPARQL evaluation nor global sort.
+def iter_person_names(graph: Graph) -> Iterator[tuple[Node, list[str]]]:
+    for person in graph.subjects(RDF.type, FOAF.Person, unique=True):
+        first_names = [ str(name).strip() for name in graph.objects(person, FOAF.firstName) if is_known_name(name) ]
+        last_names = [ str(name).strip() for name in graph.objects(person, FOAF.lastName) if is_known_name(name) ]
+        person_names = [ f'{first_name} {last_name}' for first_name in first_names for last_name in last_names ]
+        person_names += [ str(name).strip() for name in graph.objects(person, DCTERMS.alternative) if is_known_name(name) ]
+        # Removes the duplicates while keeping the order
+        person_names = list(dict.fromkeys(person_names))
+        if len(person_names) > 0:
+            yield person, person_names
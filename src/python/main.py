@@ -1,53 +1,245 @@
 from dotenv import load_dotenv
-from rdflib import Graph
-from dblp_source.dblp import dblp_most_cited_articles
-from hal_source.hal import hal_expand_article_ref, process_hal, write_hal_graph
-from github_source.github import process_github, write_github_graph
-from gitlab_source.gitlab import process_gitlab, write_gitlab_graph
-from kg.CONSTANTS import LOCAL
-from paper_with_code_source.paper_with_code import process_paper_with_code, write_paper_with_code_graph
-from crossref_source.crossref import crossref_expand_article_obj, process_crossref, write_crossref_graph
+from util.cache import cache_stats
+from util.logging_setup import configure_logging
+from util.memory import memory_budget
+from util.metrics import metrics, metrics_json_filename, metrics_prometheus_filename
+from util.pipeline import Pipeline, Stage, cancel_event, check_cancelled
 import logging
-import concurrent.futures
+import os
 import signal
 import sys
 
+# The source modules are imported by the stages that use them, so that running one stage does not load the clients and libraries of the other sources
+
+final_graph_filename = "data/rdf/data.ttl"
+
+# Graph writing function of each source module
+source_graph_writers = {
+    'hal_source.hal': 'write_hal_graph',
+    'github_source.github': 'write_github_graph',
+    'gitlab_source.gitlab': 'write_gitlab_graph',
+    'paper_with_code_source.paper_with_code': 'write_paper_with_code_graph',
+    'crossref_source.crossref': 'write_crossref_graph',
+}
+
+# Paths of the metrics report, the Prometheus textfile can be written to the directory of a node exporter textfile collector
+def export_metrics():
+    summary = metrics.export(os.getenv('metrics_json', metrics_json_filename), os.getenv('metrics_prometheus', metrics_prometheus_filename))
+    metrics.report(summary)
+
+# Writes the graphs of the source modules that have been loaded by the stages run so far
 def write_graphs_to_files():
     print('Writing graphs to files...')
-    write_hal_graph()
-    write_github_graph()
-    write_gitlab_graph()
-    write_paper_with_code_graph()
-    write_crossref_graph()
+    for module_name, writer_name in source_graph_writers.items():
+        if module_name in sys.modules:
+            getattr(sys.modules[module_name], writer_name)()
     print('Graphs written to files.')
 
+# Signal stopping the run, the graphs being written once the stages have stopped
+received_signal: int | None = None
+
 def signal_handler(sig, frame):
-    print(f'Signal {sig} received. Writing graphs to files...')
-    write_graphs_to_files()
-    sys.exit(0)
+    global received_signal
+    print(f'Signal {sig} received. Stopping the stages...')
+    received_signal = sig
+    cancel_event.set()
+    # A second signal stops the process at once, without writing the graphs
+    signal.signal(sig, signal.SIG_DFL)
 
-def main():
-    logging.basicConfig(filename='app.log', level=logging.INFO)
-    # Loading .env variables
-    load_dotenv()
+# Exit status of a run. After a signal, the graphs of the stages stopped are written and the status is 128 + the signal number, 130 for SIGINT.
+def run_exit_status(statuses: dict[str, str]) -> int:
+    if received_signal != None:
+        write_graphs_to_files()
+        return 128 + received_signal
+    return 0 if 'failed' not in statuses.values() else 1
 
-    #######################################################
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+# Stages of the pipeline
 
-    final_graph = Graph()
-    
-    papers = dblp_most_cited_articles(start_year=2020, sparql_limit=10)
+def most_cited_papers_stage(inputs: dict) -> set:
+    from dblp_source.dblp import dblp_most_cited_articles
+    return dblp_most_cited_articles(start_year=2020, sparql_limit=10)
+
+# The most cited papers are completed by Crossref and HAL
+def enrich_papers_stage(inputs: dict) -> set:
+    from crossref_source.crossref import crossref_expand_article_obj
+    from hal_source.hal import hal_expand_article_ref
+    papers = inputs['dblp']
     for paper in papers:
+        check_cancelled()
         crossref_expand_article_obj(paper)
         hal_expand_article_ref(paper)
-        logging.debug(f"Converting {paper.uri} to RDF")
+    return papers
+
+def export_papers_stage(inputs: dict):
+    from rdflib import Graph
+    from kg.CONSTANTS import LOCAL
+    from util.dataset import nquads_output_enabled, write_named_graph
+    final_graph = Graph()
+    for paper in inputs['enrich']:
+        logging.debug('Converting %s to RDF', paper.uri)
         paper.to_rdf(final_graph)
+    metrics.record_triples('dblp_Papers', len(final_graph))
+
+    if nquads_output_enabled():
+        # The named graph is concatenated with those of the other sources by the dataset stage
+        write_named_graph(final_graph, "dblp_Papers")
+    else:
+        final_graph.serialize(final_graph_filename, "turtle", str(LOCAL))
+
+def hal_people_stage(inputs: dict):
+    from hal_source.hal import process_hal, write_hal_graph
+    process_hal(authors=True, software=False, organizations=True)
+    write_hal_graph(['person', 'organization'])
+
+def hal_software_stage(inputs: dict):
+    from hal_source.hal import process_hal, write_hal_graph
+    process_hal(authors=False, software=True, organizations=False)
+    write_hal_graph(['software'])
+
+def gitlab_stage(inputs: dict):
+    from gitlab_source.gitlab import process_gitlab
+    process_gitlab()
+
+# Returns the named graphs of the instances crawled, for the dataset stage
+def gitlab_federation_stage(inputs: dict) -> list[str]:
+    from gitlab_source.federation import process_gitlab_federation
+    reports = process_gitlab_federation()
+    return [ report['graph'] for report in reports if report['status'] == 'ok' and report['triples'] > 0 ]
 
-    final_graph.serialize("data/rdf/data.ttl", "turtle", str(LOCAL))
+def pwc_stage(inputs: dict):
+    from paper_with_code_source.paper_with_code import process_paper_with_code
+    process_paper_with_code()
+
+def crossref_stage(inputs: dict):
+    from crossref_source.crossref import process_crossref
+    process_crossref()
+
+def github_stage(inputs: dict):
+    from github_source.github import process_github, write_github_graph
+    process_github()
+    write_github_graph()
+
+# The final merge of the N-Quads output is a concatenation of the named graphs of each source, once all the sources are written
+def dataset_stage(inputs: dict):
+    from util.dataset import concatenate_datasets, nquads_output_enabled
+    if nquads_output_enabled():
+        concatenate_datasets([ graph_name for graph_names in stage_named_graphs.values() for graph_name in graph_names ] + inputs['gitlab_federation'])
+
+def text_index_stage(inputs: dict):
+    from postprocessing.text_index import build_text_index
+    build_text_index()
+
+def team_index_stage(inputs: dict):
+    from postprocessing.team_index import build_team_index
+    build_team_index()
+
+def statistics_stage(inputs: dict):
+    from postprocessing.void import build_statistics
+    build_statistics()
+
+# Graph files written by the harvest stages, which must exist for them to be skipped.
+# They are the filenames of the source modules, given here so that declaring the stages does not import the modules.
+# A source with no result writes no file, and its stage runs again until it has some.
+harvest_outputs = {
+    'hal_people': ['data/rdf/person/hal_Person.ttl', 'data/rdf/organization/hal_Organization.ttl'],
+    'hal_software': ['data/rdf/software/hal_Software.ttl'],
+    'gitlab': ['data/rdf/software/gitlab_Software.ttl'],
+    'pwc': ['data/rdf/paper/paper_with_code_Papers.ttl', 'data/rdf/software/paper_with_code_Code.ttl'],
+    'crossref': ['data/rdf/paper/crossref_Papers.ttl'],
+    'github': ['data/rdf/person/github_Person.ttl'],
+}
+# Papers with Code dump read by the pwc stage, as paper_and_code_filename in paper_with_code_source.paper_with_code, and its gzip version
+pwc_dump_filename = 'data/PaperWithCode/links-between-papers-and-code.json'
+# N-Quads outputs of the export and dataset stages, as named_graph_filename('dblp_Papers') and dataset_filename in util.dataset
+export_named_graph_filename = 'data/rdf/dataset/dblp_Papers.nq'
+dataset_output_filename = 'data/rdf/data.nq'
+# Gitlab instances of the gitlab_federation stage, other than the instance of the gitlab stage (see gitlab_source.federation)
+gitlab_instances_filename = 'data/gitlab/instances.json'
+
+# Named graphs written by the stages in the N-Quads output, a source with no result writing no graph
+stage_named_graphs = {
+    'export': ['dblp_Papers'],
+    'hal_people': ['hal_Person', 'hal_Organization'],
+    'hal_software': ['hal_Software'],
+    'gitlab': ['gitlab_Software', 'gitlab_Person'],
+    'pwc': ['paper_with_code_Papers', 'paper_with_code_Code'],
+    'crossref': ['crossref_Papers'],
+    'github': ['github_Person', 'github_Software', 'github_Organization'],
+}
+
+# The stages are declared once the .env variables are loaded, as their inputs depend on them
+def pipeline_stages() -> list[Stage]:
+    # Same test as util.dataset.nquads_output_enabled, util.dataset importing rdflib
+    nquads_output = os.getenv('rdf_output_nquads', 'false').lower() in ('1', 'true', 'yes')
+    export_output_filename = export_named_graph_filename if nquads_output else final_graph_filename
+    return [
+        Stage('dblp', most_cited_papers_stage, env=['dblp_dump', 'opencitations_dump', 'dblp_sparql_endpoint'], inputs=[ path for path in [os.getenv('dblp_dump'), os.getenv('opencitations_dump')] if path ]),
+        Stage('enrich', enrich_papers_stage, dependencies=['dblp'], env=['crossref_base_url', 'hal_api_base_url']),
+        Stage('export', export_papers_stage, dependencies=['enrich'], env=['rdf_output_nquads', 'rdf_output_run_id'], outputs=[export_output_filename]),
+        Stage('hal_people', hal_people_stage, env=['hal_api_base_url', 'hal_sparql_endpoint'], outputs=harvest_outputs['hal_people']),
+        Stage('hal_software', hal_software_stage, env=['hal_api_base_url'], outputs=harvest_outputs['hal_software']),
+        Stage('gitlab', gitlab_stage, env=['gitlab_max_workers', 'gitlab_base_url'], outputs=harvest_outputs['gitlab']),
+        Stage('gitlab_federation', gitlab_federation_stage, env=['gitlab_max_instances', 'gitlab_base_url'], inputs=[gitlab_instances_filename], outputs=['data/gitlab/federation_report.json']),
+        Stage('pwc', pwc_stage, env=['pwc_workers'], inputs=[pwc_dump_filename, pwc_dump_filename + '.gz'], outputs=harvest_outputs['pwc']),
+        Stage('crossref', crossref_stage, env=['crossref_topic_limit', 'crossref_base_url'], outputs=harvest_outputs['crossref']),
+        # The people searched on GitHub are the people of the graphs written by the other sources
+        Stage('github', github_stage, dependencies=['hal_people', 'hal_software', 'crossref', 'pwc'], env=['github_user_results_limit', 'github_base_url'], outputs=harvest_outputs['github']),
+        # The named graphs of all the sources, once they are written
+        Stage('dataset', dataset_stage, dependencies=list(stage_named_graphs) + ['gitlab_federation'], env=['rdf_output_nquads', 'rdf_output_run_id'], outputs=[dataset_output_filename] if nquads_output else []),
+        # Only the segments of the graph files changed by these stages are rebuilt
+        Stage('text_index', text_index_stage, dependencies=['export', 'hal_software', 'gitlab', 'gitlab_federation', 'pwc', 'crossref', 'github'], inputs=['data/rdf/'], outputs=['data/index/text/manifest.json']),
+        # Join of the organizations, people, papers, software and repositories of all the sources
+        Stage('team_index', team_index_stage, dependencies=['export', 'hal_people', 'hal_software', 'gitlab', 'gitlab_federation', 'pwc', 'crossref', 'github'], inputs=['data/rdf/'], outputs=['data/index/team/team_index.pickle']),
+        # VoID description and statistics of the output files
+        Stage('statistics', statistics_stage, dependencies=['export', 'hal_people', 'hal_software', 'gitlab', 'gitlab_federation', 'pwc', 'crossref', 'github'], inputs=['data/rdf/'], outputs=['data/statistics/statistics.json', 'data/statistics/void.ttl']),
+    ]
+
+# The memory budget is given in megabytes of resident set size and in triples held in memory by the source graphs
+def configure_memory_budget():
+    max_rss_mb = os.getenv('memory_budget_mb', '')
+    max_triples = os.getenv('memory_budget_triples', '')
+    memory_budget.configure(max_rss_bytes=int(float(max_rss_mb) * (1 << 20)) if max_rss_mb != '' else None,
+                            max_triples=int(max_triples) if max_triples != '' else None,
+                            trace_allocations=os.getenv('memory_tracemalloc', 'false').lower() in ('1', 'true', 'yes'))
+
+def run_pipeline(targets: list[str] | None = None, force: bool | None = None) -> dict[str, str]:
+    if force is None:
+        force = os.getenv('pipeline_force', 'false').lower() in ('1', 'true', 'yes')
+    pipeline = Pipeline(pipeline_stages())
+    configure_memory_budget()
+    # The metrics are exported every metrics_export_interval seconds while the stages run, and once they are all finished
+    metrics.start_periodic_export(float(os.getenv('metrics_export_interval', '60')), os.getenv('metrics_json', metrics_json_filename), os.getenv('metrics_prometheus', metrics_prometheus_filename))
+    try:
+        statuses = pipeline.run(targets=targets, force=force, max_workers=int(os.getenv('pipeline_max_workers', '4')))
+    finally:
+        metrics.stop_periodic_export()
+        cache_stats.report()
+        export_metrics()
+        memory_budget.remove_chunks()
+    for name, status in statuses.items():
+        logging.info(f'Stage {name}: {status}')
+    return statuses
+
+# Stages that the targets would run, without running them nor importing the source modules
+def pipeline_plan(targets: list[str] | None = None) -> list[str]:
+    return Pipeline(pipeline_stages()).selected_stages(targets)
+
+# The stages to run are given as arguments, with their ancestors, e.g. "python main.py export". All the stages are run by default.
+# The pipeline_force variable reruns the stages even if they are up to date.
+def main(targets: list[str] | None = None):
+    # Loading .env variables, which configure the logging
+    load_dotenv()
+    configure_logging()
+
+    #######################################################
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
-    exit()
+    if targets is None:
+        targets = sys.argv[1:]
+    statuses = run_pipeline(targets)
+    exit(run_exit_status(statuses))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import logging
+import sys
+import threading
+
+# Starts local stand-ins of the upstream APIs and prints the .env variables pointing the sources to them.
+# Examples:
+#   python -m mock_server all --hal-authors 1000000 --latency 0.05
+#   python -m mock_server record --upstream https://api.archives-ouvertes.fr --fixtures data/mock_fixtures/hal --port 8001
+#   python -m mock_server replay --fixtures data/mock_fixtures/hal --port 8001 --latency 0.2
+
+# Variable of each stand-in, and the suffix of its url
+server_variables = {
+    'hal': [ ('hal_api_base_url', '') ],
+    'crossref': [ ('crossref_base_url', '') ],
+    'sparql': [ ('dblp_sparql_endpoint', '/sparql'), ('hal_sparql_endpoint', '/sparql') ],
+    'github': [ ('github_base_url', '') ],
+    'gitlab': [ ('gitlab_base_url', '') ],
+}
+
+def start_server(name: str, arguments: argparse.Namespace, port: int):
+    latency = { 'latency': arguments.latency, 'latency_jitter': arguments.latency_jitter }
+    if name == 'hal':
+        from mock_server.hal_api import start_hal_api
+        return start_hal_api(num_authors=arguments.hal_authors, num_software=arguments.hal_software, num_papers=arguments.hal_papers, port=port, **latency)
+    if name == 'crossref':
+        from mock_server.crossref_api import start_crossref_api
+        return start_crossref_api(num_works=arguments.crossref_works, port=port, **latency)
+    if name == 'sparql':
+        from mock_server.sparql_endpoint import start_sparql_endpoint
+        return start_sparql_endpoint(num_rows=arguments.sparql_rows, graph_filename=arguments.sparql_graph, port=port, **latency)
+    if name == 'github':
+        from mock_server.github_api import start_github_api
+        server, base_url = start_github_api(search_quota=arguments.github_search_quota, latency=arguments.latency, port=port)
+        server.RequestHandlerClass.latency_jitter = arguments.latency_jitter # type: ignore
+        return server, base_url
+    if name == 'gitlab':
+        from mock_server.gitlab_api import start_gitlab_api
+        server, base_url = start_gitlab_api(num_projects=arguments.gitlab_projects, latency=arguments.latency, requests_per_second=arguments.gitlab_requests_per_second, port=port)
+        server.RequestHandlerClass.latency_jitter = arguments.latency_jitter # type: ignore
+        return server, base_url
+    if name == 'record':
+        from mock_server.recorder import start_recorder
+        return start_recorder(arguments.upstream, arguments.fixtures, port=port)
+    from mock_server.recorder import start_replay
+    return start_replay(arguments.fixtures, port=port, **latency)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m mock_server', description='Run local stand-ins of the upstream APIs')
+    parser.add_argument('server', choices=[ *server_variables, 'all', 'record', 'replay' ])
+    parser.add_argument('--port', type=int, default=0, help='port of the server, or of the first server for all, the following ones using the next ports (0 for free ports)')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of each answer, in seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='maximum random delay added to the latency, in seconds')
+    parser.add_argument('--hal-authors', type=int, default=10000)
+    parser.add_argument('--hal-software', type=int, default=1000)
+    parser.add_argument('--hal-papers', type=int, default=10000)
+    parser.add_argument('--crossref-works', type=int, default=10000)
+    parser.add_argument('--sparql-rows', type=int, default=10000, help='number of rows of each synthesized query result')
+    parser.add_argument('--sparql-graph', help='RDF file on which the SPARQL queries are evaluated instead of being synthesized')
+    parser.add_argument('--github-search-quota', type=int, default=30)
+    parser.add_argument('--gitlab-projects', type=int, default=1000)
+    parser.add_argument('--gitlab-requests-per-second', type=float, default=0.0)
+    parser.add_argument('--upstream', help='base url of the API recorded by record')
+    parser.add_argument('--fixtures', default='data/mock_fixtures/', help='directory of the recorded fixtures')
+    arguments = parser.parse_args(argv)
+    if arguments.server == 'record' and arguments.upstream is None:
+        parser.error('record needs the --upstream url')
+    logging.basicConfig(level=logging.INFO)
+
+    names = list(server_variables) if arguments.server == 'all' else [ arguments.server ]
+    servers = []
+    for index, name in enumerate(names):
+        port = arguments.port + index if arguments.port > 0 else 0
+        server, base_url = start_server(name, arguments, port)
+        servers.append(server)
+        for variable, suffix in server_variables.get(name, [ ('url', '') ]):
+            print(f'{variable}={base_url}{suffix}')
+    sys.stdout.flush()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
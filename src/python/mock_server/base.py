@@ -0,0 +1,67 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import json
+import logging
+import random
+import threading
+import time
+
+# Common tools for the local stand-in servers of the upstream APIs, used to run the pipeline offline
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    # Delay of each answer, in seconds, plus a uniform random jitter up to latency_jitter
+    latency = 0.0
+    latency_jitter = 0.0
+
+    def wait_latency(self):
+        delay = self.latency + (random.uniform(0, self.latency_jitter) if self.latency_jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def read_body(self) -> bytes:
+        content_length = int(self.headers.get('Content-Length', '0'))
+        return self.rfile.read(content_length) if content_length > 0 else b''
+
+    # Parameters of the query string and, for a form POST, of the body
+    def form_parameters(self, body: bytes) -> dict[str, str]:
+        parameters = self.query_parameters()
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            parameters.update({ key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items() })
+        return parameters
+
+    def query_parameters(self) -> dict[str, str]:
+        return { key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items() }
+
+    def request_path(self) -> str:
+        return urlsplit(self.path).path
+
+    def send_json(self, data, status: int = 200, headers: dict[str, str] | None = None):
+        self.send_body(json.dumps(data).encode('utf-8'), 'application/json; charset=utf-8', status, headers)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200, headers: dict[str, str] | None = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if headers is not None:
+            for header, value in headers.items():
+                self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - ' + format, self.server.server_address, *args)
+
+# Starts the server in a background thread and returns it, along with its base url
+def start_mock_server(handler_class: type[MockRequestHandler], host: str = '127.0.0.1', port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server_host, server_port = server.server_address[:2]
+    base_url = f'http://{server_host}:{server_port}'
+    logging.info(f'{handler_class.__name__} listening on {base_url}')
+    return server, base_url
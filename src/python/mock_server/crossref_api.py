@@ -0,0 +1,101 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+from urllib.parse import unquote
+import threading
+import zlib
+
+# Local stand-in for the Crossref REST API endpoints used by the crossref source: the works query, with offset or cursor deep paging, and the work of a DOI.
+# The works are synthesized from their index, the most cited first, so that a query sorted by is-referenced-by-count is consistent across pages.
+
+given_names = [ 'Jean', 'Marie', 'Pierre', 'Camille', 'Nicolas', 'Léa', 'Olivier', 'Chloé', 'François', 'Zoë' ]
+family_names = [ 'Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau' ]
+words = [ 'graph', 'knowledge', 'learning', 'neural', 'semantic', 'embedding', 'query', 'ontology', 'data', 'model' ]
+cursor_prefix = 'mock-cursor-'
+
+class CrossrefAPIHandler(MockRequestHandler):
+    num_works = 10000
+    max_rows = 1000
+    request_counts: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count_request(self, kind: str):
+        with self.lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def work_json(self, index: int, doi: str | None = None) -> dict:
+        year = 2015 + index % 10
+        authors = []
+        for author_index in range(1 + index % 5):
+            author = { 'given': given_names[(index + author_index) % len(given_names)], 'family': family_names[(index * 3 + author_index) % len(family_names)], 'sequence': 'first' if author_index == 0 else 'additional', 'affiliation': [] }
+            if author_index % 2 == 0:
+                author['ORCID'] = f'https://orcid.org/0000-0002-{index % 10000:04d}-{author_index:03d}X'
+                author['authenticated-orcid'] = False
+            if author_index % 3 == 0:
+                author['affiliation'] = [ { 'name': f'University of {family_names[author_index % len(family_names)]}' } ]
+            authors.append(author)
+        work = {
+            'DOI': doi if doi != None else f'10.{1000 + index % 9000}/mock.{index}',
+            'type': 'journal-article',
+            'title': [ ' '.join(words[(index * 7 + i) % len(words)] for i in range(7)).capitalize() ],
+            'author': authors,
+            'is-referenced-by-count': max(self.num_works - index, 0),
+            'created': { 'date-parts': [[ year, 1 + index % 12, 1 + index % 28 ]], 'date-time': f'{year}-{1 + index % 12:02d}-{1 + index % 28:02d}T00:00:00Z', 'timestamp': 0 },
+            'published': { 'date-parts': [[ year, 1 + index % 12 ]] },
+            'publisher': 'Mock Publisher',
+            'container-title': [ f'Journal of {words[index % len(words)].capitalize()}' ],
+            'link': [ { 'URL': f'https://example.org/fulltext/{index}.pdf', 'content-type': 'application/pdf', 'content-version': 'vor', 'intended-application': 'text-mining' } ],
+        }
+        if index % 4 == 0:
+            work['abstract'] = f'<jats:p>Abstract of work {index}.</jats:p>'
+        if index % 5 == 0:
+            work['funder'] = [ { 'name': 'Agence Nationale de la Recherche', 'DOI': '10.13039/501100001665' } ]
+        return work
+
+    def works(self, parameters: dict[str, str]):
+        rows = min(max(int(parameters.get('rows', '20')), 0), self.max_rows)
+        cursor = parameters.get('cursor')
+        if cursor != None:
+            self.count_request('works/cursor')
+            if cursor != '*' and not cursor.startswith(cursor_prefix):
+                self.send_json({ 'status': 'failed', 'message-type': 'validation-failure', 'message': [ { 'type': 'cursor-invalid', 'value': cursor } ] }, status=400)
+                return
+            offset = 0 if cursor == '*' else int(cursor[len(cursor_prefix):])
+        else:
+            self.count_request('works')
+            offset = max(int(parameters.get('offset', '0')), 0)
+        items = [ self.work_json(index) for index in range(offset, min(offset + rows, self.num_works)) ]
+        message = {
+            'facets': {},
+            'total-results': self.num_works,
+            'items': items,
+            'items-per-page': rows,
+            'query': { 'start-index': offset, 'search-terms': parameters.get('query') },
+        }
+        if cursor != None:
+            # Crossref keeps giving a next cursor after the last page, with an empty page
+            message['next-cursor'] = f'{cursor_prefix}{offset + len(items)}'
+        self.send_json({ 'status': 'ok', 'message-type': 'work-list', 'message-version': '1.0.0', 'message': message })
+
+    def work(self, doi: str):
+        self.count_request('works/doi')
+        doi = doi.removeprefix('https://doi.org/').removeprefix('http://dx.doi.org/')
+        self.send_json({ 'status': 'ok', 'message-type': 'work', 'message-version': '1.0.0', 'message': self.work_json(zlib.crc32(doi.encode()) % self.num_works, doi=doi) })
+
+    def do_GET(self):
+        self.wait_latency()
+        path = self.request_path().rstrip('/')
+        if path == '/works':
+            self.works(self.query_parameters())
+        elif path.startswith('/works/'):
+            self.work(unquote(path[len('/works/'):]))
+        else:
+            self.send_json({ 'status': 'error', 'message': 'Not Found' }, status=404)
+
+def start_crossref_api(num_works: int = 10000, latency: float = 0.0, latency_jitter: float = 0.0, port: int = 0):
+    handler_class = type('CrossrefAPIHandler', (CrossrefAPIHandler,), {
+        'num_works': num_works,
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'request_counts': {},
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
@@ -0,0 +1,103 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+from urllib.parse import urlencode
+import hashlib
+import threading
+import time
+
+# Local stand-in for the GitHub REST API endpoints used by the github source: user search, user details and rate limits.
+# The search endpoint enforces a per-token quota and answers with the same rate limit headers as GitHub.
+
+class GithubAPIHandler(MockRequestHandler):
+    search_quota = 30
+    search_window = 60
+    max_results_per_query = 5
+    search_windows: dict[str, tuple[float, int]] = {}
+    search_count = 0
+    lock = threading.Lock()
+
+    def token(self) -> str:
+        return self.headers.get('Authorization', 'anonymous')
+
+    def consume_search_quota(self) -> tuple[int, int]:
+        with self.lock:
+            now = time.time()
+            window_start, used = self.search_windows.get(self.token(), (now, 0))
+            if now >= window_start + self.search_window:
+                window_start, used = now, 0
+            if used < self.search_quota:
+                used += 1
+                type(self).search_count += 1
+                remaining = self.search_quota - used
+            else:
+                remaining = -1
+            self.search_windows[self.token()] = (window_start, used)
+            return remaining, int(window_start + self.search_window)
+
+    def rate_limit_headers(self, remaining: int, reset: int) -> dict[str, str]:
+        return {
+            'X-RateLimit-Limit': str(self.search_quota),
+            'X-RateLimit-Remaining': str(max(remaining, 0)),
+            'X-RateLimit-Reset': str(reset),
+            'X-RateLimit-Resource': 'search',
+        }
+
+    def user_json(self, login: str) -> dict:
+        return {
+            'login': login,
+            'id': int(hashlib.md5(login.encode()).hexdigest()[:8], 16),
+            'url': f'{self.base_url()}/users/{login}',
+            'html_url': f'https://github.com/{login}',
+            'type': 'User',
+            'name': login.capitalize(),
+            'blog': None,
+            'email': None,
+            'bio': None,
+            'company': None,
+            'location': None,
+        }
+
+    def search_users(self):
+        parameters = self.query_parameters()
+        query = parameters.get('q', '')
+        page = int(parameters.get('page', '1'))
+        per_page = int(parameters.get('per_page', '30'))
+        remaining, reset = self.consume_search_quota()
+        if remaining < 0:
+            self.send_json({'message': 'API rate limit exceeded for user.', 'documentation_url': 'https://docs.github.com/rest'}, status=403, headers=self.rate_limit_headers(remaining, reset))
+            return
+        query_hash = hashlib.md5(query.encode()).hexdigest()
+        total_count = int(query_hash, 16) % (self.max_results_per_query + 1)
+        first = (page - 1) * per_page
+        items = [ self.user_json(f'user{query_hash[:8]}{i}') for i in range(first, min(first + per_page, total_count)) ]
+        headers = self.rate_limit_headers(remaining, reset)
+        if first + per_page < total_count:
+            next_parameters = urlencode({'q': query, 'per_page': per_page, 'page': page + 1})
+            headers['Link'] = f'<{self.base_url()}/search/users?{next_parameters}>; rel="next"'
+        self.send_json({'total_count': total_count, 'incomplete_results': False, 'items': items}, headers=headers)
+
+    def do_GET(self):
+        self.wait_latency()
+        path = self.request_path()
+        if path == '/search/users':
+            self.search_users()
+        elif path == '/user':
+            self.send_json(self.user_json('mock'))
+        elif path.startswith('/users/'):
+            self.send_json(self.user_json(path[len('/users/'):]))
+        elif path == '/rate_limit':
+            resources = { 'search': { 'limit': self.search_quota, 'remaining': self.search_quota, 'reset': int(time.time()) + self.search_window, 'used': 0 } }
+            self.send_json({ 'resources': resources, 'rate': resources['search'] })
+        else:
+            self.send_json({'message': 'Not Found'}, status=404)
+
+def start_github_api(search_quota: int = 30, search_window: int = 60, max_results_per_query: int = 5, latency: float = 0.0, port: int = 0):
+    handler_class = type('GithubAPIHandler', (GithubAPIHandler,), {
+        'search_quota': search_quota,
+        'search_window': search_window,
+        'max_results_per_query': max_results_per_query,
+        'latency': latency,
+        'search_windows': {},
+        'search_count': 0,
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
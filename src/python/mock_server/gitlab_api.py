@@ -0,0 +1,95 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+from urllib.parse import urlencode
+import threading
+import time
+
+# Local stand-in for the Gitlab REST API endpoints used by the gitlab source: project list with keyset pagination and project details.
+# Projects are synthesized from their id, and the server can answer with a latency and a request rate limit.
+
+class GitlabAPIHandler(MockRequestHandler):
+    num_projects = 1000
+    private_every = 3
+    licensed_every = 2
+    requests_per_second = 0.0
+    request_times: list[float] = []
+    request_counts: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count_request(self, kind: str) -> bool:
+        with self.lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+            if self.requests_per_second <= 0:
+                return True
+            now = time.time()
+            self.request_times[:] = [ t for t in self.request_times if t > now - 1 ]
+            if len(self.request_times) >= self.requests_per_second:
+                return False
+            self.request_times.append(now)
+            return True
+
+    def project_json(self, project_id: int, details: bool) -> dict:
+        project = {
+            'id': project_id,
+            'name': f'project-{project_id}',
+            'description': f'Description of project {project_id}',
+            'web_url': f'{self.base_url()}/group/project-{project_id}',
+            'visibility': 'private' if self.private_every > 0 and project_id % self.private_every == 0 else 'public',
+            'star_count': project_id % 17,
+            'forks_count': project_id % 5,
+            'topics': [ f'topic-{project_id % 7}' ],
+            'last_activity_at': '2025-01-01T00:00:00.000Z',
+        }
+        if details:
+            project['license'] = None
+            if self.licensed_every > 0 and project_id % self.licensed_every == 0:
+                project['license'] = { 'key': 'mit', 'name': 'MIT License', 'nickname': None, 'html_url': 'https://opensource.org/licenses/MIT' }
+        return project
+
+    def list_projects(self):
+        parameters = self.query_parameters()
+        per_page = int(parameters.get('per_page', '20'))
+        id_after = int(parameters.get('id_after', '0'))
+        visibility = parameters.get('visibility')
+        projects = []
+        project_id = id_after + 1
+        while len(projects) < per_page and project_id <= self.num_projects:
+            project = self.project_json(project_id, details=False)
+            if visibility is None or project['visibility'] == visibility:
+                projects.append(project)
+            project_id += 1
+        headers = {}
+        if len(projects) > 0 and project_id <= self.num_projects:
+            next_parameters = dict(parameters)
+            next_parameters['id_after'] = str(projects[-1]['id'])
+            headers['Link'] = f'<{self.base_url()}/api/v4/projects?{urlencode(next_parameters)}>; rel="next"'
+        self.send_json(projects, headers=headers)
+
+    def do_GET(self):
+        path = self.request_path()
+        if not self.count_request(path.rstrip('0123456789')):
+            self.send_json({'message': '429 Too Many Requests'}, status=429, headers={'Retry-After': '1'})
+            return
+        self.wait_latency()
+        if path == '/api/v4/projects':
+            self.list_projects()
+        elif path.startswith('/api/v4/projects/'):
+            project_id = int(path[len('/api/v4/projects/'):])
+            if project_id < 1 or project_id > self.num_projects:
+                self.send_json({'message': '404 Project Not Found'}, status=404)
+            else:
+                self.send_json(self.project_json(project_id, details=True))
+        elif path == '/api/v4/user':
+            self.send_json({'id': 1, 'username': 'mock'})
+        else:
+            self.send_json({'message': '404 Not Found'}, status=404)
+
+def start_gitlab_api(num_projects: int = 1000, latency: float = 0.0, requests_per_second: float = 0.0, port: int = 0):
+    handler_class = type('GitlabAPIHandler', (GitlabAPIHandler,), {
+        'num_projects': num_projects,
+        'latency': latency,
+        'requests_per_second': requests_per_second,
+        'request_times': [],
+        'request_counts': {},
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
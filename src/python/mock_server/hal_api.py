@@ -0,0 +1,141 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+import threading
+import zlib
+
+# Local stand-in for the HAL Solr APIs used by the hal source: the document search (/search/) and the author referential (/ref/author/).
+# The documents are synthesized from their index, so that the collections can be as large as the real ones (e.g. 1M authors) without being held in memory.
+# The rows, start and fl parameters are honored, the sort is the index order.
+
+first_names = [ 'Jean', 'Marie', 'Pierre', 'Camille', 'Nicolas', 'Léa', 'Olivier', 'Chloé', 'François', 'Zoë' ]
+last_names = [ 'Martin', 'Bernard', 'Dubois', 'Thomas', 'Robert', 'Richard', 'Petit', 'Durand', 'Leroy', 'Moreau' ]
+words = [ 'graph', 'knowledge', 'learning', 'neural', 'semantic', 'embedding', 'query', 'ontology', 'data', 'model' ]
+
+class HalAPIHandler(MockRequestHandler):
+    num_authors = 10000
+    num_software = 1000
+    num_papers = 10000
+    max_rows = 10000
+    request_counts: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count_request(self, kind: str):
+        with self.lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def author_json(self, index: int) -> dict:
+        first_name = first_names[index % len(first_names)]
+        last_name = last_names[(index // len(first_names)) % len(last_names)]
+        author = {
+            'idHal_s': f'{first_name.lower()}-{last_name.lower()}-{index}',
+            'fullName_s': f'{first_name} {last_name}',
+            'firstName_s': first_name,
+            'lastName_s': last_name,
+            'fullName_sci': f'{last_name}, {first_name}',
+        }
+        if index % 2 == 0:
+            author['orcidId_s'] = [ f'https://orcid.org/0000-{index // 10000 % 10000:04d}-{index // 100 % 100:02d}00-{index % 10000:04d}' ]
+        if index % 3 == 0:
+            author['idrefId_s'] = [ f'https://www.idref.fr/{100000000 + index}' ]
+        return author
+
+    def authors_of(self, index: int, num_authors: int) -> list[tuple[str, str]]:
+        return [ (first_names[(index + i) % len(first_names)], last_names[(index * 7 + i) % len(last_names)]) for i in range(num_authors) ]
+
+    def software_json(self, index: int) -> dict:
+        authors = self.authors_of(index, 1 + index % 6)
+        title = ' '.join(words[(index + i) % len(words)] for i in range(4)).capitalize()
+        return {
+            'halId_s': f'hal-{index:08d}',
+            'docid': str(index),
+            'label_s': title,
+            'uri_s': f'{self.base_url()}/hal-{index:08d}',
+            'title_s': [ title ],
+            'abstract_s': [ f'{title} is a software about {words[index % len(words)]}.' ],
+            'keyword_s': [ words[(index + i) % len(words)] for i in range(1 + index % 4) ],
+            'authFullName_s': [ f'{first_name} {last_name}' for first_name, last_name in authors ],
+            'authIdHal_s': [ f'{first_name.lower()}-{last_name.lower()}' for first_name, last_name in authors[:len(authors) // 2] ],
+            'softCodeRepository_s': [ f'https://gitlab.inria.fr/{words[index % len(words)]}/software-{index}' ],
+            'softProgrammingLanguage_s': [ [ 'Python', 'C++', 'Java', 'OCaml', 'Rust' ][index % 5] ],
+            'softPlatform_s': [ [ 'Linux', 'Windows', 'Mac OS X' ][index % 3] ],
+            'modifiedDate_tdate': '2024-03-01T10:00:00Z',
+            'releasedDate_tdate': '2023-11-15T00:00:00Z',
+            'publicationDate_tdate': '2023-11-15T00:00:00Z',
+            'structRorIdExt_s': [ f'https://ror.org/0{10000000 + index % 500}' ],
+            'labStructRorIdExt_s': [ f'https://ror.org/0{20000000 + index % 100}' ],
+            'openAccess_bool': index % 3 != 0,
+        }
+
+    def paper_json(self, index: int, doi: str | None = None, title: str | None = None) -> dict:
+        authors = self.authors_of(index, 1 + index % 8)
+        if title is None:
+            title = ' '.join(words[(index * 3 + i) % len(words)] for i in range(6)).capitalize()
+        return {
+            'halId_s': f'hal-{50000000 + index:08d}',
+            'docid': str(50000000 + index),
+            'label_s': title,
+            'uri_s': f'{self.base_url()}/hal-{50000000 + index:08d}',
+            'title_s': [ title ],
+            'abstract_s': [ f'{title}.' ],
+            'keyword_s': [ words[(index + i) % len(words)] for i in range(3) ],
+            'authFullName_s': [ f'{first_name} {last_name}' for first_name, last_name in authors ],
+            'authIdHal_s': [ f'{first_name.lower()}-{last_name.lower()}' for first_name, last_name in authors[:len(authors) // 2] ],
+            'doiId_s': doi if doi != None else f'10.{1000 + index % 9000}/hal.{index}',
+            'authOrganism_s': [ 'Inria' ],
+            'publicationDate_tdate': f'{2015 + index % 10}-06-01T00:00:00Z',
+            'structRorIdExt_s': [ f'https://ror.org/0{10000000 + index % 500}' ],
+        }
+
+    # Restricts a document to the fields of the fl parameter
+    def select_fields(self, doc: dict, fields: str | None) -> dict:
+        if fields is None or fields.strip() in ('', '*'):
+            return doc
+        selected_fields = { field.strip() for field in fields.split(',') }
+        return { field: value for field, value in doc.items() if field in selected_fields }
+
+    def send_documents(self, num_found: int, make_doc, parameters: dict[str, str]):
+        start = max(int(parameters.get('start', '0')), 0)
+        rows = min(max(int(parameters.get('rows', '10')), 0), self.max_rows)
+        docs = [ self.select_fields(make_doc(index), parameters.get('fl')) for index in range(start, min(start + rows, num_found)) ]
+        self.send_json({ 'response': { 'numFound': num_found, 'start': start, 'numFoundExact': True, 'docs': docs } })
+
+    def search(self, parameters: dict[str, str]):
+        query = parameters.get('q', '*')
+        if 'docType_s:SOFTWARE' in parameters.get('fq', ''):
+            self.count_request('search/software')
+            self.send_documents(self.num_software, self.software_json, parameters)
+        elif query.startswith('doiId_s:'):
+            # One paper per DOI, so that every enriched paper is found
+            self.count_request('search/doi')
+            doi = query[len('doiId_s:'):]
+            self.send_documents(1, lambda index: self.paper_json(zlib.crc32(doi.encode()) % self.num_papers, doi=doi), parameters)
+        elif query.startswith('title_s:'):
+            self.count_request('search/title')
+            title = query[len('title_s:'):]
+            self.send_documents(1, lambda index: self.paper_json(zlib.crc32(title.encode()) % self.num_papers, title=title), parameters)
+        else:
+            self.count_request('search')
+            self.send_documents(self.num_papers, self.paper_json, parameters)
+
+    def do_GET(self):
+        self.wait_latency()
+        path = self.request_path().rstrip('/')
+        parameters = self.query_parameters()
+        if path == '/search':
+            self.search(parameters)
+        elif path == '/ref/author':
+            self.count_request('ref/author')
+            self.send_documents(self.num_authors, self.author_json, parameters)
+        else:
+            self.send_json({ 'error': { 'msg': 'Not Found', 'code': 404 } }, status=404)
+
+def start_hal_api(num_authors: int = 10000, num_software: int = 1000, num_papers: int = 10000, latency: float = 0.0, latency_jitter: float = 0.0, port: int = 0):
+    handler_class = type('HalAPIHandler', (HalAPIHandler,), {
+        'num_authors': num_authors,
+        'num_software': num_software,
+        'num_papers': num_papers,
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'request_counts': {},
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
@@ -0,0 +1,158 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlsplit
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.request
+
+from util.cache import request_fingerprint
+
+# Recording proxy and replay server for the upstream APIs.
+# The recorder forwards each request to the upstream API and saves the request and its response as a fixture file, named by the fingerprint of the request.
+# The replay server answers the recorded requests from the fixtures, at a configurable latency, so that a recorded run can be replayed offline.
+# The upstream base url in the Link headers is replaced by the url of the local server, so that paginated lists stay on it.
+base_url_placeholder = '{base_url}'
+forwarded_request_headers = { 'accept', 'authorization', 'content-type', 'private-token', 'user-agent' }
+ignored_response_headers = { 'connection', 'content-encoding', 'content-length', 'date', 'keep-alive', 'server', 'transfer-encoding' }
+
+# Fingerprint of a request, from its method, path, query string and form body. Other bodies are identified by their digest.
+def fixture_key(method: str, path: str, body: bytes, content_type: str = '') -> str:
+    split_path = urlsplit(path)
+    parameters = parse_qsl(split_path.query, keep_blank_values=True)
+    if len(body) > 0:
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            parameters += parse_qsl(body.decode('utf-8'), keep_blank_values=True)
+        else:
+            parameters.append(('body_sha256', hashlib.sha256(body).hexdigest()))
+    return request_fingerprint(method, f'http://fixture{split_path.path}', parameters)
+
+def fixture_filename(fixtures_path: str, key: str) -> str:
+    return os.path.join(fixtures_path, key[:2], f'{key}.json')
+
+def save_fixture(filename: str, fixture: dict):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fixture_file = open(filename + '.tmp', 'w')
+    json.dump(fixture, fixture_file, indent=1)
+    fixture_file.close()
+    os.replace(filename + '.tmp', filename)
+
+def load_fixture(filename: str) -> dict | None:
+    if not os.path.exists(filename):
+        return None
+    fixture_file = open(filename, 'r')
+    fixture = json.load(fixture_file)
+    fixture_file.close()
+    return fixture
+
+def encode_body(body: bytes) -> dict:
+    try:
+        return { 'body': body.decode('utf-8') }
+    except UnicodeDecodeError:
+        return { 'body_base64': base64.b64encode(body).decode('ascii') }
+
+def decode_body(response: dict) -> bytes:
+    if 'body_base64' in response:
+        return base64.b64decode(response['body_base64'])
+    return response.get('body', '').encode('utf-8')
+
+# Fixtures and counters shared by the recorder and the replay server, each answering the requests with its own do_GET and do_POST
+class FixtureHandler(MockRequestHandler):
+    fixtures_path = 'data/mock_fixtures/'
+    request_counts: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count_request(self, kind: str):
+        with self.lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def send_fixture_response(self, response: dict):
+        headers = {}
+        content_type = 'application/octet-stream'
+        for header, value in response['headers'].items():
+            if header.lower() == 'content-type':
+                content_type = value
+            else:
+                headers[header] = value.replace(base_url_placeholder, self.base_url())
+        self.send_body(decode_body(response), content_type, response['status'], headers)
+
+class RecorderHandler(FixtureHandler):
+    upstream = ''
+
+    def forward(self, body: bytes) -> dict:
+        headers = { header: value for header, value in self.headers.items() if header.lower() in forwarded_request_headers }
+        upstream_request = urllib.request.Request(self.upstream.rstrip('/') + self.path, data=body if self.command == 'POST' else None, headers=headers, method=self.command)
+        try:
+            upstream_response = urllib.request.urlopen(upstream_request, timeout=300)
+        except HTTPError as e:
+            upstream_response = e
+        response_body = upstream_response.read()
+        response_headers = {}
+        for header, value in upstream_response.headers.items():
+            if header.lower() not in ignored_response_headers:
+                response_headers[header] = value.replace(self.upstream.rstrip('/'), base_url_placeholder)
+        upstream_response.close()
+        return dict({ 'status': upstream_response.status, 'headers': response_headers }, **encode_body(response_body))
+
+    def handle_request(self):
+        body = self.read_body()
+        key = fixture_key(self.command, self.path, body, self.headers.get('Content-Type', ''))
+        try:
+            response = self.forward(body)
+        except OSError as e:
+            logging.error('Error while forwarding %s %s to %s: %s', self.command, self.path, self.upstream, e)
+            self.send_json({ 'message': f'Upstream error: {e}' }, status=502)
+            return
+        # Server errors are not recorded, so that a replay does not reproduce a transient failure
+        if response['status'] < 500:
+            request = dict({ 'method': self.command, 'path': self.path }, **encode_body(body))
+            save_fixture(fixture_filename(self.fixtures_path, key), { 'request': request, 'response': response })
+            self.count_request('recorded')
+        self.send_fixture_response(response)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+class ReplayHandler(FixtureHandler):
+    def handle_request(self):
+        self.wait_latency()
+        body = self.read_body()
+        fixture = load_fixture(fixture_filename(self.fixtures_path, fixture_key(self.command, self.path, body, self.headers.get('Content-Type', ''))))
+        if fixture is None:
+            self.count_request('missing')
+            logging.warning('No fixture for %s %s', self.command, self.path)
+            self.send_json({ 'message': 'No recorded response for this request' }, status=404)
+            return
+        self.count_request('replayed')
+        self.send_fixture_response(fixture['response'])
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+def start_recorder(upstream: str, fixtures_path: str, port: int = 0):
+    handler_class = type('RecorderHandler', (RecorderHandler,), {
+        'upstream': upstream,
+        'fixtures_path': fixtures_path,
+        'request_counts': {},
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
+
+def start_replay(fixtures_path: str, latency: float = 0.0, latency_jitter: float = 0.0, port: int = 0):
+    handler_class = type('ReplayHandler', (ReplayHandler,), {
+        'fixtures_path': fixtures_path,
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'request_counts': {},
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
@@ -0,0 +1,144 @@
+from mock_server.base import MockRequestHandler, start_mock_server
+from rdflib import BNode, Graph, Literal, URIRef, XSD
+from rdflib.term import Identifier
+import json
+import re
+import threading
+
+# Local stand-in for the SPARQL endpoints of DBLP and HAL, answering SELECT queries in the SPARQL JSON or TSV results format, by GET or POST.
+# Without a graph, the rows are synthesized from the names of the projected variables (counts, years, titles, DOIs, resources), num_rows rows in total,
+# with the LIMIT and OFFSET of the query honored so that paged queries see a consistent result. With a graph, the queries are evaluated on it by rdflib.
+
+select_clause_regex = re.compile(r'\bSELECT\s+(?:DISTINCT\s+|REDUCED\s+)?(.*?)\s*(?:\bWHERE\b|\{)', re.IGNORECASE | re.DOTALL)
+alias_regex = re.compile(r'\(.*?\s+AS\s+\?(\w+)\s*\)', re.IGNORECASE | re.DOTALL)
+aggregate_alias_regex = re.compile(r'\(\s*(?:COUNT|SUM|MIN|MAX|AVG)\s*\(.*?\)\s+AS\s+\?(\w+)\s*\)', re.IGNORECASE | re.DOTALL)
+variable_regex = re.compile(r'[?$](\w+)')
+limit_regex = re.compile(r'\bLIMIT\s+(\d+)', re.IGNORECASE)
+offset_regex = re.compile(r'\bOFFSET\s+(\d+)', re.IGNORECASE)
+
+# Variables projected by a SELECT query, in order
+def projected_variables(query: str) -> list[str]:
+    match = select_clause_regex.search(query)
+    if match is None:
+        return []
+    select_clause = match.group(1)
+    if select_clause.strip() == '*':
+        where_clause = query[match.end():]
+        return list(dict.fromkeys(variable_regex.findall(where_clause)))
+    variables = []
+    # Plain variables and aliased expressions, in the order of the clause
+    position = 0
+    for alias_match in alias_regex.finditer(select_clause):
+        variables += variable_regex.findall(select_clause[position:alias_match.start()])
+        variables.append(alias_match.group(1))
+        position = alias_match.end()
+    variables += variable_regex.findall(select_clause[position:])
+    return list(dict.fromkeys(variables))
+
+def json_term(term: Identifier) -> dict:
+    if isinstance(term, URIRef):
+        return { 'type': 'uri', 'value': str(term) }
+    if isinstance(term, BNode):
+        return { 'type': 'bnode', 'value': str(term) }
+    json_literal = { 'type': 'literal', 'value': str(term) }
+    if isinstance(term, Literal) and term.language != None:
+        json_literal['xml:lang'] = term.language
+    elif isinstance(term, Literal) and term.datatype != None:
+        json_literal['datatype'] = str(term.datatype)
+    return json_literal
+
+def tsv_term(term: Identifier | None) -> str:
+    if term is None:
+        return ''
+    return term.n3()
+
+class SparqlEndpointHandler(MockRequestHandler):
+    num_rows = 10000
+    graph: Graph | None = None
+    query_count = 0
+    lock = threading.Lock()
+
+    def synthetic_term(self, variable: str, index: int, aggregates: set[str]) -> Identifier:
+        name = variable.lower()
+        if variable in aggregates or 'count' in name or 'cites' in name or 'citation' in name:
+            return Literal(max(self.num_rows - index, 0), datatype=XSD.integer)
+        if 'year' in name:
+            return Literal(str(2015 + index % 10), datatype=XSD.gYear)
+        if 'doi' in name:
+            return URIRef(f'https://doi.org/10.{1000 + index % 9000}/mock.{index}')
+        if 'title' in name or 'label' in name or 'name' in name or 'acronym' in name:
+            return Literal(f'{variable.capitalize()} {index}')
+        return URIRef(f'{self.base_url()}/resource/{variable}/{index}')
+
+    def synthetic_rows(self, query: str) -> tuple[list[str], list[dict[str, Identifier]]]:
+        variables = projected_variables(query)
+        limit_match = limit_regex.findall(query)
+        offset_match = offset_regex.findall(query)
+        offset = int(offset_match[-1]) if len(offset_match) > 0 else 0
+        end = self.num_rows if len(limit_match) == 0 else min(offset + int(limit_match[-1]), self.num_rows)
+        aggregates = set(aggregate_alias_regex.findall(query))
+        rows = [ { variable: self.synthetic_term(variable, index, aggregates) for variable in variables } for index in range(offset, end) ]
+        return variables, rows
+
+    def graph_rows(self, query: str) -> tuple[list[str], list[dict[str, Identifier]]]:
+        result = self.graph.query(query) # type: ignore
+        variables = [ str(variable) for variable in result.vars ] # type: ignore
+        rows = [ { variable: term for variable, term in zip(variables, row) if term != None } for row in result ] # type: ignore
+        return variables, rows
+
+    def send_results(self, variables: list[str], rows: list[dict[str, Identifier]], result_format: str):
+        if result_format == 'tsv':
+            lines = [ '\t'.join(f'?{variable}' for variable in variables) ]
+            lines += [ '\t'.join(tsv_term(row.get(variable)) for variable in variables) for row in rows ]
+            self.send_body(('\n'.join(lines) + '\n').encode('utf-8'), 'text/tab-separated-values; charset=utf-8')
+            return
+        bindings = [ { variable: json_term(term) for variable, term in row.items() } for row in rows ]
+        body = json.dumps({ 'head': { 'vars': variables }, 'results': { 'bindings': bindings } }).encode('utf-8')
+        self.send_body(body, 'application/sparql-results+json; charset=utf-8')
+
+    def result_format(self, parameters: dict[str, str]) -> str:
+        requested_format = (parameters.get('format') or parameters.get('output') or self.headers.get('Accept', '')).lower()
+        return 'tsv' if 'tsv' in requested_format or 'tab-separated' in requested_format else 'json'
+
+    def answer(self, query: str | None, parameters: dict[str, str]):
+        self.wait_latency()
+        if query is None or query.strip() == '':
+            self.send_body(b'Missing query', 'text/plain', status=400)
+            return
+        with self.lock:
+            type(self).query_count += 1
+        try:
+            variables, rows = self.graph_rows(query) if self.graph != None else self.synthetic_rows(query)
+        except Exception as e:
+            self.send_body(f'Query evaluation failed: {e}'.encode('utf-8'), 'text/plain', status=400)
+            return
+        self.send_results(variables, rows, self.result_format(parameters))
+
+    def do_GET(self):
+        parameters = self.query_parameters()
+        self.answer(parameters.get('query'), parameters)
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.headers.get('Content-Type', '').startswith('application/sparql-query'):
+            parameters = self.query_parameters()
+            self.answer(body.decode('utf-8'), parameters)
+            return
+        parameters = self.form_parameters(body)
+        self.answer(parameters.get('query'), parameters)
+
+# The graph, if given, is a file parsed by rdflib, e.g. an extract of the DBLP dump
+def start_sparql_endpoint(num_rows: int = 10000, graph_filename: str | None = None, latency: float = 0.0, latency_jitter: float = 0.0, port: int = 0):
+    graph = None
+    if graph_filename != None:
+        graph = Graph()
+        graph.parse(graph_filename)
+    handler_class = type('SparqlEndpointHandler', (SparqlEndpointHandler,), {
+        'num_rows': num_rows,
+        'graph': graph,
+        'latency': latency,
+        'latency_jitter': latency_jitter,
+        'query_count': 0,
+        'lock': threading.Lock(),
+    })
+    return start_mock_server(handler_class, port=port)
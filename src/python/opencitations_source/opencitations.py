@@ -0,0 +1,150 @@
+from array import array
+from typing import Iterable, Iterator
+import csv
+import heapq
+import io
+import logging
+import os
+import zipfile
+
+from kg.knowledge import CitationCount, Source
+from rdflib import URIRef
+from util.files import open_text_file
+from util.progress import ProgressReporter
+from util.pipeline import check_cancelled
+
+# Citation counts computed locally from an OpenCitations dump (https://opencitations.net/download), a CSV file of (citing, cited) pairs.
+# The dump can be a CSV file, gzip-compressed or not, a zip archive of CSV files as distributed by OpenCitations, or a directory of such files.
+opencitations_source_obj = Source(URIRef("https://opencitations.net/index"))
+omid_prefixes = ('https://w3id.org/oc/meta/', 'omid:')
+doi_prefixes = ('https://doi.org/', 'http://doi.org/', 'http://dx.doi.org/', 'https://dx.doi.org/', 'doi:')
+
+# Normalized keys of the counters: "omid:br/..." and "doi:10...", the DOIs being case-insensitive
+def normalize_omid(omid: str) -> str:
+    omid = omid.strip()
+    for prefix in omid_prefixes:
+        if omid.startswith(prefix):
+            return 'omid:' + omid[len(prefix):]
+    return 'omid:' + omid
+
+def normalize_doi(doi: str) -> str:
+    doi = doi.strip()
+    lowered_doi = doi.lower()
+    for prefix in doi_prefixes:
+        if lowered_doi.startswith(prefix):
+            return 'doi:' + lowered_doi[len(prefix):]
+    return 'doi:' + lowered_doi
+
+# Identifiers of a cited column: a single DOI in the former COCI dumps, space-separated prefixed identifiers ("omid:br/... doi:10...") in the current index
+def normalize_identifiers(identifiers: str) -> list[str]:
+    keys = []
+    for identifier in identifiers.split():
+        if identifier.startswith('omid:'):
+            keys.append(normalize_omid(identifier))
+        elif identifier.startswith('doi:') or identifier.startswith('10.'):
+            keys.append(normalize_doi(identifier))
+    return keys
+
+def iter_csv_files(dump_path: str) -> Iterator[io.TextIOBase]:
+    if os.path.isdir(dump_path):
+        for filename in sorted(os.listdir(dump_path)):
+            yield from iter_csv_files(os.path.join(dump_path, filename))
+    elif zipfile.is_zipfile(dump_path):
+        with zipfile.ZipFile(dump_path) as dump_archive:
+            for member in sorted(dump_archive.namelist()):
+                if member.endswith('.csv'):
+                    with dump_archive.open(member) as member_file:
+                        yield io.TextIOWrapper(member_file, encoding='utf-8')
+    elif '.csv' in dump_path:
+        csv_file = open_text_file(dump_path)
+        try:
+            yield csv_file
+        finally:
+            csv_file.close()
+
+def iter_cited_identifiers(dump_path: str) -> Iterator[str]:
+    for csv_file in iter_csv_files(dump_path):
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None:
+            continue
+        cited_column = header.index('cited') if 'cited' in header else 1
+        for row in reader:
+            if len(row) > cited_column:
+                yield row[cited_column]
+
+# Counts the citations of each cited entity.
+# The keys are stored once in a dictionary giving their index in an array of unsigned integers, so that a count costs 4 bytes instead of an int object.
+# The identifiers of an entity (omid and DOI) share the same index.
+class CitationCounter:
+    def __init__(self):
+        self.key_index: dict[str, int] = {}
+        self.counts = array('I')
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add_citation(self, keys: list[str]):
+        index = None
+        for key in keys:
+            index = self.key_index.get(key)
+            if index != None:
+                break
+        if index is None:
+            index = len(self.counts)
+            self.counts.append(0)
+        for key in keys:
+            self.key_index.setdefault(key, index)
+        self.counts[index] += 1
+
+    # Counts the citations of a dump. If only is given, only the citations of these keys are counted, which bounds the memory to the entities of interest
+    def count_dump(self, dump_path: str, only: set[str] | None = None) -> 'CitationCounter':
+        progress = ProgressReporter(f'OpenCitations citations of {dump_path}', interval=30.0)
+        for cited in iter_cited_identifiers(dump_path):
+            progress.update()
+            check_cancelled()
+            keys = normalize_identifiers(cited)
+            if only != None:
+                keys = [ key for key in keys if key in only ]
+            if len(keys) > 0:
+                self.add_citation(keys)
+        progress.close()
+        logging.info(f'{len(self.counts)} cited entities counted in {dump_path}')
+        return self
+
+    def count(self, key: str) -> int:
+        index = self.key_index.get(key)
+        if index is None:
+            return 0
+        return self.counts[index]
+
+    def count_by_doi(self, doi: str) -> int:
+        return self.count(normalize_doi(doi))
+
+    def count_by_omid(self, omid: str) -> int:
+        return self.count(normalize_omid(omid))
+
+    # Citations of a publication known by its omid and/or its DOI
+    def count_publication(self, omid: str | None = None, doi: str | None = None) -> int:
+        if omid != None:
+            omid_count = self.count_by_omid(omid)
+            if omid_count > 0:
+                return omid_count
+        if doi != None:
+            return self.count_by_doi(doi)
+        return 0
+
+    def citation_count(self, omid: str | None = None, doi: str | None = None, source: Source = opencitations_source_obj) -> CitationCount:
+        return CitationCount(source=source, count=self.count_publication(omid=omid, doi=doi))
+
+    # Most cited publications of each year, from (identifier, omid, doi, year) tuples. Publications without citation are left out.
+    def top_per_year(self, publications: Iterable[tuple[str, str | None, str | None, int]], limit: int) -> dict[int, list[tuple[str, int]]]:
+        counts_per_year: dict[int, list[tuple[int, str]]] = {}
+        for identifier, omid, doi, year in publications:
+            count = self.count_publication(omid=omid, doi=doi)
+            if count > 0:
+                counts_per_year.setdefault(year, []).append((count, identifier))
+        return { year: [ (identifier, count) for count, identifier in heapq.nlargest(limit, year_counts) ] for year, year_counts in counts_per_year.items() }
+
+def load_citation_counter(dump_path: str, only: set[str] | None = None) -> CitationCounter:
+    return CitationCounter().count_dump(dump_path, only)
@@ -1,74 +1,165 @@
 from kg.knowledge import UniqueIdentifier, Paper, Repository, Source
-from util.utilities import create_uri, sanitize, sanitize_uri
+from util.utilities import create_uri, sanitize
+from util.dataset import merge_ntriples_files, write_source_graph
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.pipeline import check_cancelled
+from util.json_stream import iter_json_array
+from util.progress import ProgressReporter
+from util.logging_setup import configure_worker_logging, start_worker_logging
 from kg.CONSTANTS import ARXIV
-from rdflib import Graph, Literal, URIRef
-from rdflib.namespace import DCTERMS, DCAT, RDF, RDFS
-import json
-import datetime
+from rdflib import Graph
+import concurrent.futures
+import multiprocessing
 import os
 import logging
 
 # sources url
 paper_with_code_url = 'http://paperwithcode.com/'
 
-g_pwc_paper = Graph()
+g_pwc_paper = memory_budget.register('paper_with_code_Papers', LazyGraph())
 g_pwc_paper_filename = 'data/rdf/paper/paper_with_code_Papers.ttl'
-g_pwc_code = Graph()
+g_pwc_code = memory_budget.register('paper_with_code_Code', LazyGraph())
 g_pwc_code_filename = 'data/rdf/software/paper_with_code_Code.ttl'
+paper_and_code_filename = 'data/PaperWithCode/links-between-papers-and-code.json'
+pwc_shard_path = 'data/PaperWithCode/shards/'
+pwc_shard_size = 10000
+
+# The dump can be used as downloaded, gzip-compressed
+def paper_and_code_filepath() -> str:
+    if os.path.exists(paper_and_code_filename):
+        return paper_and_code_filename
+    return paper_and_code_filename + '.gz'
+
+# Converts one record of the links dump, adding the paper to the paper graph and the repository to the code graph
+def convert_paper_with_code_record(paper: dict, pwc_source_obj: Source, paper_graph: Graph, code_graph: Graph):
+    if paper.get('paper_url') == None or paper['paper_url'] == '':
+        return
+    # Add the paper to the graph
+    paper_uri = create_uri(paper['paper_url'])
+    pwc_paper_obj = Paper(pwc_source_obj, paper_uri)
+    paper_title_string = ""
+    if paper['paper_title'] != None:
+        paper_title_string = sanitize(paper['paper_title'])
+    pwc_paper_obj.set_title(paper_title_string)
+    paper_pdf_string = paper['paper_url_pdf']
+    paper_arxiv_string = paper['paper_arxiv_id']
+    if paper_pdf_string != None:
+        pwc_paper_obj.add_download_url(paper_pdf_string)
+    if paper_arxiv_string != None:
+        arxiv_uri = create_uri(ARXIV + paper_arxiv_string)
+        arxiv_id_obj = UniqueIdentifier(pwc_source_obj, arxiv_uri)
+        pwc_paper_obj.add_identifier(arxiv_id_obj)
+
+    # Add the code to the graph
+    paper_repo = create_uri(paper['repo_url'])
+    repo_obj = Repository(pwc_source_obj, paper_repo)
+    pwc_paper_obj.add_related(repo_obj)
+    repo_obj.to_rdf(code_graph)
+
+    pwc_paper_obj.to_rdf(paper_graph)
+    logging.debug('Added paper %s and code %s', paper_title_string, paper_repo)
+
+def paper_with_code_source() -> Source:
+    return Source(create_uri(paper_with_code_url))
 
 # Parse the Paper with code json files and creates the corresponding data containing information on the papers and the code
-def process_paper_with_code():
-
-    # Load the json files
-    paper_and_code_file = open("data/PaperWithCode/links-between-papers-and-code.json", 'r')
-    paper_and_code_result = json.load(paper_and_code_file)
-    paper_and_code_file.close()
-
-    paper_with_code = create_uri(paper_with_code_url)
-    num_papers = len(paper_and_code_result)
-    pwc_source_obj = Source.Builder(URIRef(paper_with_code)).build()
-
-    for paper in paper_and_code_result:
-        # Add the paper to the graph
-        paper_uri = create_uri(sanitize_uri(paper['paper_url']))
-        pwc_paper_obj_builder = Paper.Builder(pwc_source_obj, paper_uri)
-        if paper_uri == None or paper_uri == '':
-            continue
-        paper_title_string = ""
-        if paper['paper_title'] != None:
-            paper_title_string = sanitize(paper['paper_title'])
-        pwc_paper_obj_builder.set_title(paper_title_string)
-        paper_pdf_string = paper['paper_url_pdf']
-        paper_arxiv_string = paper['paper_arxiv_id']
-        if paper_pdf_string != None:
-            pwc_paper_obj_builder.add_download_url(paper_pdf_string)
-        if paper_arxiv_string != None:
-            arxiv_uri = create_uri(ARXIV + paper_arxiv_string)
-            arxiv_id_obj = UniqueIdentifier.Builder(pwc_source_obj, arxiv_uri).build()
-            pwc_paper_obj_builder.add_identifier(arxiv_id_obj)
-        
-        # Add the code to the graph
-        paper_repo = create_uri(paper['repo_url'])
-        repo_obj_obj = Repository.Builder(pwc_source_obj, paper_repo).build()
-        pwc_paper_obj_builder.add_related(repo_obj_obj)
-        repo_obj_obj.to_rdf(g_pwc_code)
-
-        pwc_paper_obj = pwc_paper_obj_builder.build()
-        pwc_paper_obj.to_rdf(g_pwc_paper)
-        logging.info(f'Added paper {paper_title_string} and code {paper_repo} ({num_papers} remaining)')
-        num_papers -= 1
+def process_paper_with_code(num_workers: int | None = None):
+    if num_workers is None:
+        num_workers = int(os.getenv('pwc_workers', '1'))
+    if num_workers > 1:
+        process_paper_with_code_sharded(num_workers)
+        return
+
+    pwc_source_obj = paper_with_code_source()
+    progress = ProgressReporter('Paper with code links')
+
+    # The links are read one at a time from the json file
+    for paper in iter_json_array(paper_and_code_filepath()):
+        progress.update()
+        convert_paper_with_code_record(paper, pwc_source_obj, g_pwc_paper, g_pwc_code)
+        memory_budget.check(g_pwc_paper, g_pwc_code)
+        check_cancelled()
+    progress.close()
 
     write_paper_with_code_graph()
 
+# Sharded conversion
+# The records of the dump are sent by batches to worker processes. Each batch is a shard, converted into its own paper and code N-Triples files.
+# The shards are then concatenated into the paper and code Turtle files, without going through a graph, so that the merge stays a fraction of the conversion time.
+def shard_filenames(shard_index: int) -> tuple[str, str]:
+    return (f'{pwc_shard_path}papers_{shard_index:05d}.nt', f'{pwc_shard_path}code_{shard_index:05d}.nt')
+
+def convert_paper_with_code_shard(shard_index: int, records: list[dict], pwc_source_obj: Source) -> tuple[str, str]:
+    paper_graph = Graph()
+    code_graph = Graph()
+    for paper in records:
+        convert_paper_with_code_record(paper, pwc_source_obj, paper_graph, code_graph)
+    paper_shard_filename, code_shard_filename = shard_filenames(shard_index)
+    paper_graph.serialize(destination=paper_shard_filename, format='nt', encoding='utf-8')
+    code_graph.serialize(destination=code_shard_filename, format='nt', encoding='utf-8')
+    return paper_shard_filename, code_shard_filename
+
+def merge_ntriples_shards(shard_filenames: list[str], filename: str):
+    merge_ntriples_files(shard_filenames, filename)
+    for shard_filename in shard_filenames:
+        os.remove(shard_filename)
+
+def process_paper_with_code_sharded(num_workers: int, shard_size: int = pwc_shard_size):
+    os.makedirs(pwc_shard_path, exist_ok=True)
+    # The source is shared by all the shards, so that they all give it the same refresh dates
+    pwc_source_obj = paper_with_code_source()
+    progress = ProgressReporter('Paper with code links')
+    paper_shard_filenames: list[str] = []
+    code_shard_filenames: list[str] = []
+
+    pending = set()
+    # The workers are not forked from this process, whose threads (other stages, logging, metrics) may hold locks that a forked child would inherit held:
+    # they are started by a fork server, or spawned where there is none, and import this module to run the shards
+    mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    worker_queue, worker_listener = start_worker_logging(mp_context)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context, initializer=configure_worker_logging, initargs=(worker_queue, logging.getLogger().level)) as executor:
+        def collect_done_shards(return_when):
+            done, not_done = concurrent.futures.wait(pending, return_when=return_when)
+            for future in done:
+                paper_shard_filename, code_shard_filename = future.result()
+                paper_shard_filenames.append(paper_shard_filename)
+                code_shard_filenames.append(code_shard_filename)
+            return not_done
+
+        shard_index = 0
+        records = []
+        for paper in iter_json_array(paper_and_code_filepath()):
+            progress.update()
+            check_cancelled()
+            records.append(paper)
+            if len(records) == shard_size:
+                pending.add(executor.submit(convert_paper_with_code_shard, shard_index, records, pwc_source_obj))
+                shard_index += 1
+                records = []
+                # Bounds the number of shards held in memory waiting for a worker
+                if len(pending) >= num_workers * 2:
+                    pending = collect_done_shards(concurrent.futures.FIRST_COMPLETED)
+        if len(records) > 0:
+            pending.add(executor.submit(convert_paper_with_code_shard, shard_index, records, pwc_source_obj))
+        collect_done_shards(concurrent.futures.ALL_COMPLETED)
+    worker_listener.stop()
+    progress.close()
+
+    logging.info(f'Merging {len(paper_shard_filenames)} paper with code shards')
+    merge_ntriples_shards(sorted(paper_shard_filenames), g_pwc_paper_filename)
+    merge_ntriples_shards(sorted(code_shard_filenames), g_pwc_code_filename)
+    logging.info('Paper with code paper graph written to file')
+
 def write_paper_with_code_graph():
     # writing g to a file
     if len(g_pwc_paper) > 0:
         logging.info(f'Writing paper with code paper graph to file {len(g_pwc_paper)} triples')
-        g_pwc_paper.serialize(destination=g_pwc_paper_filename, format='turtle')
+        write_source_graph(g_pwc_paper, g_pwc_paper_filename)
     g_pwc_paper.close()
     if len(g_pwc_code) > 0:
         logging.info(f'Writing paper with code paper code graph to file {len(g_pwc_code)} triples')
-        g_pwc_code.serialize(destination=g_pwc_code_filename, format='turtle')
+        write_source_graph(g_pwc_code, g_pwc_code_filename)
     g_pwc_code.close()
     if len(g_pwc_paper) > 0 or len(g_pwc_code) > 0:
         logging.info('Paper with code paper graph written to file')
@@ -0,0 +1,383 @@
+from array import array
+from dataclasses import dataclass, field
+import argparse
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import time
+
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import DCMITYPE, DCTERMS, FOAF, OWL, RDF, RDFS
+
+from kg.CONSTANTS import ADMS, BIBO, DOAP, LOCAL, ORCID, ROH
+
+# Materialized join of the research teams and their public repositories, over the graphs of all the sources:
+#   organization <- foaf:member - person <- dcterms:contributor - paper - dcterms:relation -> repository
+#   organization <- foaf:member - person <- dcterms:creator - software - doap:repository -> repository
+# and the papers and software linked directly to an organization (the structures of a HAL article, the organizations creating a software).
+# The papers and the software are the works of the index. The entities of different sources are identified by their shared identifiers
+# (adms:identifier, owl:sameAs, DOI, ORCID), the organizations without identifier by their label, and the repositories by their normalized url.
+# The index holds the adjacency of each level (organization -> people, person -> works, organization -> works, work -> repositories) as integer arrays,
+# and the repositories of each organization with the number of works and people leading to them, so that a team is answered without joining the graphs.
+team_index_filename = 'data/index/team/team_index.pickle'
+graph_path = 'data/rdf/'
+
+# An identifier shared by more entities than this is not specific to one of them (e.g. the url of a source), it does not identify them together
+max_identifier_entities = 20
+
+identity_predicates = { ADMS.identifier, OWL.sameAs, BIBO.doi }
+repository_types = { DCMITYPE.Software, LOCAL.GitlabRepo }
+
+# Kinds of the entities, an entity of several sources can have several
+ORGANIZATION, PERSON, WORK, REPOSITORY = 1, 2, 4, 8
+
+# Url of a repository without scheme, credentials, trailing slash or .git, so that the links of HAL, Papers with Code, GitHub and Gitlab to a repository match
+def normalize_repository(url: str) -> str:
+    url = url.strip().lower()
+    url = re.sub(r'^(git\+)?[a-z]+://', '', url)
+    url = re.sub(r'^[^/@]*@', '', url)
+    url = re.sub(r'^www\.', '', url)
+    url = re.sub(r'^([^/:]+):(?!\d)', r'\1/', url)
+    url = re.sub(r'(\.git)?/*$', '', url)
+    return 'https://' + url
+
+def normalize_label(label: str) -> str:
+    return 'label:' + ' '.join(label.casefold().split())
+
+class UnionFind:
+    def __init__(self):
+        self.parents: dict[str, str] = {}
+
+    def find(self, key: str) -> str:
+        parents = self.parents
+        if key not in parents:
+            parents[key] = key
+            return key
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    def union(self, key: str, other_key: str):
+        root, other_root = self.find(key), self.find(other_key)
+        if root != other_root:
+            # The smallest key is kept as the root, so that the classes do not depend on the order of the files
+            if other_root < root:
+                root, other_root = other_root, root
+            self.parents[other_root] = root
+
+# Compressed adjacency of integer ids: the neighbours of node i are targets[offsets[i]:offsets[i + 1]]
+def compressed_adjacency(adjacency: dict[int, set[int]], num_nodes: int) -> tuple[array, array]:
+    offsets, targets = array('I', [ 0 ]), array('I')
+    for node in range(num_nodes):
+        targets.extend(sorted(adjacency.get(node, ())))
+        offsets.append(len(targets))
+    return offsets, targets
+
+def neighbours(adjacency: tuple[array, array], node: int) -> array:
+    offsets, targets = adjacency
+    return targets[offsets[node]:offsets[node + 1]]
+
+@dataclass
+class TeamIndex:
+    organization_names: list[str]
+    organization_labels: list[str]
+    person_names: list[str]
+    work_names: list[str]
+    repository_names: list[str]
+    organization_people: tuple[array, array]
+    person_works: tuple[array, array]
+    organization_works: tuple[array, array]
+    work_repositories: tuple[array, array]
+    # Organization of each key: URIs of the organization and of its identifiers, and normalized labels
+    organization_keys: dict[str, int]
+    # Repositories of each organization, the most linked first, with the number of works and of people leading to them
+    organization_repositories: tuple[array, array] = field(default_factory=lambda: (array('I', [ 0 ]), array('I')))
+    repository_works: array = field(default_factory=lambda: array('I'))
+    repository_people: array = field(default_factory=lambda: array('I'))
+    organization_num_works: array = field(default_factory=lambda: array('I'))
+
+    # Joins the levels of the index into the repositories of each organization
+    def materialize(self):
+        offsets, targets = array('I', [ 0 ]), array('I')
+        repository_works, repository_people, organization_num_works = array('I'), array('I'), array('I')
+        for organization in range(len(self.organization_names)):
+            works: set[int] = set(neighbours(self.organization_works, organization))
+            repository_work_sets: dict[int, set[int]] = {}
+            repository_person_sets: dict[int, set[int]] = {}
+            for person in neighbours(self.organization_people, organization):
+                for work in neighbours(self.person_works, person):
+                    works.add(work)
+                    for repository in neighbours(self.work_repositories, work):
+                        repository_person_sets.setdefault(repository, set()).add(person)
+            for work in works:
+                for repository in neighbours(self.work_repositories, work):
+                    repository_work_sets.setdefault(repository, set()).add(work)
+            repositories = sorted(repository_work_sets, key=lambda repository: (-len(repository_work_sets[repository]), -len(repository_person_sets.get(repository, ())), self.repository_names[repository]))
+            targets.extend(repositories)
+            repository_works.extend(len(repository_work_sets[repository]) for repository in repositories)
+            repository_people.extend(len(repository_person_sets.get(repository, ())) for repository in repositories)
+            offsets.append(len(targets))
+            organization_num_works.append(len(works))
+        self.organization_repositories = (offsets, targets)
+        self.repository_works = repository_works
+        self.repository_people = repository_people
+        self.organization_num_works = organization_num_works
+
+    def save(self, filename: str = team_index_filename):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        index_file = open(filename + '.tmp', 'wb')
+        # Pickled as a dictionary, so that an index built by "python -m postprocessing.team_index" does not refer to its __main__ module
+        pickle.dump(vars(self), index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        index_file.close()
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename: str = team_index_filename) -> 'TeamIndex':
+        index_file = open(filename, 'rb')
+        index = cls(**pickle.load(index_file))
+        index_file.close()
+        return index
+
+    # The organization is given by its URI, the URI of one of its identifiers (e.g. its ROR or its HAL structure) or its label
+    def organization_id(self, organization: str) -> int | None:
+        organization = organization.strip()
+        if organization in self.organization_keys:
+            return self.organization_keys[organization]
+        return self.organization_keys.get(normalize_label(organization))
+
+    def repositories(self, organization: str, limit: int | None = None) -> list[dict]:
+        organization_id = self.organization_id(organization)
+        if organization_id is None:
+            return []
+        offsets, targets = self.organization_repositories
+        start, end = offsets[organization_id], offsets[organization_id + 1]
+        if limit != None:
+            end = min(end, start + limit)
+        return [ { 'repository': self.repository_names[targets[i]], 'works': self.repository_works[i], 'people': self.repository_people[i] } for i in range(start, end) ]
+
+    def people(self, organization: str) -> list[str]:
+        organization_id = self.organization_id(organization)
+        if organization_id is None:
+            return []
+        return [ self.person_names[person] for person in neighbours(self.organization_people, organization_id) ]
+
+    def summary(self, organization: str, limit: int | None = 10) -> dict | None:
+        organization_id = self.organization_id(organization)
+        if organization_id is None:
+            return None
+        offsets, _ = self.organization_repositories
+        return {
+            'organization': self.organization_names[organization_id],
+            'label': self.organization_labels[organization_id],
+            'people': len(neighbours(self.organization_people, organization_id)),
+            'works': self.organization_num_works[organization_id],
+            'repositories': offsets[organization_id + 1] - offsets[organization_id],
+            'top_repositories': self.repositories(organization, limit),
+        }
+
+    # Organizations with the most repositories
+    def top_organizations(self, limit: int = 10) -> list[dict]:
+        offsets, _ = self.organization_repositories
+        organizations = sorted(range(len(self.organization_names)), key=lambda organization: offsets[organization] - offsets[organization + 1])[:limit]
+        return [ { 'organization': self.organization_names[organization], 'label': self.organization_labels[organization], 'repositories': offsets[organization + 1] - offsets[organization] } for organization in organizations ]
+
+class TeamIndexBuilder:
+    def __init__(self):
+        self.keys = UnionFind()
+        self.kinds: dict[str, int] = {}
+        self.labels: dict[str, str] = {}
+        # Entities of each identifier, and identifiers of each entity
+        self.identified_entities: dict[str, set[str]] = {}
+        self.entity_identifiers: dict[str, set[str]] = {}
+        self.members: set[tuple[str, str]] = set()
+        self.creators: set[tuple[str, str]] = set()
+        self.relations: set[tuple[str, str]] = set()
+        # Works and the normalized urls of their repositories
+        self.repository_links: set[tuple[str, str]] = set()
+
+    def add_kind(self, node: str, kind: int):
+        self.kinds[node] = self.kinds.get(node, 0) | kind
+
+    def add_identifier(self, node: str, identifier: str):
+        self.identified_entities.setdefault(identifier, set()).add(node)
+        self.entity_identifiers.setdefault(node, set()).add(identifier)
+
+    # Reads the edges of the join from a graph file. The blank nodes are only valid in their file, their keys are prefixed by its index.
+    def add_graph_file(self, filename: str, file_index: int):
+        graph = Graph()
+        graph.parse(filename, format='nt' if filename.endswith('.nt') else 'turtle')
+        def node_key(node) -> str:
+            return str(node) if isinstance(node, URIRef) else f'_:{file_index}:{node}'
+        for subject, predicate, object in graph:
+            subject_key = node_key(subject)
+            if isinstance(object, Literal):
+                value = str(object).strip()
+                if value in ('', 'None'):
+                    continue
+                if predicate == DOAP.repository:
+                    self.add_kind(subject_key, WORK)
+                    self.repository_links.add((subject_key, normalize_repository(value)))
+                elif predicate == ROH.ORCID:
+                    self.add_identifier(subject_key, str(ORCID) + value.upper())
+                elif predicate == RDFS.label:
+                    self.labels[subject_key] = value
+            elif predicate in identity_predicates:
+                if isinstance(object, URIRef):
+                    self.add_identifier(subject_key, str(object))
+            elif predicate == RDF.type:
+                if object == FOAF.Organization:
+                    self.add_kind(subject_key, ORGANIZATION)
+                elif object == FOAF.Person:
+                    self.add_kind(subject_key, PERSON)
+                elif object == BIBO.Document:
+                    self.add_kind(subject_key, WORK)
+                elif object in repository_types and isinstance(subject, URIRef):
+                    self.add_kind(subject_key, REPOSITORY)
+                    self.keys.union(normalize_repository(subject_key), subject_key)
+            elif predicate == FOAF.member:
+                self.members.add((subject_key, node_key(object)))
+            elif predicate in (DCTERMS.contributor, DCTERMS.creator):
+                self.add_kind(subject_key, WORK)
+                self.creators.add((subject_key, node_key(object)))
+            elif predicate == DCTERMS.relation:
+                self.relations.add((subject_key, node_key(object)))
+        graph.close()
+
+    def specific_identifiers(self, node: str) -> list[str]:
+        return [ identifier for identifier in self.entity_identifiers.get(node, ()) if len(self.identified_entities[identifier]) <= max_identifier_entities ]
+
+    def build(self) -> TeamIndex:
+        keys = self.keys
+        for node in self.entity_identifiers:
+            for identifier in self.specific_identifiers(node):
+                keys.union(identifier, node)
+        for node, kind in self.kinds.items():
+            # The organizations without identifier, always blank nodes, are identified by their label
+            if kind & ORGANIZATION and node in self.labels and len(self.specific_identifiers(node)) == 0:
+                keys.union(normalize_label(self.labels[node]), node)
+        for _, repository in self.repository_links:
+            self.add_kind(repository, REPOSITORY)
+
+        # Kinds and keys of each class of identified entities
+        class_kinds: dict[str, int] = {}
+        for node, kind in self.kinds.items():
+            root = keys.find(node)
+            class_kinds[root] = class_kinds.get(root, 0) | kind
+        class_keys: dict[str, list[str]] = {}
+        for key in sorted(keys.parents):
+            root = keys.find(key)
+            if root in class_kinds and not key.startswith('_:'):
+                class_keys.setdefault(root, []).append(key)
+        class_labels: dict[str, str] = {}
+        for node in sorted(self.labels):
+            class_labels.setdefault(keys.find(node), self.labels[node])
+
+        # Integer ids of the classes of each kind
+        ids: dict[int, dict[str, int]] = { kind: {} for kind in (ORGANIZATION, PERSON, WORK, REPOSITORY) }
+        for root in sorted(class_kinds):
+            for kind, kind_ids in ids.items():
+                if class_kinds[root] & kind:
+                    kind_ids[root] = len(kind_ids)
+        def class_id(node: str, kind: int) -> int | None:
+            return ids[kind].get(keys.find(node))
+        def add_edge(adjacency: dict[int, set[int]], node: int | None, other_node: int | None):
+            if node != None and other_node != None:
+                adjacency.setdefault(node, set()).add(other_node)
+
+        organization_people: dict[int, set[int]] = {}
+        for person, organization in self.members:
+            add_edge(organization_people, class_id(organization, ORGANIZATION), class_id(person, PERSON))
+        person_works: dict[int, set[int]] = {}
+        organization_works: dict[int, set[int]] = {}
+        for work, creator in self.creators:
+            add_edge(person_works, class_id(creator, PERSON), class_id(work, WORK))
+            add_edge(organization_works, class_id(creator, ORGANIZATION), class_id(work, WORK))
+        work_repositories: dict[int, set[int]] = {}
+        for work, repository in self.repository_links:
+            add_edge(work_repositories, class_id(work, WORK), class_id(repository, REPOSITORY))
+        for work, related in self.relations:
+            add_edge(work_repositories, class_id(work, WORK), class_id(related, REPOSITORY))
+            add_edge(organization_works, class_id(related, ORGANIZATION), class_id(work, WORK))
+
+        # Each class is named by one of its URIs, the url of a repository, and the label of an organization without identifier
+        def class_names(kind: int) -> list[str]:
+            names = []
+            for root in ids[kind]:
+                root_keys = class_keys.get(root, [])
+                if kind == REPOSITORY:
+                    names.append(next((key for key in root_keys if key == normalize_repository(key)), root_keys[0] if root_keys else root))
+                else:
+                    names.append(next((key for key in root_keys if not key.startswith('label:')), class_labels.get(root, root)))
+            return names
+        index = TeamIndex(
+            organization_names=class_names(ORGANIZATION),
+            organization_labels=[ class_labels.get(root, '') for root in ids[ORGANIZATION] ],
+            person_names=class_names(PERSON),
+            work_names=class_names(WORK),
+            repository_names=class_names(REPOSITORY),
+            organization_people=compressed_adjacency(organization_people, len(ids[ORGANIZATION])),
+            person_works=compressed_adjacency(person_works, len(ids[PERSON])),
+            organization_works=compressed_adjacency(organization_works, len(ids[ORGANIZATION])),
+            work_repositories=compressed_adjacency(work_repositories, len(ids[WORK])),
+            organization_keys={ key: ids[ORGANIZATION][root] for root in ids[ORGANIZATION] for key in class_keys.get(root, []) },
+        )
+        # The organizations with identifiers can also be looked up by their labels
+        for node in sorted(self.labels):
+            organization_id = class_id(node, ORGANIZATION) if self.kinds.get(node, 0) & ORGANIZATION else None
+            if organization_id != None:
+                index.organization_keys.setdefault(normalize_label(self.labels[node]), organization_id)
+        index.materialize()
+        return index
+
+def build_team_index(paths: list[str] | None = None, filename: str = team_index_filename) -> TeamIndex:
+    from service.store import graph_filenames
+    start_time = time.monotonic()
+    builder = TeamIndexBuilder()
+    for file_index, graph_filename in enumerate(graph_filenames(paths if paths != None else [ graph_path ])):
+        builder.add_graph_file(graph_filename, file_index)
+        logging.info(f'Team index: read {graph_filename}')
+    index = builder.build()
+    index.save(filename)
+    logging.info(f'Team index built in {time.monotonic() - start_time:.1f}s: {len(index.organization_names)} organizations, {len(index.person_names)} people, '
+                 f'{len(index.work_names)} works, {len(index.repository_names)} repositories, {len(index.organization_repositories[1])} organization repositories')
+    return index
+
+# python -m postprocessing.team_index build [files or directories]
+# python -m postprocessing.team_index repositories <URI, identifier or label of the organization>
+# python -m postprocessing.team_index top
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m postprocessing.team_index', description='Build or query the index of the repositories of the research teams')
+    parser.add_argument('--index', default=team_index_filename)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='join the graphs into the index')
+    build_parser.add_argument('graphs', nargs='*', help='files or directories of the graph (data/rdf/ by default)')
+    repositories_parser = subparsers.add_parser('repositories', help='summary and repositories of an organization')
+    repositories_parser.add_argument('organization', help='URI, identifier or label of the organization')
+    repositories_parser.add_argument('--limit', type=int, default=20)
+    top_parser = subparsers.add_parser('top', help='organizations with the most repositories')
+    top_parser.add_argument('--limit', type=int, default=10)
+    arguments = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if arguments.command == 'build':
+        build_team_index(arguments.graphs or None, arguments.index)
+        return 0
+    index = TeamIndex.load(arguments.index)
+    if arguments.command == 'top':
+        print(json.dumps(index.top_organizations(arguments.limit), indent=1, ensure_ascii=False))
+        return 0
+    start_time = time.perf_counter()
+    summary = index.summary(arguments.organization, arguments.limit)
+    elapsed_time = time.perf_counter() - start_time
+    if summary is None:
+        print(f'Unknown organization {arguments.organization}')
+        return 1
+    print(json.dumps(summary, indent=1, ensure_ascii=False))
+    print(f'Answered in {elapsed_time * 1000:.2f} ms')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+from array import array
+from dataclasses import dataclass, field
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import sys
+import time
+import unicodedata
+
+from util.pipeline import path_fingerprint
+
+# Full-text index of the titles, abstracts, keywords and labels of the papers and software of the graph, ranked with BM25.
+# The index has one segment per graph file of the pipeline, so that a source harvested again only rebuilds its own segment.
+# A segment holds the URIs of its entities, their lengths in tokens, and for each term the ids of the entities containing it with the term frequencies,
+# as arrays of integers pickled together. The statistics of BM25 (number of entities, document frequencies, mean length) are summed over the segments at query time.
+text_index_path = 'data/index/text/'
+manifest_filename = 'manifest.json'
+# Graph files indexed, with the kind of their entities
+indexed_graph_paths = { 'data/rdf/paper/': 'paper', 'data/rdf/article/': 'paper', 'data/rdf/software/': 'software', 'data/rdf/data.ttl': 'paper' }
+
+dcterms = 'http://purl.org/dc/terms/'
+# Indexed predicates, with the number of times their tokens are counted, so that a title weighs more than an abstract
+indexed_predicates = {
+    f'{dcterms}title': 2,
+    'http://www.w3.org/2000/01/rdf-schema#label': 2,
+    f'{dcterms}subject': 2,
+    f'{dcterms}abstract': 1,
+}
+
+bm25_k1 = 1.2
+bm25_b = 0.75
+
+token_regex = re.compile(r'[^\W_]+')
+stopwords = set('''
+a an and are as at be by for from has have in into is it its of on or that the their this to was were which with we our not can using based via
+au aux avec ce ces dans de des du en et est il la le les leur par pas pour qui que sa se ses son sur un une
+'''.split())
+
+def tokenize(text: str) -> list[str]:
+    # Lowercase and without accents, so that "Réseaux" and "reseaux" are the same term
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return [ token for token in token_regex.findall(text) if len(token) > 1 and token not in stopwords ]
+
+@dataclass
+class Segment:
+    name: str
+    kind: str
+    fingerprint: list
+    uris: list[str] = field(default_factory=list)
+    lengths: array = field(default_factory=lambda: array('I'))
+    # Term: (entity ids, in increasing order, and term frequencies)
+    postings: dict[str, tuple[array, array]] = field(default_factory=dict)
+
+    def num_tokens(self) -> int:
+        return sum(self.lengths)
+
+def segment_name(filename: str) -> str:
+    return re.sub(r'[^A-Za-z0-9]+', '_', os.path.splitext(os.path.relpath(filename, 'data/rdf'))[0]).strip('_')
+
+def indexed_graph_files(graph_paths: dict[str, str] = indexed_graph_paths) -> list[tuple[str, str]]:
+    files = []
+    for path, kind in graph_paths.items():
+        if os.path.isfile(path):
+            files.append((path, kind))
+        elif os.path.isdir(path):
+            files += [ (os.path.join(path, filename), kind) for filename in sorted(os.listdir(path)) if filename.endswith(('.ttl', '.nt')) ]
+    return files
+
+# Reads the indexed literals of a graph file, by entity
+def entity_texts(filename: str) -> dict[str, list[tuple[str, int]]]:
+    from rdflib import Graph, URIRef
+    graph = Graph()
+    graph.parse(filename, format='nt' if filename.endswith('.nt') else 'turtle')
+    texts: dict[str, list[tuple[str, int]]] = {}
+    for predicate, weight in indexed_predicates.items():
+        for entity, text in graph.subject_objects(URIRef(predicate)):
+            # The blank nodes can not be linked back to, and the labels of the identifiers and sources are not text
+            if isinstance(entity, URIRef) and str(text) not in ('', 'None', str(entity)):
+                texts.setdefault(str(entity), []).append((str(text), weight))
+    graph.close()
+    return texts
+
+def build_segment(filename: str, kind: str) -> Segment:
+    segment = Segment(segment_name(filename), kind, path_fingerprint(filename))
+    term_postings: dict[str, tuple[array, array]] = {}
+    for entity_id, (uri, texts) in enumerate(sorted(entity_texts(filename).items())):
+        term_frequencies: dict[str, int] = {}
+        for text, weight in texts:
+            for token in tokenize(text):
+                term_frequencies[token] = term_frequencies.get(token, 0) + weight
+        segment.uris.append(uri)
+        segment.lengths.append(sum(term_frequencies.values()))
+        for term, frequency in term_frequencies.items():
+            if term not in term_postings:
+                term_postings[term] = (array('I'), array('H'))
+            entity_ids, frequencies = term_postings[term]
+            entity_ids.append(entity_id)
+            frequencies.append(min(frequency, 0xFFFF))
+    segment.postings = term_postings
+    return segment
+
+def segment_filename(index_path: str, name: str) -> str:
+    return os.path.join(index_path, f'{name}.idx')
+
+def save_segment(index_path: str, segment: Segment):
+    filename = segment_filename(index_path, segment.name)
+    segment_file = open(filename + '.tmp', 'wb')
+    # Pickled as a dictionary, so that the segments built by "python -m postprocessing.text_index" do not refer to its __main__ module
+    pickle.dump(vars(segment), segment_file, protocol=pickle.HIGHEST_PROTOCOL)
+    segment_file.close()
+    os.replace(filename + '.tmp', filename)
+
+def load_segment(index_path: str, name: str) -> Segment:
+    segment_file = open(segment_filename(index_path, name), 'rb')
+    segment = Segment(**pickle.load(segment_file))
+    segment_file.close()
+    return segment
+
+def load_manifest(index_path: str) -> dict:
+    filename = os.path.join(index_path, manifest_filename)
+    if not os.path.exists(filename):
+        return {}
+    manifest_file = open(filename, 'r')
+    manifest = json.load(manifest_file)
+    manifest_file.close()
+    return manifest
+
+# Builds the segments of the graph files that changed since the last build, and removes the segments of the files that no longer exist.
+# Returns the number of segments rebuilt.
+def build_text_index(index_path: str = text_index_path, graph_paths: dict[str, str] = indexed_graph_paths) -> int:
+    os.makedirs(index_path, exist_ok=True)
+    manifest = load_manifest(index_path)
+    new_manifest = {}
+    num_built_segments = 0
+    for filename, kind in indexed_graph_files(graph_paths):
+        name = segment_name(filename)
+        fingerprint = path_fingerprint(filename)
+        if name in manifest and manifest[name]['fingerprint'] == fingerprint and manifest[name]['kind'] == kind and os.path.exists(segment_filename(index_path, name)):
+            new_manifest[name] = manifest[name]
+            continue
+        start_time = time.monotonic()
+        segment = build_segment(filename, kind)
+        save_segment(index_path, segment)
+        new_manifest[name] = { 'filename': filename, 'kind': kind, 'fingerprint': fingerprint, 'entities': len(segment.uris), 'terms': len(segment.postings) }
+        num_built_segments += 1
+        logging.info(f'Text index segment {name}: {len(segment.uris)} entities, {len(segment.postings)} terms in {time.monotonic() - start_time:.1f}s')
+    for name in manifest:
+        if name not in new_manifest and os.path.exists(segment_filename(index_path, name)):
+            os.remove(segment_filename(index_path, name))
+    manifest_file = open(os.path.join(index_path, manifest_filename + '.tmp'), 'w')
+    json.dump(new_manifest, manifest_file, indent=1)
+    manifest_file.close()
+    os.replace(os.path.join(index_path, manifest_filename + '.tmp'), os.path.join(index_path, manifest_filename))
+    logging.info(f'Text index: {num_built_segments} of {len(new_manifest)} segments rebuilt')
+    return num_built_segments
+
+class TextIndex:
+    def __init__(self, segments: list[Segment]):
+        self.segments = segments
+        self.num_entities = sum(len(segment.uris) for segment in segments)
+        self.mean_length = sum(segment.num_tokens() for segment in segments) / max(self.num_entities, 1)
+        # Length normalization of BM25 for each entity of each segment, computed once instead of for each posting
+        self.length_norms = [ [ bm25_k1 * (1 - bm25_b + bm25_b * length / max(self.mean_length, 1.0)) for length in segment.lengths ] for segment in segments ]
+
+    @classmethod
+    def load(cls, index_path: str = text_index_path) -> 'TextIndex':
+        return cls([ load_segment(index_path, name) for name in load_manifest(index_path) if os.path.exists(segment_filename(index_path, name)) ])
+
+    def idf(self, term: str) -> float:
+        document_frequency = sum(len(segment.postings[term][0]) for segment in self.segments if term in segment.postings)
+        return math.log(1 + (self.num_entities - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    # Entities matching the query, the best first, as (uri, kind, score).
+    # An entity found in several graph files, e.g. a paper of two sources, has the best of its scores.
+    def search(self, query: str, limit: int = 10, kind: str | None = None) -> list[tuple[str, str, float]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        scores: dict[str, tuple[float, str]] = {}
+        idfs = { term: self.idf(term) for term in terms }
+        for segment, length_norms in zip(self.segments, self.length_norms):
+            if kind != None and segment.kind != kind:
+                continue
+            segment_scores: dict[int, float] = {}
+            for term in terms:
+                if term not in segment.postings:
+                    continue
+                weight = idfs[term] * (bm25_k1 + 1)
+                entity_ids, frequencies = segment.postings[term]
+                for entity_id, frequency in zip(entity_ids, frequencies):
+                    segment_scores[entity_id] = segment_scores.get(entity_id, 0.0) + weight * frequency / (frequency + length_norms[entity_id])
+            for entity_id, score in segment_scores.items():
+                uri = segment.uris[entity_id]
+                if uri not in scores or scores[uri][0] < score:
+                    scores[uri] = (score, segment.kind)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1][0])
+        return [ (uri, entity_kind, score) for uri, (score, entity_kind) in best ]
+
+# python -m postprocessing.text_index build
+# python -m postprocessing.text_index search "knowledge graph embedding" --kind software
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m postprocessing.text_index', description='Build or query the full-text index of the papers and software')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help='build the segments of the graph files that changed')
+    search_parser = subparsers.add_parser('search', help='search the index')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--kind', choices=['paper', 'software'])
+    search_parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--index', default=text_index_path)
+    arguments = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if arguments.command == 'build':
+        build_text_index(arguments.index)
+        return 0
+    index = TextIndex.load(arguments.index)
+    start_time = time.perf_counter()
+    results = index.search(arguments.query, arguments.limit, arguments.kind)
+    elapsed_time = time.perf_counter() - start_time
+    for uri, kind, score in results:
+        print(f'{score:7.3f}  {kind:8}  {uri}')
+    print(f'{len(results)} results in {elapsed_time * 1000:.1f} ms, {index.num_entities} entities indexed')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
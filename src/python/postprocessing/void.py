@@ -0,0 +1,445 @@
+from collections import OrderedDict
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+from typing import Iterator
+
+from util.ntriples import is_iri, is_literal, iri_value, parse_nquads_line
+from util.pipeline import path_fingerprint
+
+# Statistics of the output files of the pipeline, written as a VoID description (data/statistics/void.ttl) and a JSON summary (data/statistics/statistics.json).
+# Each file is read once, and the memory used does not depend on its size: the distinct subjects and objects are counted with HyperLogLog sketches,
+# of the file, of each class and of each property, and the triples are counted in the classes of their subject.
+# The N-Triples files, and the Turtle files merged from spilled chunks which are N-Triples too, are written in any order (spilled chunks, merged shards,
+# named graphs): their triples are grouped by subject with an external merge sort, by runs of sort_run_lines triples sorted in memory and written to
+# data/statistics/sort/, the rdf:type triples of a subject first. The disk used is about the size of the file.
+# The other Turtle files are written by rdflib, which groups the triples of a subject: they are parsed by chunks of whole statements into a store
+# that keeps no triple, and the triples of a subject are grouped in a window of the last subjects read, its rdf:type being anywhere among them.
+# The parser keeps the labelled blank nodes, written by rdflib for the blank nodes that are the object of several triples.
+# The links between sources are the triples of a file whose object is in the URI space of another file, the URI spaces of a file being the
+# hosts of most of its subjects. The statistics of a file are kept with its fingerprint and only computed again when it changes.
+statistics_path = 'data/statistics/'
+statistics_filename = f'{statistics_path}statistics.json'
+void_filename = f'{statistics_path}void.ttl'
+graph_path = 'data/rdf/'
+sort_path = f'{statistics_path}sort/'
+
+rdf_type = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+# Number of subjects whose triples are grouped, and number of triples of a subject held before they are counted
+subject_window = 256
+max_subject_triples = 10000
+# Triples sorted in memory by run of the external sort, and runs merged at once
+sort_run_lines = 200000
+max_merged_runs = 128
+# Characters of Turtle statements parsed at once
+turtle_chunk_size = 1 << 20
+# Hosts counted per file, the next ones being counted as other hosts
+max_namespaces = 1000
+# Share of the subjects of a file in a host for the host to be a URI space of the file
+uri_space_share = 0.05
+
+# HyperLogLog sketch of the distinct values of a stream, 2 ** precision one-byte registers, with a standard error of 1.04 / sqrt(2 ** precision)
+class HyperLogLog:
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    # The hash is a 64-bit integer, its first bits choosing the register and the position of the first 1 of the others giving the rank
+    def add(self, value_hash: int):
+        index = value_hash >> (64 - self.precision)
+        remaining_bits = value_hash & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - remaining_bits.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        raw_estimate = alpha * num_registers * num_registers / sum(2.0 ** -register for register in self.registers)
+        num_empty_registers = self.registers.count(0)
+        # Linear counting for the small cardinalities
+        if raw_estimate <= 2.5 * num_registers and num_empty_registers > 0:
+            return round(num_registers * math.log(num_registers / num_empty_registers))
+        return round(raw_estimate)
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+
+# Scheme and host of an IRI term, e.g. https://orcid.org/
+def namespace(term: str) -> str:
+    iri = iri_value(term)
+    scheme_end = iri.find('://')
+    if scheme_end == -1:
+        return iri.split(':', 1)[0] + ':'
+    host_end = iri.find('/', scheme_end + 3)
+    return (iri if host_end == -1 else iri[:host_end]) + '/'
+
+def count_bounded(counts: dict, key, value: int = 1):
+    if key not in counts and len(counts) >= max_namespaces:
+        key = 'other'
+    counts[key] = counts.get(key, 0) + value
+
+class ClassPartition:
+    def __init__(self):
+        self.entities = HyperLogLog()
+        self.objects = HyperLogLog()
+        self.triples = 0
+        self.properties: set[str] = set()
+
+class PropertyPartition:
+    def __init__(self):
+        self.subjects = HyperLogLog()
+        self.objects = HyperLogLog()
+        self.triples = 0
+
+class FileStatistics:
+    # The triples sorted by subject only need a window of one subject
+    def __init__(self, filename: str, window_size: int = subject_window):
+        self.filename = filename
+        self.window_size = window_size
+        self.triples = 0
+        self.literals = 0
+        self.malformed_lines = 0
+        self.subjects = HyperLogLog(14)
+        self.objects = HyperLogLog(14)
+        self.classes: dict[str, ClassPartition] = {}
+        self.properties: dict[str, PropertyPartition] = {}
+        self.subject_namespaces: dict[str, int] = {}
+        # Triples by host of their IRI object and by predicate
+        self.object_namespaces: dict[tuple[str, str], int] = {}
+        # Open subjects: their types and their triples not counted yet
+        self.window: OrderedDict[str, tuple[set[str], list[tuple[str, str]]]] = OrderedDict()
+
+    def add_triple(self, subject: str, predicate: str, object: str):
+        window = self.window
+        if subject in window:
+            window.move_to_end(subject)
+            types, triples = window[subject]
+        else:
+            types, triples = set(), []
+            window[subject] = (types, triples)
+            if len(window) > self.window_size:
+                self.count_subject(*window.popitem(last=False))
+        if predicate == rdf_type:
+            types.add(object)
+        triples.append((predicate, object))
+        if len(triples) >= max_subject_triples:
+            self.count_subject(subject, (types, triples))
+            window[subject] = (types, [])
+
+    def count_subject(self, subject: str, subject_triples: tuple[set[str], list[tuple[str, str]]]):
+        types, triples = subject_triples
+        subject_hash = term_hash(subject)
+        self.subjects.add(subject_hash)
+        if is_iri(subject):
+            count_bounded(self.subject_namespaces, namespace(subject))
+        classes = [ self.classes.setdefault(subject_type, ClassPartition()) for subject_type in types ]
+        for class_partition in classes:
+            class_partition.entities.add(subject_hash)
+        for predicate, object in triples:
+            self.triples += 1
+            object_hash = term_hash(object)
+            self.objects.add(object_hash)
+            property_partition = self.properties.get(predicate)
+            if property_partition is None:
+                property_partition = self.properties[predicate] = PropertyPartition()
+            property_partition.triples += 1
+            property_partition.subjects.add(subject_hash)
+            property_partition.objects.add(object_hash)
+            if is_literal(object):
+                self.literals += 1
+            elif is_iri(object) and predicate != rdf_type:
+                count_bounded(self.object_namespaces, (namespace(object), predicate))
+            for class_partition in classes:
+                class_partition.triples += 1
+                class_partition.properties.add(predicate)
+                class_partition.objects.add(object_hash)
+
+    def finish(self):
+        while len(self.window) > 0:
+            self.count_subject(*self.window.popitem(last=False))
+
+    def uri_spaces(self) -> list[str]:
+        num_subjects = sum(self.subject_namespaces.values())
+        return sorted(host for host, count in self.subject_namespaces.items() if host != 'other' and count >= uri_space_share * num_subjects)
+
+    def summary(self) -> dict:
+        return {
+            'filename': self.filename,
+            'fingerprint': path_fingerprint(self.filename),
+            'triples': self.triples,
+            'distinct_subjects': self.subjects.estimate(),
+            'distinct_objects': self.objects.estimate(),
+            'properties': len(self.properties),
+            'literals': self.literals,
+            'malformed_lines': self.malformed_lines,
+            'uri_spaces': self.uri_spaces(),
+            'classes': { iri_value(class_term): { 'entities': partition.entities.estimate(), 'triples': partition.triples, 'properties': len(partition.properties), 'distinct_objects': partition.objects.estimate() }
+                         for class_term, partition in sorted(self.classes.items()) },
+            'property_partitions': { iri_value(predicate): { 'triples': partition.triples, 'distinct_subjects': partition.subjects.estimate(), 'distinct_objects': partition.objects.estimate() }
+                                     for predicate, partition in sorted(self.properties.items()) },
+            # The links to the hosts beyond the max_namespaces first ones are not kept
+            'object_namespaces': [ [ key[0], iri_value(key[1]), count ] for key, count in sorted(self.object_namespaces.items(), key=lambda item: -item[1]) if key != 'other' ],
+        }
+
+# N-Triples lines if the first statement of the file is one, e.g. a Turtle file merged from spilled chunks
+def is_line_based(filename: str) -> bool:
+    if filename.endswith(('.nt', '.nq')):
+        return True
+    graph_file = open(filename, 'r', encoding='utf-8')
+    try:
+        for line in graph_file:
+            if line.strip() != '' and not line.startswith('#'):
+                return parse_nquads_line(line) != None
+    finally:
+        graph_file.close()
+    return True
+
+def rdflib_term(term) -> str:
+    from rdflib import BNode, URIRef
+    if isinstance(term, URIRef):
+        return f'<{term}>'
+    if isinstance(term, BNode):
+        return f'_:{term}'
+    return term.n3()
+
+def write_sort_run(lines: list[str], run_filename: str) -> str:
+    lines.sort()
+    run_file = open(run_filename, 'w', encoding='utf-8')
+    run_file.writelines(lines)
+    run_file.close()
+    return run_filename
+
+def merge_sort_runs(run_filenames: list[str], merged_filename: str) -> str:
+    run_files = [ open(run_filename, 'r', encoding='utf-8') for run_filename in run_filenames ]
+    merged_file = open(merged_filename, 'w', encoding='utf-8')
+    merged_file.writelines(heapq.merge(*run_files))
+    merged_file.close()
+    for run_file, run_filename in zip(run_files, run_filenames):
+        run_file.close()
+        os.remove(run_filename)
+    return merged_filename
+
+# Triples of a N-Triples file grouped by subject, the rdf:type triples of each subject first.
+# Each triple is a line of the runs, prefixed by the hash of its subject and 0 for a rdf:type triple, the subject and predicate having no space.
+def iter_triples_by_subject(filename: str, statistics: FileStatistics, sort_path: str = sort_path) -> Iterator[tuple[str, str, str]]:
+    os.makedirs(sort_path, exist_ok=True)
+    run_path = tempfile.mkdtemp(prefix='runs_', dir=sort_path)
+    run_files = []
+    try:
+        run_filenames: list[str] = []
+        lines: list[str] = []
+        graph_file = open(filename, 'r', encoding='utf-8')
+        for line in graph_file:
+            quad = parse_nquads_line(line)
+            if quad is None:
+                if line.strip() != '' and not line.startswith('#'):
+                    statistics.malformed_lines += 1
+                continue
+            lines.append(f'{term_hash(quad[0]):016x}{0 if quad[1] == rdf_type else 1} {quad[0]} {quad[1]} {quad[2]}\n')
+            if len(lines) >= sort_run_lines:
+                run_filenames.append(write_sort_run(lines, os.path.join(run_path, f'run_{len(run_filenames):05d}')))
+                lines = []
+        graph_file.close()
+        if len(run_filenames) == 0:
+            # A file of a single run is sorted in memory only
+            lines.sort()
+            sorted_lines = iter(lines)
+        else:
+            if len(lines) > 0:
+                run_filenames.append(write_sort_run(lines, os.path.join(run_path, f'run_{len(run_filenames):05d}')))
+            lines = []
+            num_merged_runs = 0
+            while len(run_filenames) > max_merged_runs:
+                merged_filename = merge_sort_runs(run_filenames[:max_merged_runs], os.path.join(run_path, f'merged_{num_merged_runs:05d}'))
+                run_filenames = run_filenames[max_merged_runs:] + [merged_filename]
+                num_merged_runs += 1
+            run_files = [ open(run_filename, 'r', encoding='utf-8') for run_filename in run_filenames ]
+            sorted_lines = heapq.merge(*run_files)
+        for sorted_line in sorted_lines:
+            _, subject, predicate, object = sorted_line[:-1].split(' ', 3)
+            yield subject, predicate, object
+    finally:
+        for run_file in run_files:
+            run_file.close()
+        shutil.rmtree(run_path, ignore_errors=True)
+
+# Whole statements of a Turtle file written by rdflib, by chunks of about turtle_chunk_size characters.
+# The statements are separated by blank lines, which are chunk boundaries outside of the long literals.
+def iter_turtle_chunks(filename: str) -> Iterator[str]:
+    turtle_file = open(filename, 'r', encoding='utf-8')
+    chunk: list[str] = []
+    chunk_length = 0
+    in_long_literal = False
+    for line in turtle_file:
+        if chunk_length >= turtle_chunk_size and not in_long_literal and line.strip() == '':
+            yield ''.join(chunk)
+            chunk = []
+            chunk_length = 0
+            continue
+        chunk.append(line)
+        chunk_length += len(line)
+        # The long literals are delimited by """, the quotes inside them being escaped
+        if '"""' in line and line.replace('\\\\', '').replace('\\"', '').count('"""') % 2 == 1:
+            in_long_literal = not in_long_literal
+    turtle_file.close()
+    if len(chunk) > 0:
+        yield ''.join(chunk)
+
+def file_statistics(filename: str, sort_path: str = sort_path) -> FileStatistics:
+    if is_line_based(filename):
+        statistics = FileStatistics(filename, window_size=1)
+        for subject, predicate, object in iter_triples_by_subject(filename, statistics, sort_path):
+            statistics.add_triple(subject, predicate, object)
+    else:
+        statistics = FileStatistics(filename)
+        from rdflib import Graph
+        from rdflib.plugins.parsers.notation3 import RDFSink, SinkParser
+        from rdflib.store import Store
+        # Store of the parsed triples that counts them instead of keeping them
+        class StatisticsSink(Store):
+            def add(self, triple, context, quoted=False):
+                statistics.add_triple(rdflib_term(triple[0]), rdflib_term(triple[1]), rdflib_term(triple[2]))
+        # The parser of Graph.parse reads the whole file at once, the chunks are fed to the same parser, which keeps the prefixes
+        parser = SinkParser(RDFSink(Graph(store=StatisticsSink())), baseURI=pathlib.Path(filename).absolute().as_uri(), turtle=True)
+        parser.startDoc()
+        for chunk in iter_turtle_chunks(filename):
+            parser.feed(chunk)
+        parser.endDoc()
+    statistics.finish()
+    return statistics
+
+def dataset_name(filename: str) -> str:
+    return os.path.splitext(os.path.basename(filename))[0]
+
+# Links of each file to the other files and to the external URI spaces, by predicate.
+# The links to a URI space of the file itself are not counted, and a link goes to the other file with this URI space if only one has it, else to the URI space.
+def linksets(file_summaries: list[dict]) -> list[dict]:
+    files_by_uri_space: dict[str, list[str]] = {}
+    for summary in file_summaries:
+        for uri_space in summary['uri_spaces']:
+            files_by_uri_space.setdefault(uri_space, []).append(dataset_name(summary['filename']))
+    links = []
+    for summary in file_summaries:
+        for host, predicate, count in summary['object_namespaces']:
+            if host in summary['uri_spaces']:
+                continue
+            target_files = files_by_uri_space.get(host, [])
+            links.append({ 'source': dataset_name(summary['filename']), 'target': target_files[0] if len(target_files) == 1 else host, 'predicate': predicate, 'triples': count })
+    return links
+
+def void_graph(file_summaries: list[dict], links: list[dict]):
+    from rdflib import BNode, Graph, Literal, URIRef
+    from rdflib.namespace import RDF, VOID, XSD
+    from kg.CONSTANTS import GRAPH
+    graph = Graph()
+    graph.bind('void', VOID)
+    root = GRAPH['statistics']
+    graph.add((root, RDF.type, VOID.Dataset))
+    def integer(value: int) -> Literal:
+        return Literal(value, datatype=XSD.integer)
+    for summary in file_summaries:
+        dataset = GRAPH[dataset_name(summary['filename'])]
+        graph.add((root, VOID.subset, dataset))
+        graph.add((dataset, RDF.type, VOID.Dataset))
+        graph.add((dataset, VOID.dataDump, URIRef(f'file:{os.path.abspath(summary["filename"])}')))
+        graph.add((dataset, VOID.triples, integer(summary['triples'])))
+        graph.add((dataset, VOID.entities, integer(summary['distinct_subjects'])))
+        graph.add((dataset, VOID.distinctSubjects, integer(summary['distinct_subjects'])))
+        graph.add((dataset, VOID.distinctObjects, integer(summary['distinct_objects'])))
+        graph.add((dataset, VOID.properties, integer(summary['properties'])))
+        graph.add((dataset, VOID.classes, integer(len(summary['classes']))))
+        for uri_space in summary['uri_spaces']:
+            graph.add((dataset, VOID.uriSpace, Literal(uri_space)))
+        for class_uri, partition in summary['classes'].items():
+            class_partition = BNode()
+            graph.add((dataset, VOID.classPartition, class_partition))
+            graph.add((class_partition, VOID['class'], URIRef(class_uri)))
+            graph.add((class_partition, VOID.entities, integer(partition['entities'])))
+            graph.add((class_partition, VOID.triples, integer(partition['triples'])))
+            graph.add((class_partition, VOID.properties, integer(partition['properties'])))
+            graph.add((class_partition, VOID.distinctObjects, integer(partition['distinct_objects'])))
+        for property_uri, partition in summary['property_partitions'].items():
+            property_partition = BNode()
+            graph.add((dataset, VOID.propertyPartition, property_partition))
+            graph.add((property_partition, VOID.property, URIRef(property_uri)))
+            graph.add((property_partition, VOID.triples, integer(partition['triples'])))
+            graph.add((property_partition, VOID.distinctSubjects, integer(partition['distinct_subjects'])))
+            graph.add((property_partition, VOID.distinctObjects, integer(partition['distinct_objects'])))
+    for link in links:
+        predicate_name = link['predicate'].rstrip('/').rsplit('/', 1)[-1].rsplit('#', 1)[-1]
+        if '://' in link['target']:
+            # External URI space, described by a dataset of its own
+            target = GRAPH[f'statistics/external/{link["target"].split("://", 1)[1].rstrip("/")}']
+            graph.add((target, RDF.type, VOID.Dataset))
+            graph.add((target, VOID.uriSpace, Literal(link['target'])))
+        else:
+            target = GRAPH[link['target']]
+        linkset = GRAPH[f'statistics/linkset/{link["source"]}/{target.rsplit("/", 1)[-1]}/{predicate_name}']
+        graph.add((root, VOID.subset, linkset))
+        graph.add((linkset, RDF.type, VOID.Linkset))
+        graph.add((linkset, VOID.subjectsTarget, GRAPH[link['source']]))
+        graph.add((linkset, VOID.objectsTarget, target))
+        graph.add((linkset, VOID.linkPredicate, URIRef(link['predicate'])))
+        graph.add((linkset, VOID.triples, integer(link['triples'])))
+    return graph
+
+# Computes the statistics of the graph files changed since the last run, and writes the JSON summary and the VoID description of all of them
+def build_statistics(paths: list[str] | None = None, filename: str = statistics_filename, void_filename: str = void_filename) -> dict:
+    from service.store import graph_filenames
+    previous_summaries = {}
+    if os.path.exists(filename):
+        statistics_file = open(filename, 'r')
+        previous_summaries = { summary['filename']: summary for summary in json.load(statistics_file)['files'] }
+        statistics_file.close()
+    file_summaries = []
+    for graph_filename in graph_filenames(paths if paths != None else [ graph_path ]):
+        previous_summary = previous_summaries.get(graph_filename)
+        if previous_summary != None and previous_summary['fingerprint'] == path_fingerprint(graph_filename):
+            file_summaries.append(previous_summary)
+            continue
+        start_time = time.monotonic()
+        summary = file_statistics(graph_filename).summary()
+        file_summaries.append(summary)
+        logging.info(f'Statistics of {graph_filename}: {summary["triples"]} triples, {summary["distinct_subjects"]} subjects, {len(summary["classes"])} classes in {time.monotonic() - start_time:.1f}s')
+    links = linksets(file_summaries)
+    statistics = {
+        'triples': sum(summary['triples'] for summary in file_summaries),
+        'files': file_summaries,
+        'linksets': links,
+    }
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    statistics_file = open(filename + '.tmp', 'w')
+    json.dump(statistics, statistics_file, indent=1)
+    statistics_file.close()
+    os.replace(filename + '.tmp', filename)
+    void_graph(file_summaries, links).serialize(destination=void_filename, format='turtle')
+    logging.info(f'Statistics of {len(file_summaries)} files written to {filename} and {void_filename}, {statistics["triples"]} triples, {len(links)} linksets')
+    return statistics
+
+# python -m postprocessing.void [files or directories]
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m postprocessing.void', description='Write the VoID description and the statistics of the graph files')
+    parser.add_argument('graphs', nargs='*', help='files or directories of the graph (data/rdf/ by default)')
+    parser.add_argument('--output', default=statistics_filename, help='JSON summary')
+    parser.add_argument('--void', default=void_filename, help='VoID description')
+    arguments = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    statistics = build_statistics(arguments.graphs or None, arguments.output, arguments.void)
+    for summary in statistics['files']:
+        print(f'{summary["triples"]:>12} triples {summary["distinct_subjects"]:>10} subjects  {summary["filename"]}')
+    for link in statistics['linksets']:
+        print(f'{link["triples"]:>12} links {link["source"]} -> {link["target"]} ({link["predicate"]})')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
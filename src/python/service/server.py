@@ -0,0 +1,172 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import json
+import logging
+import os
+import time
+
+from postprocessing.team_index import TeamIndex, team_index_filename
+from postprocessing.text_index import TextIndex, manifest_filename, text_index_path
+from service.store import KnowledgeGraphStore, QueryError, QueryTimeout
+
+# Read-only HTTP query service over the knowledge graph, each request being answered by its own thread:
+#   GET|POST /sparql                      SPARQL query (query parameter, form body or application/sparql-query body), results format from the format parameter or the Accept header
+#   GET /people/orcid/{orcid}             people with this ORCID, in any source
+#   GET /people/idhal/{idhal}             people with this idHal
+#   GET /repositories?organization={uri}  repositories of the software of an organization, given by its URI or the URI of one of its identifiers (e.g. its ROR)
+#   GET /search?q={text}&kind={kind}      papers and software whose title, abstract or keywords match the text, ranked with BM25 (kind paper or software, limit 10 by default)
+#   GET /teams?organization={uri}        people, works and repositories of an organization from the team index, given by its URI, the URI of one of its identifiers or its label
+#   GET /teams                            organizations with the most repositories
+#   GET /health                           size of the graph and uptime
+# The SPARQL updates and the SERVICE patterns are not accepted, the graph is never modified, and a query is stopped after service_query_timeout seconds (30 by default).
+accepted_formats = [
+    ('application/sparql-results+json', 'json'),
+    ('application/json', 'json'),
+    ('application/sparql-results+xml', 'xml'),
+    ('text/csv', 'csv'),
+    ('text/turtle', 'turtle'),
+    ('application/n-triples', 'nt'),
+    ('application/rdf+xml', 'xml'),
+]
+
+class QueryServiceHandler(BaseHTTPRequestHandler):
+    store: KnowledgeGraphStore
+    text_index: TextIndex | None = None
+    team_index: TeamIndex | None = None
+    start_time = 0.0
+
+    def log_message(self, format, *args):
+        logging.debug('%s ' + format, self.address_string(), *args)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, content, status: int = 200):
+        self.send_body(json.dumps(content, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8', status)
+
+    def query_parameters(self) -> dict[str, str]:
+        return { key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items() }
+
+    def result_format(self, parameters: dict[str, str]) -> str:
+        if 'format' in parameters:
+            return parameters['format']
+        accept = self.headers.get('Accept', '')
+        for content_type, result_format in accepted_formats:
+            if content_type in accept:
+                return result_format
+        return 'json'
+
+    def answer_sparql(self, query: str | None, parameters: dict[str, str]):
+        if query is None or query.strip() == '':
+            self.send_json({ 'error': 'Missing query' }, status=400)
+            return
+        try:
+            content_type, body = self.store.sparql(query, self.result_format(parameters))
+        except QueryError as e:
+            self.send_json({ 'error': f'Invalid query: {e}' }, status=400)
+            return
+        except QueryTimeout as e:
+            self.send_json({ 'error': str(e) }, status=503)
+            return
+        except Exception as e:
+            logging.exception(f'SPARQL query failed: {query}')
+            self.send_json({ 'error': f'Query failed: {e}' }, status=500)
+            return
+        self.send_body(body, content_type)
+
+    def answer_search(self, parameters: dict[str, str]):
+        if self.text_index is None:
+            self.send_json({ 'error': 'No text index, run "python cli.py text_index"' }, status=503)
+            return
+        if parameters.get('q', '').strip() == '':
+            self.send_json({ 'error': 'Missing q' }, status=400)
+            return
+        try:
+            limit = int(parameters.get('limit', '10'))
+        except ValueError:
+            self.send_json({ 'error': 'Invalid limit' }, status=400)
+            return
+        results = self.text_index.search(parameters['q'], limit=limit, kind=parameters.get('kind'))
+        self.send_json([ { 'uri': uri, 'kind': kind, 'score': round(score, 4) } for uri, kind, score in results ])
+
+    def answer_teams(self, parameters: dict[str, str]):
+        if self.team_index is None:
+            self.send_json({ 'error': 'No team index, run "python cli.py team_index"' }, status=503)
+            return
+        try:
+            limit = int(parameters.get('limit', '10'))
+        except ValueError:
+            self.send_json({ 'error': 'Invalid limit' }, status=400)
+            return
+        if 'organization' not in parameters:
+            self.send_json(self.team_index.top_organizations(limit))
+            return
+        summary = self.team_index.summary(parameters['organization'], limit)
+        if summary is None:
+            self.send_json({ 'error': 'Unknown organization' }, status=404)
+            return
+        self.send_json(summary)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        parameters = self.query_parameters()
+        if path == '/sparql':
+            self.answer_sparql(parameters.get('query'), parameters)
+        elif path.startswith('/people/orcid/'):
+            self.send_json(self.store.people_by_orcid_id(unquote(path[len('/people/orcid/'):])))
+        elif path.startswith('/people/idhal/'):
+            self.send_json(self.store.people_by_idhal_id(unquote(path[len('/people/idhal/'):])))
+        elif path == '/repositories':
+            if 'organization' not in parameters:
+                self.send_json({ 'error': 'Missing organization' }, status=400)
+                return
+            self.send_json(self.store.repositories_of_organization(parameters['organization']))
+        elif path == '/search':
+            self.answer_search(parameters)
+        elif path == '/teams':
+            self.answer_teams(parameters)
+        elif path == '/health':
+            self.send_json({ 'triples': len(self.store.graph), 'uptime': time.time() - self.start_time })
+        else:
+            self.send_json({ 'error': 'Not found' }, status=404)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        if path != '/sparql':
+            self.send_json({ 'error': 'Not found' }, status=404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', '0'))).decode('utf-8')
+        parameters = self.query_parameters()
+        if self.headers.get('Content-Type', '').startswith('application/sparql-query'):
+            self.answer_sparql(body, parameters)
+            return
+        parameters.update({ key: values[0] for key, values in parse_qs(body).items() })
+        self.answer_sparql(parameters.get('query'), parameters)
+
+def start_query_service(store: KnowledgeGraphStore, host: str = '127.0.0.1', port: int = 8080, text_index: TextIndex | None = None, team_index: TeamIndex | None = None) -> ThreadingHTTPServer:
+    handler_class = type('QueryServiceHandler', (QueryServiceHandler,), { 'store': store, 'text_index': text_index, 'team_index': team_index, 'start_time': time.time() })
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    return server
+
+def serve(paths: list[str] | None = None, host: str = '127.0.0.1', port: int = 8080, rebuild: bool = False):
+    store = KnowledgeGraphStore.load(paths, rebuild=rebuild)
+    # The full-text search and the teams are available once the text_index and team_index stages have run
+    text_index = TextIndex.load(text_index_path) if os.path.exists(os.path.join(text_index_path, manifest_filename)) else None
+    if text_index != None:
+        logging.info(f'Text index loaded, {text_index.num_entities} entities')
+    team_index = TeamIndex.load(team_index_filename) if os.path.exists(team_index_filename) else None
+    if team_index != None:
+        logging.info(f'Team index loaded, {len(team_index.organization_names)} organizations')
+    server = start_query_service(store, host, port, text_index, team_index)
+    logging.info(f'Query service listening on http://{host}:{server.server_port}')
+    print(f'Query service listening on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,230 @@
+from pyparsing import ParseException
+from rdflib import Graph, URIRef
+from rdflib.namespace import FOAF, OWL, RDF, RDFS, DCTERMS
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.term import Identifier
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+
+from kg.CONSTANTS import ADMS, DOAP, HAL_AUTHOR, ORCID, PAV, ROH
+from util.pipeline import path_fingerprint
+
+# Read-only store of the knowledge graph written by the pipeline, for the query service.
+# The Turtle and N-Triples files of the graph are loaded once, and the lookups of the REST API (people by ORCID and idHal, repositories by organization) are computed with them.
+# The graph and the lookups are persisted as an index file, reused by the next starts as long as the files of the graph are unchanged.
+graph_path = 'data/rdf/'
+index_filename = 'data/service/index.pickle'
+graph_file_formats = { '.ttl': 'turtle', '.nt': 'nt' }
+# Seconds a SPARQL query may run before it is stopped
+query_timeout = float(os.getenv('service_query_timeout', '30'))
+
+# Query refused by the service: a parse error, an update, or a SERVICE pattern
+class QueryError(ValueError):
+    pass
+
+class QueryTimeout(Exception):
+    pass
+
+# The SERVICE patterns would make the service send requests to any endpoint given by the query
+def has_service_pattern(node) -> bool:
+    if isinstance(node, CompValue):
+        return node.name == 'ServiceGraphPattern' or any(has_service_pattern(value) for value in node.values())
+    if isinstance(node, (list, tuple)):
+        return any(has_service_pattern(value) for value in node)
+    return False
+
+# Graph of a single query, sharing the triples of the knowledge graph, whose lookups fail once the query has run too long.
+# The evaluation of rdflib looks the triples up for each solution of each pattern, so that a long query reaches the deadline.
+class DeadlineGraph(Graph):
+    def __init__(self, graph: Graph, deadline: float):
+        super().__init__(store=graph.store, identifier=graph.identifier, namespace_manager=graph.namespace_manager)
+        self.deadline = deadline
+
+    def triples(self, triple):
+        for index, found_triple in enumerate(super().triples(triple)):
+            if index % 1024 == 0 and time.monotonic() > self.deadline:
+                raise QueryTimeout('Query timeout')
+            yield found_triple
+
+def graph_filenames(paths: list[str]) -> list[str]:
+    filenames = []
+    for path in paths:
+        if os.path.isfile(path):
+            filenames.append(path)
+            continue
+        for directory, _, files in os.walk(path):
+            filenames += [ os.path.join(directory, filename) for filename in files if os.path.splitext(filename)[1] in graph_file_formats ]
+    return sorted(filenames)
+
+def index_fingerprint(paths: list[str]) -> str:
+    return hashlib.sha256(json.dumps([ path_fingerprint(path) for path in sorted(paths) ]).encode('utf-8')).hexdigest()
+
+# ORCID given as an identifier or as a url
+def normalize_orcid(orcid: str) -> str:
+    return orcid.strip().removeprefix(str(ORCID)).removeprefix('http://orcid.org/').upper()
+
+def normalize_idhal(idhal: str) -> str:
+    return idhal.strip().removeprefix(str(HAL_AUTHOR)).lower()
+
+class KnowledgeGraphStore:
+    def __init__(self, graph: Graph, fingerprint: str = ''):
+        self.graph = graph
+        self.fingerprint = fingerprint
+        self.people_by_orcid: dict[str, set[Identifier]] = {}
+        self.people_by_idhal: dict[str, set[Identifier]] = {}
+        self.repositories_by_organization: dict[str, set[tuple[Identifier, str]]] = {}
+        # The SPARQL parser is not thread-safe, the queries are parsed one at a time and their results kept for the next identical queries
+        self.parse_lock = threading.Lock()
+        self.result_cache: OrderedDict[tuple[str, str], tuple[str, bytes]] = OrderedDict()
+        self.result_cache_size = 256
+        self.result_cache_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return { 'graph': self.graph, 'fingerprint': self.fingerprint, 'people_by_orcid': self.people_by_orcid, 'people_by_idhal': self.people_by_idhal, 'repositories_by_organization': self.repositories_by_organization }
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['graph'], state['fingerprint'])
+        self.people_by_orcid = state['people_by_orcid']
+        self.people_by_idhal = state['people_by_idhal']
+        self.repositories_by_organization = state['repositories_by_organization']
+
+    # Keys of an agent: its own URI and the URIs of its identifiers, so that the agents of different sources sharing an identifier are matched
+    def agent_keys(self, agent: Identifier) -> set[str]:
+        keys = { str(agent) } if isinstance(agent, URIRef) else set()
+        keys.update(str(identifier) for identifier in self.graph.objects(agent, ADMS.identifier))
+        keys.update(str(same_as) for same_as in self.graph.objects(agent, OWL.sameAs))
+        return keys
+
+    def build_lookups(self):
+        graph = self.graph
+        for person in graph.subjects(RDF.type, FOAF.Person):
+            for key in self.agent_keys(person):
+                if key.startswith(str(ORCID)):
+                    self.people_by_orcid.setdefault(normalize_orcid(key), set()).add(person)
+                elif key.startswith(str(HAL_AUTHOR)):
+                    self.people_by_idhal.setdefault(normalize_idhal(key), set()).add(person)
+            for orcid in graph.objects(person, ROH.ORCID):
+                self.people_by_orcid.setdefault(normalize_orcid(str(orcid)), set()).add(person)
+
+        # Organizations of each person key, from the memberships of the people
+        organizations_by_person_key: dict[str, set[str]] = {}
+        for person, organization in graph.subject_objects(FOAF.member):
+            organization_keys = self.agent_keys(organization)
+            for key in self.agent_keys(person):
+                organizations_by_person_key.setdefault(key, set()).update(organization_keys)
+
+        # The repositories of a software belong to the organizations creating it, and to the organizations of the people creating it
+        for software, repository in graph.subject_objects(DOAP.repository):
+            organization_keys: set[str] = set()
+            for creator in graph.objects(software, DCTERMS.creator):
+                creator_keys = self.agent_keys(creator)
+                if (creator, RDF.type, FOAF.Organization) in graph:
+                    organization_keys.update(creator_keys)
+                else:
+                    for key in creator_keys:
+                        organization_keys.update(organizations_by_person_key.get(key, ()))
+            for key in organization_keys:
+                self.repositories_by_organization.setdefault(key, set()).add((software, str(repository)))
+        logging.info(f'Lookups built: {len(self.people_by_orcid)} ORCIDs, {len(self.people_by_idhal)} idHals, {len(self.repositories_by_organization)} organizations with repositories')
+
+    @classmethod
+    def load(cls, paths: list[str] | None = None, index_filename: str = index_filename, rebuild: bool = False) -> 'KnowledgeGraphStore':
+        if paths is None:
+            paths = [ graph_path ]
+        fingerprint = index_fingerprint(paths)
+        if not rebuild and os.path.exists(index_filename):
+            start_time = time.monotonic()
+            index_file = open(index_filename, 'rb')
+            store = pickle.load(index_file)
+            index_file.close()
+            if store.fingerprint == fingerprint:
+                logging.info(f'Index {index_filename} loaded in {time.monotonic() - start_time:.1f}s, {len(store.graph)} triples')
+                return store
+            logging.info(f'Index {index_filename} is out of date')
+
+        start_time = time.monotonic()
+        graph = Graph()
+        for filename in graph_filenames(paths):
+            graph.parse(filename, format=graph_file_formats[os.path.splitext(filename)[1]])
+            logging.info(f'Loaded {filename}, {len(graph)} triples')
+        store = cls(graph, fingerprint)
+        store.build_lookups()
+        logging.info(f'Graph loaded in {time.monotonic() - start_time:.1f}s, {len(graph)} triples')
+
+        os.makedirs(os.path.dirname(index_filename) or '.', exist_ok=True)
+        index_file = open(index_filename + '.tmp', 'wb')
+        pickle.dump(store, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        index_file.close()
+        os.replace(index_filename + '.tmp', index_filename)
+        return store
+
+    def resource_id(self, resource: Identifier) -> str:
+        return str(resource) if isinstance(resource, URIRef) else resource.n3()
+
+    def describe(self, resource: Identifier) -> dict:
+        graph = self.graph
+        description = { 'uri': self.resource_id(resource) }
+        label = graph.value(resource, RDFS.label)
+        if label != None:
+            description['label'] = str(label)
+        for key, predicate in (('first_name', FOAF.firstName), ('last_name', FOAF.lastName)):
+            value = graph.value(resource, predicate)
+            if value != None and str(value) != 'None':
+                description[key] = str(value)
+        description['identifiers'] = sorted(str(identifier) for identifier in graph.objects(resource, ADMS.identifier))
+        # The organizations without URI are given by their label
+        description['organizations'] = sorted(self.resource_id(organization) if isinstance(organization, URIRef) else str(graph.value(organization, RDFS.label, default=organization.n3())) for organization in graph.objects(resource, FOAF.member))
+        description['sources'] = sorted({ str(source) for source in graph.objects(resource, PAV.retrievedFrom) if isinstance(source, URIRef) })
+        return description
+
+    def people_by_orcid_id(self, orcid: str) -> list[dict]:
+        return [ self.describe(person) for person in sorted(self.people_by_orcid.get(normalize_orcid(orcid), ()), key=str) ]
+
+    def people_by_idhal_id(self, idhal: str) -> list[dict]:
+        return [ self.describe(person) for person in sorted(self.people_by_idhal.get(normalize_idhal(idhal), ()), key=str) ]
+
+    # The organization is given by its URI or by the URI of one of its identifiers, e.g. its ROR
+    def repositories_of_organization(self, organization: str) -> list[dict]:
+        repositories = self.repositories_by_organization.get(organization.strip(), set())
+        return [ { 'software': self.resource_id(software), 'repository': repository } for software, repository in sorted(repositories, key=lambda item: (item[1], str(item[0]))) ]
+
+    # Answers a SPARQL query, serialized in the given format: json, xml or csv for SELECT and ASK, turtle, nt or xml for CONSTRUCT and DESCRIBE.
+    # The queries with a SERVICE pattern are refused, and a query running for more than the timeout is stopped.
+    def sparql(self, query: str, result_format: str = 'json', timeout: float = query_timeout) -> tuple[str, bytes]:
+        cache_key = (query, result_format)
+        with self.result_cache_lock:
+            if cache_key in self.result_cache:
+                self.result_cache.move_to_end(cache_key)
+                return self.result_cache[cache_key]
+        with self.parse_lock:
+            try:
+                prepared_query = prepareQuery(query)
+            except ParseException as e:
+                # The updates are not parsed as queries either
+                raise QueryError(str(e))
+        if has_service_pattern(prepared_query.algebra):
+            raise QueryError('SERVICE is not allowed')
+        # The results are computed while they are serialized, both before the deadline
+        result = DeadlineGraph(self.graph, time.monotonic() + timeout).query(prepared_query)
+        if result.type in ('CONSTRUCT', 'DESCRIBE'):
+            graph_format = result_format if result_format in ('turtle', 'nt', 'xml') else 'turtle'
+            content_type = { 'turtle': 'text/turtle', 'nt': 'application/n-triples', 'xml': 'application/rdf+xml' }[graph_format]
+            body = result.serialize(format=graph_format, encoding='utf-8')
+        else:
+            # rdflib has no serializer of the TSV results
+            result_format = result_format if result_format in ('json', 'xml', 'csv') else 'json'
+            content_type = { 'json': 'application/sparql-results+json', 'xml': 'application/sparql-results+xml', 'csv': 'text/csv' }[result_format]
+            body = result.serialize(format=result_format, encoding='utf-8')
+        answer = (f'{content_type}; charset=utf-8', body if body != None else b'')
+        with self.result_cache_lock:
+            self.result_cache[cache_key] = answer
+            if len(self.result_cache) > self.result_cache_size:
+                self.result_cache.popitem(last=False)
+        return answer
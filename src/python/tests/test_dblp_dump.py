@@ -0,0 +1,90 @@
+import gzip
+
+import pytest
+
+from dblp_source.dblp_dump import dblp_xml_publication, iter_dblp_xml_records, load_dblp_ntriples_index, load_dblp_xml_index
+
+dblp_schema = 'https://dblp.org/rdf/schema#'
+cito = 'http://purl.org/spar/cito/'
+owl_same_as = 'http://www.w3.org/2002/07/owl#sameAs'
+omid = 'https://w3id.org/oc/meta/br/'
+
+# The triples of a publication are not contiguous, the citations come before the omid they cite and one publication is out of the years
+ntriples_dump = f'''<https://dblp.org/rec/conf/a/One20> <{dblp_schema}yearOfPublication> "2020"^^<http://www.w3.org/2001/XMLSchema#gYear> .
+<https://dblp.org/rec/conf/a/One20> <{dblp_schema}title> "First paper." .
+<https://w3id.org/oc/meta/ci/1> <{cito}hasCitedEntity> <{omid}0601> .
+<https://w3id.org/oc/meta/ci/2> <{cito}hasCitedEntity> <{omid}0601> .
+<https://w3id.org/oc/meta/ci/3> <{cito}hasCitedEntity> <{omid}0602> .
+<https://w3id.org/oc/meta/ci/4> <{cito}hasCitedEntity> <{omid}0603> .
+<https://dblp.org/rec/journals/b/Two21> <{dblp_schema}yearOfPublication> "2021"^^<http://www.w3.org/2001/XMLSchema#gYear> .
+<https://dblp.org/rec/conf/a/Old10> <{dblp_schema}yearOfPublication> "2010"^^<http://www.w3.org/2001/XMLSchema#gYear> .
+<https://dblp.org/rec/conf/a/Old10> <{dblp_schema}title> "Old paper." .
+<https://dblp.org/rec/conf/a/Old10> <{dblp_schema}omid> <{omid}0603> .
+<https://dblp.org/rec/conf/a/One20> <{dblp_schema}doi> <https://doi.org/10.1000/one> .
+<https://dblp.org/rec/conf/a/One20> <{dblp_schema}omid> <{omid}0601> .
+<https://dblp.org/rec/conf/a/One20> <{owl_same_as}> <https://www.wikidata.org/entity/Q1> .
+<https://dblp.org/rec/journals/b/Two21> <{dblp_schema}title> "Second paper." .
+<https://dblp.org/rec/journals/b/Two21> <{dblp_schema}omid> <{omid}0602> .
+'''
+
+def test_ntriples_dump(tmp_path):
+    filename = tmp_path / 'dblp.nt'
+    filename.write_text(ntriples_dump, encoding='utf-8')
+
+    index = load_dblp_ntriples_index(str(filename), 2015, 2024)
+    assert set(index.publications) == { 'https://dblp.org/rec/conf/a/One20', 'https://dblp.org/rec/journals/b/Two21' }
+    first = index.publications['https://dblp.org/rec/conf/a/One20']
+    assert (first.year, first.title, first.doi, first.omid) == (2020, 'First paper.', 'https://doi.org/10.1000/one', f'{omid}0601')
+    assert first.same_as == ['https://www.wikidata.org/entity/Q1']
+    assert first.citations == 2
+    assert index.publications['https://dblp.org/rec/journals/b/Two21'].citations == 1
+    assert [ publication.uri for publication in index.most_cited(2021, 10) ] == ['https://dblp.org/rec/journals/b/Two21']
+    assert index.most_cited(2010, 10) == []
+
+# The entities of dblp.dtd are replaced without the DTD, the www elements are person pages and one publication is out of the years
+xml_dump = '''<?xml version="1.0" encoding="ISO-8859-1"?>
+<!DOCTYPE dblp SYSTEM "dblp.dtd">
+<dblp>
+<article key="journals/b/Caf&eacute;21" mdate="2022-01-01">
+<author>Ren&eacute;e M&uuml;ller</author>
+<title>Caf&eacute; &amp; <i>tea</i> at 100&deg;.</title>
+<year>2021</year>
+<ee>https://example.org/cafe</ee>
+<ee>https://doi.org/10.1000/cafe</ee>
+</article>
+<www key="homepages/1/2">
+<author>Ren&eacute;e M&uuml;ller</author>
+<title>Home Page</title>
+</www>
+<inproceedings key="conf/a/Old10" mdate="2011-01-01">
+<title>Old paper.</title>
+<year>2010</year>
+</inproceedings>
+<inproceedings key="conf/a/New22" mdate="2023-01-01">
+<title>New paper.</title>
+<year>2022</year>
+</inproceedings>
+</dblp>
+'''
+
+# Every chunk size cuts the entities at every position, the elements being read before the next one clears them
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 8, 64])
+def test_xml_dump_records(tmp_path, chunk_size):
+    filename = tmp_path / 'dblp.xml.gz'
+    with gzip.open(filename, 'wb') as dump_file:
+        dump_file.write(xml_dump.encode('iso-8859-1'))
+    publications = [ dblp_xml_publication(element) for element in iter_dblp_xml_records(str(filename), chunk_size=chunk_size) ]
+    assert [ (publication.uri, publication.year, publication.title, publication.doi) for publication in publications if publication != None ] == [
+        ('https://dblp.org/rec/journals/b/Café21', 2021, 'Café & tea at 100°.', 'https://doi.org/10.1000/cafe'),
+        ('https://dblp.org/rec/conf/a/Old10', 2010, 'Old paper.', None),
+        ('https://dblp.org/rec/conf/a/New22', 2022, 'New paper.', None),
+    ]
+
+def test_xml_dump_index(tmp_path):
+    filename = tmp_path / 'dblp.xml.gz'
+    with gzip.open(filename, 'wb') as dump_file:
+        dump_file.write(xml_dump.encode('iso-8859-1'))
+    index = load_dblp_xml_index(str(filename), 2015, 2024)
+    assert set(index.publications) == { 'https://dblp.org/rec/journals/b/Café21', 'https://dblp.org/rec/conf/a/New22' }
+    assert [ publication.title for publication in index.by_year[2022] ] == ['New paper.']
+    assert index.most_cited(2021, 10) == []
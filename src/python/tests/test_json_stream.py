@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from util.json_stream import iter_json_array
+
+elements = [1.25, 3e5, -0.5e-3, 12345, {'a': 2.5, 'b': [True, None]}, 'text, with [brackets]', 7]
+
+# Every chunk size cuts the numbers, literals and strings at every position
+@pytest.mark.parametrize('chunk_size', range(1, 12))
+def test_iter_json_array_small_chunks(tmp_path, chunk_size):
+    filename = tmp_path / 'array.json'
+    filename.write_text(json.dumps(elements), encoding='utf-8')
+    assert list(iter_json_array(str(filename), chunk_size=chunk_size)) == elements
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7])
+def test_iter_json_array_key(tmp_path, chunk_size):
+    filename = tmp_path / 'results.json'
+    filename.write_text(json.dumps({ 'head': { 'vars': ['x'] }, 'results': { 'bindings': elements } }), encoding='utf-8')
+    assert list(iter_json_array(str(filename), chunk_size=chunk_size, key='bindings')) == elements
+
+# The name of the key is also a variable, a string value with an escaped quote and a member of the bindings, which come before the head
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 64])
+def test_iter_json_array_key_depth(tmp_path, chunk_size):
+    bindings = [ { 'vars': { 'type': 'literal', 'value': 'a "bindings": [1]' }, 'bindings': { 'type': 'uri', 'value': 'https://example.org/' } } ]
+    filename = tmp_path / 'results.json'
+    filename.write_text(json.dumps({ 'results': { 'bindings': bindings }, 'head': { 'vars': ['bindings', 'vars'] } }), encoding='utf-8')
+    assert list(iter_json_array(str(filename), chunk_size=chunk_size, key='bindings', key_depth=2)) == bindings
+    assert list(iter_json_array(str(filename), chunk_size=chunk_size, key='vars', key_depth=2)) == ['bindings', 'vars']
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(filename), chunk_size=chunk_size, key='value', key_depth=2))
@@ -0,0 +1,53 @@
+from opencitations_source.opencitations import load_citation_counter
+
+# Current index rows (space-separated omid and DOI) and a former COCI row with a single DOI, in upper case
+citations_dump = '''oci,citing,cited,creation,timespan,journal_sc,author_sc
+1-2,omid:br/001,omid:br/0601 doi:10.1000/a,2020-01-01,P1Y,no,no
+1-3,omid:br/002,omid:br/0601 doi:10.1000/a,2020-01-01,P1Y,no,no
+1-4,omid:br/003,omid:br/0602 doi:10.1000/b,2021-01-01,P1Y,no,no
+1-5,omid:br/004,omid:br/0602,2021-01-01,P1Y,no,no
+1-6,omid:br/005,omid:br/0603 doi:10.1000/c,2021-01-01,P1Y,no,no
+1-7,omid:br/006,10.1000/C,2021-01-01,P1Y,no,no
+1-8,omid:br/007,doi:10.1000/d,2021-01-01,P1Y,no,no
+'''
+
+def test_citation_counter(tmp_path):
+    filename = tmp_path / 'citations.csv'
+    filename.write_text(citations_dump, encoding='utf-8')
+    counter = load_citation_counter(str(filename))
+
+    assert len(counter) == 4
+    assert counter.count_publication(omid='https://w3id.org/oc/meta/br/0601') == 2
+    # The DOI of an entity shares the count of its omid, and the DOIs are case-insensitive
+    assert counter.count_by_doi('https://doi.org/10.1000/B') == 2
+    assert counter.count_publication(doi='10.1000/c') == 2
+    # An unknown omid falls back on the DOI, an unknown DOI has no citation
+    assert counter.count_publication(omid='omid:br/0999', doi='doi:10.1000/d') == 1
+    assert counter.count_publication(doi='10.1000/unknown') == 0
+    assert counter.count_publication() == 0
+
+def test_top_per_year(tmp_path):
+    filename = tmp_path / 'citations.csv'
+    filename.write_text(citations_dump, encoding='utf-8')
+    counter = load_citation_counter(str(filename))
+    publications = [
+        ('a', 'omid:br/0601', None, 2020),
+        ('b', 'omid:br/0602', None, 2021),
+        ('c', None, '10.1000/c', 2021),
+        ('d', None, 'doi:10.1000/d', 2021),
+        ('unknown', 'omid:br/0999', '10.1000/unknown', 2021),
+        ('uncited', None, None, 2022),
+    ]
+    # The ties are ordered by identifier, from the last one, and the publications without citation are left out
+    assert counter.top_per_year(publications, limit=2) == { 2020: [('a', 2)], 2021: [('c', 2), ('b', 2)] }
+    assert counter.top_per_year(publications, limit=5)[2021] == [('c', 2), ('b', 2), ('d', 1)]
+
+def test_only_keys(tmp_path):
+    filename = tmp_path / 'citations.csv'
+    filename.write_text(citations_dump, encoding='utf-8')
+    counter = load_citation_counter(str(filename), only={ 'doi:10.1000/a', 'omid:br/0602' })
+    assert len(counter) == 2
+    assert counter.count_by_omid('omid:br/0601') == 0
+    assert counter.count_by_doi('10.1000/a') == 2
+    assert counter.count_by_omid('omid:br/0602') == 2
+    assert counter.count_by_doi('10.1000/b') == 0
@@ -0,0 +1,28 @@
+import threading
+import time
+
+from util.pipeline import Pipeline, Stage, cancel_event, check_cancelled
+
+def test_cancelled_run_stops_the_stages(tmp_path):
+    started = threading.Event()
+    def long_stage(inputs: dict):
+        started.set()
+        while True:
+            check_cancelled()
+            time.sleep(0.01)
+    stages = [
+        Stage('long', long_stage),
+        Stage('waiting', lambda inputs: 1),
+        Stage('dependent', lambda inputs: 2, dependencies=['long']),
+    ]
+    pipeline = Pipeline(stages, state_path=f'{tmp_path}/')
+    threading.Thread(target=lambda: started.wait() and cancel_event.set()).start()
+    try:
+        start_time = time.monotonic()
+        statuses = pipeline.run(max_workers=1)
+    finally:
+        cancel_event.clear()
+    assert time.monotonic() - start_time < 5
+    assert statuses == { 'long': 'cancelled', 'waiting': 'cancelled', 'dependent': 'cancelled' }
+    # A cancelled stage is not memoized
+    assert not (tmp_path / 'long.json').exists()
@@ -0,0 +1,49 @@
+import postprocessing.void
+from postprocessing.void import file_statistics
+
+foaf = 'http://xmlns.com/foaf/0.1/'
+rdf_type = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+
+# The types are written after all the other triples, further than the window of the Turtle files
+# The runs of the external sort are smaller than the file, and merged in two levels
+def test_unsorted_ntriples_classes(tmp_path, monkeypatch):
+    monkeypatch.setattr(postprocessing.void, 'sort_run_lines', 500)
+    monkeypatch.setattr(postprocessing.void, 'max_merged_runs', 4)
+    num_persons = 1000
+    lines = []
+    for index in range(num_persons):
+        lines.append(f'<https://example.org/person/{index}> <{foaf}name> "Person {index}" .\n')
+        lines.append(f'<https://example.org/person/{index}> <{foaf}knows> <https://example.org/person/{(index + 1) % num_persons}> .\n')
+    for index in reversed(range(num_persons)):
+        lines.append(f'<https://example.org/person/{index}> <{rdf_type}> <{foaf}Person> .\n')
+    lines.append(f'<https://example.org/document/1> <{foaf}maker> <https://example.org/person/0> .\n')
+    filename = tmp_path / 'persons.nt'
+    filename.write_text(''.join(lines), encoding='utf-8')
+
+    statistics = file_statistics(str(filename), str(tmp_path / 'sort'))
+    persons = statistics.classes[f'<{foaf}Person>']
+    assert statistics.triples == 3 * num_persons + 1
+    assert persons.triples == 3 * num_persons
+    assert persons.properties == { f'<{foaf}name>', f'<{foaf}knows>', f'<{rdf_type}>' }
+    assert abs(persons.entities.estimate() - num_persons) < 0.05 * num_persons
+    assert len(statistics.classes) == 1
+    assert list((tmp_path / 'sort').iterdir()) == []
+
+# The chunks of a Turtle file keep its prefixes and labelled blank nodes, and are not cut in a long literal with blank lines
+def test_turtle_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(postprocessing.void, 'turtle_chunk_size', 200)
+    num_persons = 50
+    statements = [ f'@prefix foaf: <{foaf}> .\n' ]
+    for index in range(num_persons):
+        statements.append(f'<https://example.org/person/{index}> a foaf:Person ;\n    foaf:name """Person\n\n{index} \\""" .\n""" ;\n    foaf:based_near _:place .\n')
+    statements.append('_:place foaf:name "Somewhere" .\n')
+    filename = tmp_path / 'persons.ttl'
+    filename.write_text('\n'.join(statements), encoding='utf-8')
+
+    statistics = file_statistics(str(filename), str(tmp_path / 'sort'))
+    persons = statistics.classes[f'<{foaf}Person>']
+    assert statistics.malformed_lines == 0
+    assert statistics.triples == 3 * num_persons + 1
+    assert persons.triples == 3 * num_persons
+    assert persons.properties == { f'<{foaf}name>', f'<{foaf}based_near>', f'<{rdf_type}>' }
+    assert persons.objects.estimate() == num_persons + 2
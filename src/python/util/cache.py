@@ -0,0 +1,106 @@
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Canonical fingerprint of an API request, used as cache key by all the sources.
+# The method is upper-cased, the scheme and host of the endpoint are lower-cased, the default port and the trailing slash are removed,
+# and the parameters, from the query string of the endpoint and from params, are sorted. None parameters are ignored.
+def request_fingerprint(method: str, endpoint: str, params: dict | list[tuple] | None = None) -> str:
+    split_endpoint = urlsplit(endpoint.strip())
+    scheme = split_endpoint.scheme.lower()
+    netloc = split_endpoint.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    path = split_endpoint.path
+    if len(path) > 1:
+        path = path.rstrip('/')
+    parameters = parse_qsl(split_endpoint.query, keep_blank_values=True)
+    if params != None:
+        param_items = params.items() if isinstance(params, dict) else params
+        for key, value in param_items:
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                parameters += [ (str(key), str(item)) for item in value ]
+            else:
+                parameters.append((str(key), str(value)))
+    canonical_request = json.dumps([ method.upper(), urlunsplit((scheme, netloc, path, '', '')), sorted(parameters) ], ensure_ascii=False)
+    return hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+
+# Hit, miss and byte counters of the caches of each source
+class CacheStats:
+    def __init__(self):
+        self.counters: dict[str, dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def _counter(self, source: str) -> dict[str, int]:
+        if source not in self.counters:
+            self.counters[source] = { 'hits': 0, 'misses': 0, 'bytes_read': 0, 'bytes_written': 0 }
+        return self.counters[source]
+
+    def record_hit(self, source: str, num_bytes: int = 0):
+        with self.lock:
+            counter = self._counter(source)
+            counter['hits'] += 1
+            counter['bytes_read'] += num_bytes
+
+    def record_miss(self, source: str):
+        with self.lock:
+            self._counter(source)['misses'] += 1
+
+    def record_write(self, source: str, num_bytes: int = 0):
+        with self.lock:
+            self._counter(source)['bytes_written'] += num_bytes
+
+    def summary(self) -> dict[str, dict]:
+        with self.lock:
+            summary = {}
+            for source, counter in sorted(self.counters.items()):
+                requests = counter['hits'] + counter['misses']
+                summary[source] = dict(counter, hit_ratio=counter['hits'] / requests if requests > 0 else 0.0)
+            return summary
+
+    # Logs the counters of each source and writes them to a JSON file
+    def report(self, filename: str | None = 'data/cache_stats.json') -> dict[str, dict]:
+        summary = self.summary()
+        for source, counter in summary.items():
+            logging.info(f"Cache {source}: {counter['hits']} hits, {counter['misses']} misses ({counter['hit_ratio']:.1%} hit ratio), {counter['bytes_read']} bytes read, {counter['bytes_written']} bytes written")
+        if filename != None and len(summary) > 0:
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            stats_file = open(filename, 'w')
+            json.dump(summary, stats_file, indent=2)
+            stats_file.close()
+        return summary
+
+cache_stats = CacheStats()
+
+def cache_filepath(prefix: str, fingerprint: str, extension: str = 'json') -> str:
+    return f'{prefix}{fingerprint}.{extension}'
+
+# Moves a cache file stored under a former key to its fingerprint path, so that previously cached answers are kept
+def migrate_legacy_cache(legacy_filepath: str | None, filepath: str):
+    if legacy_filepath != None and not os.path.exists(filepath) and os.path.exists(legacy_filepath):
+        os.replace(legacy_filepath, filepath)
+
+# Reads a cached JSON answer and counts the hit or the miss. Returns None on a miss.
+def read_cached_json(source: str, filepath: str, legacy_filepath: str | None = None):
+    migrate_legacy_cache(legacy_filepath, filepath)
+    if not os.path.exists(filepath):
+        cache_stats.record_miss(source)
+        return None
+    cache_file = open(filepath, 'r')
+    cached_json = json.load(cache_file)
+    cache_file.close()
+    cache_stats.record_hit(source, os.path.getsize(filepath))
+    return cached_json
+
+def write_cached_json(source: str, filepath: str, data):
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    json_string = json.dumps(data)
+    cache_file = open(filepath, 'w')
+    cache_file.write(json_string)
+    cache_file.close()
+    cache_stats.record_write(source, len(json_string.encode('utf-8')))
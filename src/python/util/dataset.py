@@ -0,0 +1,114 @@
+from rdflib import Graph, URIRef
+from kg.CONSTANTS import GRAPH
+import hashlib
+import os
+import shutil
+import logging
+
+from util.lazy_graph import LazyGraph
+from util.memory import memory_budget
+from util.metrics import metrics
+
+# N-Quads dataset output
+# Each source output is written as its own named graph so that a triple store can drop and reload one source at a time.
+# The final dataset is the concatenation of the per-source N-Quads files.
+dataset_path = 'data/rdf/dataset/'
+dataset_filename = 'data/rdf/data.nq'
+
+def nquads_output_enabled() -> bool:
+    return os.getenv('rdf_output_nquads', 'false').lower() in ('1', 'true', 'yes')
+
+def named_graph_uri(graph_name: str) -> URIRef:
+    run_id = os.getenv('rdf_output_run_id')
+    if run_id is not None and run_id != '':
+        return GRAPH[f'{graph_name}/{run_id}']
+    return GRAPH[graph_name]
+
+def named_graph_filename(graph_name: str) -> str:
+    return f'{dataset_path}{graph_name}.nq'
+
+def write_named_graph(graph: Graph, graph_name: str) -> str:
+    graph_uri = named_graph_uri(graph_name)
+    nquads_filename = named_graph_filename(graph_name)
+    ntriples_filename = nquads_filename + '.nt.tmp'
+    os.makedirs(dataset_path, exist_ok=True)
+    # N-Triples has one triple per line, so adding the graph label before the final dot of each line gives N-Quads
+    graph.serialize(destination=ntriples_filename, format='nt', encoding='utf-8')
+    graph_label = f' <{graph_uri}> .\n'
+    with open(ntriples_filename, 'r', encoding='utf-8') as ntriples_file, open(nquads_filename + '.tmp', 'w', encoding='utf-8') as nquads_file:
+        for line in ntriples_file:
+            line = line.rstrip()
+            if line == '' or not line.endswith('.'):
+                continue
+            nquads_file.write(line[:-1].rstrip() + graph_label)
+    os.replace(nquads_filename + '.tmp', nquads_filename)
+    os.remove(ntriples_filename)
+    logging.info(f'Named graph {graph_uri} written to {nquads_filename}')
+    return nquads_filename
+
+# Writes a source graph to its Turtle file and, if enabled, to its named graph in the dataset.
+# The files are written to a .tmp file renamed once complete, so that a stage reading the graphs of the other sources while they are written
+# reads either the previous file or the new one, never a truncated file.
+def write_source_graph(graph: Graph | LazyGraph, filename: str):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    if isinstance(graph, LazyGraph) and len(graph.spilled_filenames()) > 0:
+        # A graph spilled to disk by the memory budget is written by merging its chunks, its last triples being spilled too, without loading them
+        memory_budget.spill(graph)
+        merge_ntriples_files(graph.spilled_filenames(), filename)
+        return
+    graph.serialize(destination=filename + '.tmp', format='turtle')
+    os.replace(filename + '.tmp', filename)
+    graph_name = os.path.splitext(os.path.basename(filename))[0]
+    metrics.record_triples(graph_name, len(graph))
+    if nquads_output_enabled():
+        write_named_graph(graph, graph_name)
+
+# Merges N-Triples files into the Turtle file of a source, without loading them in a graph.
+# N-Triples is a subset of Turtle, so the concatenation of the files is a valid Turtle file.
+# The triples are deduplicated within each file, a spilled chunk of a graph, so that the memory used is bounded by the size of a chunk:
+# a triple of several chunks is written once per chunk, the duplicates being merged by the RDF parsers.
+# The named graph of the source is written from the same lines if the N-Quads output is enabled.
+def merge_ntriples_files(ntriples_filenames: list[str], filename: str) -> int:
+    num_triples = 0
+    nquads_file = None
+    if nquads_output_enabled():
+        graph_name = os.path.splitext(os.path.basename(filename))[0]
+        graph_label = f' <{named_graph_uri(graph_name)}> .\n'
+        os.makedirs(dataset_path, exist_ok=True)
+        nquads_file = open(named_graph_filename(graph_name) + '.tmp', 'w', encoding='utf-8')
+    with open(filename + '.tmp', 'w', encoding='utf-8') as turtle_file:
+        for ntriples_filename in ntriples_filenames:
+            seen_triples: set[bytes] = set()
+            with open(ntriples_filename, 'r', encoding='utf-8') as ntriples_file:
+                for line in ntriples_file:
+                    line = line.strip()
+                    if line == '' or line.startswith('#'):
+                        continue
+                    triple_digest = hashlib.blake2b(line.encode('utf-8'), digest_size=16).digest()
+                    if triple_digest in seen_triples:
+                        continue
+                    seen_triples.add(triple_digest)
+                    num_triples += 1
+                    turtle_file.write(line + '\n')
+                    if nquads_file != None:
+                        nquads_file.write(line[:-1].rstrip() + graph_label)
+    os.replace(filename + '.tmp', filename)
+    if nquads_file != None:
+        nquads_file.close()
+        os.replace(named_graph_filename(graph_name) + '.tmp', named_graph_filename(graph_name))
+    logging.info(f'{len(ntriples_filenames)} N-Triples files merged into {filename}, {num_triples} triples')
+    metrics.record_triples(os.path.splitext(os.path.basename(filename))[0], num_triples)
+    return num_triples
+
+# Merges the named graphs into a single dataset file, without loading them.
+# Only the given graphs are merged, the other files of the dataset directory being the graphs of sources no longer harvested.
+def concatenate_datasets(graph_names: list[str], destination: str = dataset_filename) -> str:
+    os.makedirs(dataset_path, exist_ok=True)
+    nquads_filenames = [ named_graph_filename(graph_name) for graph_name in sorted(graph_names) if os.path.exists(named_graph_filename(graph_name)) ]
+    with open(destination + '.tmp', 'wb') as dataset_file:
+        for nquads_filename in nquads_filenames:
+            with open(nquads_filename, 'rb') as nquads_file:
+                shutil.copyfileobj(nquads_file, dataset_file)
+    os.replace(destination + '.tmp', destination)
+    logging.info(f'{len(nquads_filenames)} named graphs concatenated into {destination}')
+    return destination
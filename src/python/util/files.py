@@ -0,0 +1,16 @@
+import gzip
+import io
+
+# Opens a file in binary mode, decompressing it if it starts with the gzip magic number, so that dumps can be read as downloaded
+def open_binary_file(filename: str) -> io.BufferedIOBase:
+    binary_file = open(filename, 'rb')
+    magic_number = binary_file.read(2)
+    if magic_number == b'\x1f\x8b':
+        # gzip.open opens its own file, closed with the decompressing file, which a GzipFile given a file object does not close
+        binary_file.close()
+        return gzip.open(filename, 'rb')
+    binary_file.seek(0)
+    return binary_file
+
+def open_text_file(filename: str) -> io.TextIOBase:
+    return io.TextIOWrapper(open_binary_file(filename), encoding='utf-8')
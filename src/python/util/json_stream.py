@@ -0,0 +1,137 @@
+from typing import Iterator
+from util.files import open_text_file
+import json
+import re
+
+json_stream_chunk_size = 1 << 16
+json_whitespace = ' \t\n\r'
+json_number_characters = '0123456789+-.eE'
+json_structure_regex = re.compile(r'["{}\[\],:]')
+json_string_special_regex = re.compile(r'["\\]')
+
+# Yields the elements of the top-level JSON array of a file one at a time.
+# If key is given, the array is the value of the first member with this name, e.g. the "bindings" of a SPARQL JSON result, at key_depth objects and
+# arrays deep if it is given, e.g. 2 for the "bindings" in "results".
+# Only the current element and one chunk of the file are held in memory, whatever the size of the array.
+def iter_json_array(filename: str, chunk_size: int = json_stream_chunk_size, key: str | None = None, key_depth: int | None = None) -> Iterator:
+    decoder = json.JSONDecoder()
+    json_file = open_text_file(filename)
+    try:
+        buffer = ''
+        position = 0
+        eof = False
+
+        # Skips the whitespace and returns the next character, reading more chunks when the buffer is exhausted
+        def next_character() -> str | None:
+            nonlocal buffer, position, eof
+            while True:
+                while position < len(buffer) and buffer[position] in json_whitespace:
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if eof:
+                    return None
+                buffer = json_file.read(chunk_size)
+                position = 0
+                eof = len(buffer) == 0
+
+        if key != None:
+            # The members are read up to the key, the strings and the depth of the containers being tracked so that the name is only
+            # matched as the name of a member, at the given depth, and not in a string value or in a member of another depth
+            stack: list[str] = []
+            in_string = False
+            key_expected = False
+            key_token = False
+            token_start = 0
+            scan = 0
+            while True:
+                if scan >= len(buffer):
+                    if eof:
+                        raise ValueError(f'{filename} has no member {key}')
+                    # The current string is kept in case it is cut by the chunk
+                    kept = token_start if in_string else scan
+                    chunk = json_file.read(chunk_size)
+                    eof = len(chunk) == 0
+                    buffer = buffer[kept:] + chunk
+                    token_start -= kept
+                    scan -= kept
+                    continue
+                if in_string:
+                    match = json_string_special_regex.search(buffer, scan)
+                    if match is None:
+                        scan = len(buffer)
+                        continue
+                    scan = match.start()
+                    if buffer[scan] == '\\':
+                        scan += 2
+                        continue
+                    in_string = False
+                    scan += 1
+                    if key_token and (key_depth is None or len(stack) == key_depth) and json.loads(buffer[token_start:scan]) == key:
+                        position = scan
+                        break
+                    continue
+                match = json_structure_regex.search(buffer, scan)
+                if match is None:
+                    scan = len(buffer)
+                    continue
+                scan = match.start()
+                character = buffer[scan]
+                if character == '"':
+                    in_string = True
+                    key_token = key_expected
+                    key_expected = False
+                    token_start = scan
+                elif character in '{[':
+                    stack.append(character)
+                    key_expected = character == '{'
+                elif character in '}]':
+                    if len(stack) > 0:
+                        stack.pop()
+                    key_expected = False
+                elif character == ',':
+                    key_expected = len(stack) > 0 and stack[-1] == '{'
+                else:
+                    key_expected = False
+                scan += 1
+            if next_character() != ':':
+                raise ValueError(f'Expected : after {json.dumps(key)} in {filename}')
+            position += 1
+
+        if next_character() != '[':
+            raise ValueError(f'{filename} does not contain a JSON array')
+        position += 1
+        if next_character() == ']':
+            return
+        while True:
+            if next_character() is None:
+                raise ValueError(f'Unexpected end of file in {filename}')
+            # The element may be split between chunks: more of the file is read until it decodes
+            while True:
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                    # A number cut by the end of the buffer is decoded up to the cut, e.g. 1 for "1." or 3 for "3e":
+                    # the element is only complete when a character which is not part of a number follows it
+                    if eof or (end < len(buffer) and buffer[end] not in json_number_characters):
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = json_file.read(chunk_size)
+                eof = len(chunk) == 0
+                buffer = buffer[position:] + chunk
+                position = 0
+            position = end
+            yield element
+            separator = next_character()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f'Expected , or ] after element in {filename}, found {separator}')
+            position += 1
+            # The decoded elements are dropped from the buffer
+            if position > chunk_size:
+                buffer = buffer[position:]
+                position = 0
+    finally:
+        json_file.close()
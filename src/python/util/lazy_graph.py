@@ -0,0 +1,66 @@
+import threading
+
+from rdflib import Graph
+
+# Graph created on first use, so that importing a source module does not allocate the graphs of the sources that are not run.
+# The attributes and methods are those of the underlying rdflib Graph.
+# The triples can be spilled to N-Triples chunk files to free the memory, the length of the graph counting the spilled triples.
+class LazyGraph:
+    def __init__(self, *args, **kwargs):
+        self._graph_args = args
+        self._graph_kwargs = kwargs
+        self._graph: Graph | None = None
+        self._graph_lock = threading.Lock()
+        self._spilled_filenames: list[str] = []
+        self._spilled_triples = 0
+
+    @property
+    def graph(self) -> Graph:
+        if self._graph is None:
+            with self._graph_lock:
+                if self._graph is None:
+                    self._graph = Graph(*self._graph_args, **self._graph_kwargs)
+        return self._graph
+
+    def is_created(self) -> bool:
+        return self._graph is not None
+
+    def __getattr__(self, name: str):
+        return getattr(self.graph, name)
+
+    def __len__(self) -> int:
+        return self.in_memory_len() + self._spilled_triples
+
+    def in_memory_len(self) -> int:
+        if self._graph is None:
+            return 0
+        return len(self._graph)
+
+    # Writes the triples in memory to a chunk file and starts a new empty graph.
+    # Only for the graphs that are written but not queried, as the spilled triples are no longer seen by the queries on the graph.
+    # The caller must be the only thread adding triples to the graph.
+    def spill(self, filename: str) -> int:
+        with self._graph_lock:
+            graph = self._graph
+            if graph is None or len(graph) == 0:
+                return 0
+            num_triples = len(graph)
+            graph.serialize(destination=filename, format='nt', encoding='utf-8')
+            self._spilled_filenames.append(filename)
+            self._spilled_triples += num_triples
+            self._graph = Graph(*self._graph_args, **self._graph_kwargs)
+        graph.close()
+        return num_triples
+
+    def spilled_filenames(self) -> list[str]:
+        return list(self._spilled_filenames)
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def __contains__(self, triple) -> bool:
+        return triple in self.graph
+
+    def __iadd__(self, other):
+        self.graph.__iadd__(other)
+        return self
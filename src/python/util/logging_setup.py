@@ -0,0 +1,161 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+# Logging of a run, configured once by the entry point.
+# The records are put on a queue by the thread that logs them and written to the log file by a background thread, so that the loops do not wait for the disk.
+# The message of a record is formatted by the background thread, from the template and the arguments of the call: the loops log with the lazy %-style
+# (logging.debug('Added %s', label)) so that a record dropped by its level or by the rate limit costs no formatting, and the arguments should not be modified after the call.
+# Each message template is rate limited: above rate_limit records per second, the records of the template are dropped, and the next record kept reports how many were.
+# The warnings and errors are never dropped. The buckets of the templates are bounded to max_rate_limit_buckets: the idle ones, full again with no dropped
+# record, are removed first, then the oldest ones, a message logged with an f-string being a new template at each call.
+log_filename = 'app.log'
+max_rate_limit_buckets = 1024
+
+# Attributes of every log record, the other attributes being the extra fields of the call
+standard_record_attributes = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | { 'message', 'asctime', 'taskName' }
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate_limit: float, burst: int | None = None, max_level: int = logging.INFO, max_buckets: int = max_rate_limit_buckets):
+        super().__init__()
+        # Records per second kept for each template, after a burst of records kept at once
+        self.rate_limit = rate_limit
+        self.burst = burst if burst != None else max(int(rate_limit), 1)
+        self.max_level = max_level
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        # Remaining tokens, time of the last refill and number of dropped records, by logger and template
+        self.buckets: dict[tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate_limit <= 0 or record.levelno > self.max_level:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    self.remove_buckets(now)
+                bucket = [ float(self.burst), now, 0 ]
+                self.buckets[key] = bucket
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate_limit)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            if bucket[2] > 0:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+    # Called with the lock held
+    def remove_buckets(self, now: float):
+        refill_time = self.burst / self.rate_limit
+        for key in [ key for key, bucket in self.buckets.items() if bucket[2] == 0 and now - bucket[1] >= refill_time ]:
+            del self.buckets[key]
+        # The buckets are in the order of their first record
+        for key in list(self.buckets)[:len(self.buckets) - self.max_buckets // 2]:
+            del self.buckets[key]
+
+def record_fields(record: logging.LogRecord) -> dict:
+    return { key: value for key, value in record.__dict__.items() if key not in standard_record_attributes }
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if hasattr(record, 'suppressed'):
+            text += f' ({record.suppressed} similar records suppressed)' # type: ignore
+        return text
+
+# One JSON object per line, with the extra fields of the call, e.g. logging.info('Page read', extra={ 'source': 'hal', 'page': 3 })
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        json_record = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'location': f'{record.module}:{record.lineno}',
+            'template': str(record.msg),
+            'message': record.getMessage(),
+        }
+        json_record.update(record_fields(record))
+        if record.exc_info:
+            json_record['exception'] = self.formatException(record.exc_info)
+        return json.dumps(json_record, default=str, ensure_ascii=False)
+
+# Puts the records on the queue as they are, their message being formatted by the listener thread
+class BackgroundQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+listener: QueueListener | None = None
+
+def configure_logging(filename: str | None = None, level: str | int | None = None, json_format: bool | None = None, rate_limit: float | None = None) -> QueueListener:
+    global listener
+    if filename is None:
+        filename = os.getenv('log_file', log_filename)
+    if level is None:
+        level = os.getenv('log_level', 'INFO').upper()
+    if json_format is None:
+        json_format = os.getenv('log_format', 'text').lower() == 'json'
+    if rate_limit is None:
+        rate_limit = float(os.getenv('log_rate_limit', '10'))
+    stop_logging()
+
+    file_handler = logging.FileHandler(filename, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter() if json_format else TextFormatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    queue_handler = BackgroundQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(rate_limit))
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+# Writes the records still on the queue and stops the background thread
+def stop_logging():
+    global listener
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    listener = None
+
+atexit.register(stop_logging)
+
+# Logging of the worker processes of a ProcessPoolExecutor. A forked worker inherits the queue handler of the parent but not its listener thread,
+# and a spawned or fork server worker has no handler, so their records would be lost: the workers put their records on a queue shared with the parent,
+# where a listener thread logs them again with the loggers of the parent.
+class ForwardingHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+# Returns the queue given to the workers and its listener, to stop once the pool is shut down. The queue is created by the context that starts the workers.
+def start_worker_logging(mp_context=multiprocessing) -> tuple[multiprocessing.Queue, QueueListener]:
+    worker_queue = mp_context.Queue()
+    worker_listener = QueueListener(worker_queue, ForwardingHandler())
+    worker_listener.start()
+    return worker_queue, worker_listener
+
+# Initializer of the workers: their records, formatted in the worker so that their arguments are not pickled, go to the queue of the parent
+def configure_worker_logging(worker_queue: multiprocessing.Queue, level: int):
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(worker_queue))
+    root_logger.setLevel(level)
@@ -0,0 +1,139 @@
+from typing import TYPE_CHECKING
+import gc
+import logging
+import os
+import shutil
+import threading
+import time
+import tracemalloc
+import weakref
+
+from util.metrics import current_rss_bytes, metrics
+
+# rdflib is only needed once a graph is registered, it is not imported with the pipeline
+if TYPE_CHECKING:
+    from util.lazy_graph import LazyGraph
+
+# Memory budget of a run.
+# The source graphs are registered with the budget, and the loops filling them check the budget between two entities.
+# When the triples in memory or the resident set size are above the budget, the graphs of the caller are spilled to N-Triples chunk files
+# and emptied, the chunks being merged into the output file of the graph when it is written (see util.dataset.write_source_graph).
+# The allocations of each stage can also be traced with tracemalloc, which slows the run down and is meant for investigations.
+spill_path = 'data/spill/'
+
+class MemoryBudget:
+    def __init__(self, max_rss_bytes: int | None = None, max_triples: int | None = None, min_spill_triples: int = 50000, check_interval: float = 1.0, spill_path: str = spill_path):
+        self.max_rss_bytes = max_rss_bytes
+        self.max_triples = max_triples
+        # A graph smaller than this is not spilled, so that a resident set size that does not decrease after a spill does not give one chunk per check
+        self.min_spill_triples = min_spill_triples
+        # Seconds between two reads of the resident set size, the triples in memory being counted at each check
+        self.check_interval = check_interval
+        self.spill_path = spill_path
+        self.trace_allocations = False
+        self.lock = threading.Lock()
+        # Registered graphs and their names, a graph no longer used elsewhere leaving the budget
+        self.graph_names: weakref.WeakKeyDictionary['LazyGraph', str] = weakref.WeakKeyDictionary()
+        self.chunk_counts: dict[str, int] = {}
+        self.rss_bytes: int | None = None
+        self.rss_time = 0.0
+        self.stage_snapshots: dict[str, tracemalloc.Snapshot] = {}
+
+    def configure(self, max_rss_bytes: int | None = None, max_triples: int | None = None, trace_allocations: bool = False):
+        self.max_rss_bytes = max_rss_bytes
+        self.max_triples = max_triples
+        self.trace_allocations = trace_allocations
+        if self.enabled():
+            logging.info(f'Memory budget: {max_rss_bytes} bytes of resident set size, {max_triples} triples in memory')
+
+    def enabled(self) -> bool:
+        return self.max_rss_bytes != None or self.max_triples != None
+
+    # Registers a graph that can be spilled, named after the output file it is written to
+    def register(self, name: str, graph: 'LazyGraph') -> 'LazyGraph':
+        with self.lock:
+            self.graph_names[graph] = name
+        return graph
+
+    def in_memory_triples(self) -> int:
+        with self.lock:
+            graphs = list(self.graph_names.keys())
+        return sum(graph.in_memory_len() for graph in graphs)
+
+    def current_rss_bytes(self) -> int | None:
+        now = time.monotonic()
+        if now - self.rss_time >= self.check_interval:
+            self.rss_bytes = current_rss_bytes()
+            self.rss_time = now
+        return self.rss_bytes
+
+    def over_budget(self) -> bool:
+        if self.max_triples != None and self.in_memory_triples() > self.max_triples:
+            return True
+        if self.max_rss_bytes != None:
+            rss_bytes = self.current_rss_bytes()
+            return rss_bytes != None and rss_bytes > self.max_rss_bytes
+        return False
+
+    # Spills the given graphs if the budget is exceeded, and returns the number of triples spilled.
+    # Called by the thread adding triples to these graphs, the graphs of the other stages being spilled by their own checks.
+    def check(self, *graphs: 'LazyGraph') -> int:
+        if not self.enabled() or not self.over_budget():
+            return 0
+        num_spilled_triples = 0
+        for graph in graphs:
+            if graph in self.graph_names and graph.in_memory_len() >= self.min_spill_triples:
+                num_spilled_triples += self.spill(graph)
+        if num_spilled_triples > 0:
+            gc.collect()
+            # The resident set size is read again at the next check
+            self.rss_time = 0.0
+        return num_spilled_triples
+
+    def chunk_path(self) -> str:
+        return f'{self.spill_path}{os.getpid()}/'
+
+    def spill(self, graph: 'LazyGraph') -> int:
+        name = self.graph_names.get(graph, 'graph')
+        with self.lock:
+            chunk_index = self.chunk_counts.get(name, 0)
+            self.chunk_counts[name] = chunk_index + 1
+        os.makedirs(self.chunk_path(), exist_ok=True)
+        num_triples = graph.spill(f'{self.chunk_path()}{name}_{chunk_index:05d}.nt')
+        if num_triples > 0:
+            logging.info('Spilled %d triples of %s to disk', num_triples, name)
+            metrics.record_spill(name, num_triples)
+        return num_triples
+
+    # Removes the chunk files once the graphs have been written
+    def remove_chunks(self):
+        if os.path.exists(self.chunk_path()):
+            shutil.rmtree(self.chunk_path(), ignore_errors=True)
+
+    # The allocations of a stage are the difference between the snapshots taken when it starts and when it ends.
+    # The stages running concurrently are traced together, so the difference also counts the allocations of the other stages.
+    def stage_started(self, name: str):
+        if not self.trace_allocations:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        with self.lock:
+            self.stage_snapshots[name] = snapshot
+
+    def stage_finished(self, name: str, num_top_allocations: int = 10):
+        with self.lock:
+            start_snapshot = self.stage_snapshots.pop(name, None)
+        if start_snapshot is None or not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, tracemalloc.__file__) ])
+        statistics = snapshot.compare_to(start_snapshot.filter_traces([ tracemalloc.Filter(False, tracemalloc.__file__) ]), 'lineno')
+        allocated_bytes = sum(statistic.size_diff for statistic in statistics)
+        top_allocations = [ (str(statistic.traceback), statistic.size_diff) for statistic in statistics[:num_top_allocations] ]
+        _, traced_peak_bytes = tracemalloc.get_traced_memory()
+        metrics.record_stage_memory(name, allocated_bytes, traced_peak_bytes, top_allocations)
+        logging.info(f'Stage {name} allocated {allocated_bytes / (1 << 20):.1f} MiB')
+        for location, size in top_allocations:
+            logging.info(f'  {location}: {size / 1024:.0f} KiB')
+
+memory_budget = MemoryBudget()
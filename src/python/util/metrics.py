@@ -0,0 +1,310 @@
+from urllib.parse import urlsplit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from util.cache import cache_stats
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on Unix
+    resource = None
+
+# Metrics of a run: wall time of the stages, requests and latency per host, retries, cache hit ratios, entities and triples emitted per source, and peak memory.
+# They are exported as a JSON report and as a Prometheus textfile, at the end of the run and periodically while it runs.
+metrics_json_filename = 'data/metrics/metrics.json'
+metrics_prometheus_filename = 'data/metrics/metrics.prom'
+metrics_prefix = 'kg'
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    def __init__(self, buckets: tuple[float, ...] = latency_buckets):
+        self.buckets = buckets
+        # Non cumulative counts, the last one being the count of the latencies above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Smallest bucket bound below which the given fraction of the latencies are
+    def quantile(self, fraction: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        cumulative_count = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return bound
+        return self.max
+
+    def summary(self) -> dict:
+        cumulative_counts = []
+        cumulative_count = 0
+        for count in self.counts:
+            cumulative_count += count
+            cumulative_counts.append(cumulative_count)
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count > 0 else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': self.max,
+            'buckets': { str(bound): count for bound, count in zip(self.buckets + (float('inf'),), cumulative_counts) },
+        }
+
+# Count of the entities or triples emitted by a source, with the time of the first and last ones for the throughput
+class EmissionCounter:
+    def __init__(self, now: float):
+        self.count = 0
+        self.first_time = now
+        self.last_time = now
+
+    def add(self, count: int, now: float):
+        self.count += count
+        self.last_time = now
+
+    def summary(self, start_time: float) -> dict:
+        # A counter updated once, such as the triples of a graph written at the end of a stage, is rated over the run until then
+        first_time = self.first_time if self.last_time > self.first_time else start_time
+        return { 'count': self.count, 'per_second': self.count / max(self.last_time - first_time, 1e-9) }
+
+# Peak resident set size of the process and of its finished children, in bytes, or None if it is not available
+def peak_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux gives kilobytes, macOS gives bytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+# Current resident set size of the process, in bytes, read from /proc on Linux, or the peak resident set size elsewhere
+def current_rss_bytes() -> int | None:
+    try:
+        statm_file = open('/proc/self/statm', 'r')
+        resident_pages = int(statm_file.read().split()[1])
+        statm_file.close()
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_bytes()
+
+def prometheus_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_labels(labels: dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{key}="{prometheus_label_value(str(value))}"' for key, value in labels.items()) + '}'
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.stages: dict[str, dict] = {}
+        self.requests: dict[str, dict[str, int]] = {}
+        self.latencies: dict[str, LatencyHistogram] = {}
+        self.retries: dict[str, int] = {}
+        self.entities: dict[str, EmissionCounter] = {}
+        self.triples: dict[str, EmissionCounter] = {}
+        self.spills: dict[str, dict[str, int]] = {}
+        self.stage_memory: dict[str, dict] = {}
+        self.export_thread: threading.Thread | None = None
+        self.export_stop = threading.Event()
+
+    def record_stage(self, name: str, duration: float, status: str):
+        with self.lock:
+            self.stages[name] = { 'duration': duration, 'status': status }
+
+    # Records a request sent to the host of the url, with its status code, or 'error' if no response was received
+    def record_request(self, url: str, duration: float, status: int | str):
+        host = urlsplit(url).netloc.lower() or url
+        with self.lock:
+            host_requests = self.requests.setdefault(host, {})
+            host_requests[str(status)] = host_requests.get(str(status), 0) + 1
+            if host not in self.latencies:
+                self.latencies[host] = LatencyHistogram()
+            self.latencies[host].observe(duration)
+
+    def record_retry(self, url: str):
+        host = urlsplit(url).netloc.lower() or url
+        with self.lock:
+            self.retries[host] = self.retries.get(host, 0) + 1
+
+    # Entities (records, articles, projects, people...) converted by a source.
+    # Recording 0 entities marks the start of the emission, for the throughput of a source recording its entities by batches.
+    def record_entities(self, source: str, count: int = 1):
+        now = time.time()
+        with self.lock:
+            if source not in self.entities:
+                self.entities[source] = EmissionCounter(now)
+            self.entities[source].add(count, now)
+
+    def record_triples(self, graph_name: str, count: int):
+        now = time.time()
+        with self.lock:
+            if graph_name not in self.triples:
+                self.triples[graph_name] = EmissionCounter(now)
+            self.triples[graph_name].add(count, now)
+
+    # Triples of a graph spilled to disk to stay within the memory budget
+    def record_spill(self, graph_name: str, count: int):
+        with self.lock:
+            graph_spills = self.spills.setdefault(graph_name, { 'chunks': 0, 'triples': 0 })
+            graph_spills['chunks'] += 1
+            graph_spills['triples'] += count
+
+    # Memory allocated by a stage, traced by tracemalloc, with its largest allocation sites
+    def record_stage_memory(self, name: str, allocated_bytes: int, traced_peak_bytes: int, top_allocations: list[tuple[str, int]]):
+        with self.lock:
+            self.stage_memory[name] = { 'allocated_bytes': allocated_bytes, 'traced_peak_bytes': traced_peak_bytes, 'top_allocations': dict(top_allocations) }
+
+    def summary(self) -> dict:
+        with self.lock:
+            hosts = {}
+            for host, statuses in sorted(self.requests.items()):
+                hosts[host] = {
+                    'requests': sum(statuses.values()),
+                    'statuses': dict(sorted(statuses.items())),
+                    'retries': self.retries.get(host, 0),
+                    'latency': self.latencies[host].summary(),
+                }
+            for host, retries in self.retries.items():
+                if host not in hosts:
+                    hosts[host] = { 'requests': 0, 'statuses': {}, 'retries': retries, 'latency': LatencyHistogram().summary() }
+            summary = {
+                'started_at': self.start_time,
+                'duration': time.time() - self.start_time,
+                'peak_rss_bytes': peak_rss_bytes(),
+                'rss_bytes': current_rss_bytes(),
+                'stages': dict(self.stages),
+                'hosts': hosts,
+                'entities': { source: counter.summary(self.start_time) for source, counter in sorted(self.entities.items()) },
+                'triples': { graph_name: counter.summary(self.start_time) for graph_name, counter in sorted(self.triples.items()) },
+                'spills': { graph_name: dict(graph_spills) for graph_name, graph_spills in sorted(self.spills.items()) },
+                'stage_memory': dict(self.stage_memory),
+            }
+        summary['caches'] = cache_stats.summary()
+        return summary
+
+    def prometheus_text(self, summary: dict | None = None) -> str:
+        if summary is None:
+            summary = self.summary()
+        lines = []
+        def metric(name: str, metric_type: str, description: str, samples: list[tuple[dict, float]]):
+            lines.append(f'# HELP {metrics_prefix}_{name} {description}')
+            lines.append(f'# TYPE {metrics_prefix}_{name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{metrics_prefix}_{name}{prometheus_labels(labels)} {value}')
+
+        metric('run_duration_seconds', 'gauge', 'Wall time of the run so far', [({}, summary['duration'])])
+        if summary['peak_rss_bytes'] != None:
+            metric('peak_rss_bytes', 'gauge', 'Peak resident set size of the run', [({}, summary['peak_rss_bytes'])])
+        if summary['rss_bytes'] != None:
+            metric('rss_bytes', 'gauge', 'Resident set size of the run', [({}, summary['rss_bytes'])])
+        metric('stage_duration_seconds', 'gauge', 'Wall time of the pipeline stages',
+               [({ 'stage': name, 'status': stage['status'] }, stage['duration']) for name, stage in summary['stages'].items()])
+        metric('http_requests_total', 'counter', 'Requests sent, by host and status',
+               [({ 'host': host, 'status': status }, count) for host, host_summary in summary['hosts'].items() for status, count in host_summary['statuses'].items()])
+        metric('http_retries_total', 'counter', 'Requests retried, by host',
+               [({ 'host': host }, host_summary['retries']) for host, host_summary in summary['hosts'].items()])
+        lines.append(f'# HELP {metrics_prefix}_http_request_duration_seconds Latency of the requests, by host')
+        lines.append(f'# TYPE {metrics_prefix}_http_request_duration_seconds histogram')
+        for host, host_summary in summary['hosts'].items():
+            latency = host_summary['latency']
+            for bound, count in latency['buckets'].items():
+                bound_label = '+Inf' if bound == 'inf' else bound
+                lines.append(f'{metrics_prefix}_http_request_duration_seconds_bucket{prometheus_labels({ "host": host, "le": bound_label })} {count}')
+            lines.append(f'{metrics_prefix}_http_request_duration_seconds_sum{prometheus_labels({ "host": host })} {latency["sum"]}')
+            lines.append(f'{metrics_prefix}_http_request_duration_seconds_count{prometheus_labels({ "host": host })} {latency["count"]}')
+        metric('cache_hits_total', 'counter', 'Answers read from the cache, by source',
+               [({ 'source': source }, cache['hits']) for source, cache in summary['caches'].items()])
+        metric('cache_misses_total', 'counter', 'Answers missing from the cache, by source',
+               [({ 'source': source }, cache['misses']) for source, cache in summary['caches'].items()])
+        metric('cache_hit_ratio', 'gauge', 'Ratio of the answers read from the cache, by source',
+               [({ 'source': source }, cache['hit_ratio']) for source, cache in summary['caches'].items()])
+        metric('entities_total', 'counter', 'Entities converted, by source',
+               [({ 'source': source }, counter['count']) for source, counter in summary['entities'].items()])
+        metric('entities_per_second', 'gauge', 'Throughput of the entity conversion, by source',
+               [({ 'source': source }, counter['per_second']) for source, counter in summary['entities'].items()])
+        metric('triples_total', 'counter', 'Triples written, by graph',
+               [({ 'graph': graph_name }, counter['count']) for graph_name, counter in summary['triples'].items()])
+        metric('triples_per_second', 'gauge', 'Throughput of the triple emission, by graph',
+               [({ 'graph': graph_name }, counter['per_second']) for graph_name, counter in summary['triples'].items()])
+        metric('graph_spills_total', 'counter', 'Chunks spilled to disk to stay within the memory budget, by graph',
+               [({ 'graph': graph_name }, graph_spills['chunks']) for graph_name, graph_spills in summary['spills'].items()])
+        metric('graph_spilled_triples_total', 'counter', 'Triples spilled to disk to stay within the memory budget, by graph',
+               [({ 'graph': graph_name }, graph_spills['triples']) for graph_name, graph_spills in summary['spills'].items()])
+        metric('stage_allocated_bytes', 'gauge', 'Memory allocated by the stages, traced by tracemalloc',
+               [({ 'stage': name }, stage_memory['allocated_bytes']) for name, stage_memory in summary['stage_memory'].items()])
+        return '\n'.join(lines) + '\n'
+
+    # Writes the JSON report and the Prometheus textfile. Both are replaced atomically, so that a collector never reads a partial file.
+    def export(self, json_filename: str | None = metrics_json_filename, prometheus_filename: str | None = metrics_prometheus_filename) -> dict:
+        summary = self.summary()
+        for filename, content in ((json_filename, lambda: json.dumps(summary, indent=2)), (prometheus_filename, lambda: self.prometheus_text(summary))):
+            if filename is None:
+                continue
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            metrics_file = open(filename + '.tmp', 'w')
+            metrics_file.write(content())
+            metrics_file.close()
+            os.replace(filename + '.tmp', filename)
+        return summary
+
+    # Logs the slowest stages and hosts, to see which source is the bottleneck
+    def report(self, summary: dict | None = None):
+        if summary is None:
+            summary = self.summary()
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: item[1]['duration'], reverse=True):
+            logging.info(f"Stage {name}: {stage['duration']:.1f}s ({stage['status']})")
+        for host, host_summary in summary['hosts'].items():
+            latency = host_summary['latency']
+            logging.info(f"Host {host}: {host_summary['requests']} requests, {host_summary['retries']} retries, {latency['mean']:.3f}s mean latency, {latency['p95']}s p95")
+        for source, counter in summary['entities'].items():
+            logging.info(f"Entities {source}: {counter['count']} ({counter['per_second']:.1f}/s)")
+        for graph_name, counter in summary['triples'].items():
+            logging.info(f"Triples {graph_name}: {counter['count']} ({counter['per_second']:.1f}/s)")
+        for graph_name, graph_spills in summary['spills'].items():
+            logging.info(f"Spilled {graph_name}: {graph_spills['triples']} triples in {graph_spills['chunks']} chunks")
+        for name, stage_memory in summary['stage_memory'].items():
+            logging.info(f"Stage {name} allocated {stage_memory['allocated_bytes'] / (1 << 20):.0f} MiB (traced peak {stage_memory['traced_peak_bytes'] / (1 << 20):.0f} MiB)")
+        if summary['peak_rss_bytes'] != None:
+            logging.info(f"Peak RSS: {summary['peak_rss_bytes'] / (1 << 20):.0f} MiB")
+
+    # Exports the metrics every interval seconds until stop_periodic_export is called
+    def start_periodic_export(self, interval: float, json_filename: str | None = metrics_json_filename, prometheus_filename: str | None = metrics_prometheus_filename):
+        if interval <= 0 or self.export_thread != None:
+            return
+        self.export_stop.clear()
+        def export_loop():
+            while not self.export_stop.wait(interval):
+                try:
+                    self.export(json_filename, prometheus_filename)
+                except OSError as e:
+                    logging.error(f'Error while exporting the metrics: {e}')
+        self.export_thread = threading.Thread(target=export_loop, name='metrics-export', daemon=True)
+        self.export_thread.start()
+
+    def stop_periodic_export(self):
+        if self.export_thread is None:
+            return
+        self.export_stop.set()
+        self.export_thread.join()
+        self.export_thread = None
+
+metrics = Metrics()
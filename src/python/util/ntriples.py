@@ -0,0 +1,85 @@
+from typing import Iterator
+from util.files import open_text_file
+import re
+
+# Line parser for N-Triples and N-Quads dumps.
+# The terms are returned as they are written in the file (<iri>, _:label or "literal"^^<datatype>), which is enough to filter and index large dumps without building rdflib terms for every line.
+ntriples_iri_pattern = r'<[^>]*>'
+ntriples_bnode_pattern = r'_:[^\s]*[^\s.]'
+ntriples_literal_pattern = r'"(?:[^"\\]|\\.)*"(?:\^\^<[^>]*>|@[A-Za-z0-9-]+)?'
+nquads_line_regex = re.compile(
+    rf'\s*({ntriples_iri_pattern}|{ntriples_bnode_pattern})'
+    rf'\s+({ntriples_iri_pattern})'
+    rf'\s+({ntriples_iri_pattern}|{ntriples_bnode_pattern}|{ntriples_literal_pattern})'
+    rf'(?:\s+({ntriples_iri_pattern}|{ntriples_bnode_pattern}))?'
+    r'\s*\.\s*$')
+ntriples_escape_regex = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ntriples_escapes = { 't': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\' }
+
+# Returns the subject, predicate, object and graph of a line, the graph being None for a triple, or None for an empty, comment or malformed line
+def parse_nquads_line(line: str) -> tuple[str, str, str, str | None] | None:
+    match = nquads_line_regex.match(line)
+    if match is None:
+        return None
+    return match.group(1), match.group(2), match.group(3), match.group(4)
+
+def parse_ntriples_line(line: str) -> tuple[str, str, str] | None:
+    quad = parse_nquads_line(line)
+    if quad is None:
+        return None
+    return quad[0], quad[1], quad[2]
+
+def iter_ntriples_file(filename: str, predicates: set[str] | None = None) -> Iterator[tuple[str, str, str]]:
+    ntriples_file = open_text_file(filename)
+    try:
+        for line in ntriples_file:
+            # Cheap filter on the text of the line before parsing it
+            if predicates != None and not any(predicate in line for predicate in predicates):
+                continue
+            triple = parse_ntriples_line(line)
+            if triple is None:
+                continue
+            if predicates != None and triple[1] not in predicates:
+                continue
+            yield triple
+    finally:
+        ntriples_file.close()
+
+def is_iri(term: str) -> bool:
+    return term.startswith('<')
+
+def is_literal(term: str) -> bool:
+    return term.startswith('"')
+
+def iri_value(term: str) -> str:
+    return term[1:-1]
+
+def unescape_literal(lexical_form: str) -> str:
+    if '\\' not in lexical_form:
+        return lexical_form
+    def unescape(match: re.Match) -> str:
+        if match.group(1) != None:
+            return chr(int(match.group(1), 16))
+        if match.group(2) != None:
+            return chr(int(match.group(2), 16))
+        return ntriples_escapes.get(match.group(3), match.group(3))
+    return ntriples_escape_regex.sub(unescape, lexical_form)
+
+# Returns the lexical form of a literal term, without its datatype or language tag
+def literal_value(term: str) -> str:
+    return unescape_literal(term[1:term.rindex('"')])
+
+# Returns the datatype IRI of a literal term, or None
+def literal_datatype(term: str) -> str | None:
+    datatype_index = term.rfind('"^^<')
+    if datatype_index == -1:
+        return None
+    return term[datatype_index + 4:-1]
+
+# Returns the value of an IRI or of a literal term
+def term_value(term: str) -> str:
+    if is_literal(term):
+        return literal_value(term)
+    if is_iri(term):
+        return iri_value(term)
+    return term
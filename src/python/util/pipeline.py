@@ -0,0 +1,238 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+
+from util.memory import memory_budget
+from util.metrics import metrics
+
+# Pipeline of stages with declared dependencies.
+# The stages whose dependencies are done run concurrently. A stage is skipped when its fingerprint, computed from its declared environment variables,
+# its input files and the fingerprints and last runs of its dependencies, is the one of its last successful run, the result of that run being reused.
+# A dependency run again, e.g. with force, changes the fingerprints of the stages depending on it, which run again too.
+# A run is cancelled by setting cancel_event, e.g. on SIGINT: the stages not started yet are not run, and the running stages stop at their next
+# check_cancelled, called by the loops of the sources.
+pipeline_state_path = 'data/pipeline/'
+cancel_event = threading.Event()
+
+# A BaseException, like KeyboardInterrupt, so that the handlers of the errors of a single record or request do not catch it
+class StageCancelled(BaseException):
+    pass
+
+def check_cancelled():
+    if cancel_event.is_set():
+        raise StageCancelled('Run cancelled')
+
+@dataclass
+class Stage:
+    name: str
+    # Called with the results of the dependencies, by stage name
+    function: Callable[[dict[str, Any]], Any]
+    dependencies: list[str] = field(default_factory=list)
+    # Files or directories read by the stage, and environment variables changing its result
+    inputs: list[str] = field(default_factory=list)
+    env: list[str] = field(default_factory=list)
+    # Files written by the stage, which must exist for the stage to be skipped
+    outputs: list[str] = field(default_factory=list)
+
+def path_fingerprint(path: str) -> list:
+    if not os.path.exists(path):
+        return [path, None]
+    if os.path.isdir(path):
+        return [path, sorted(path_fingerprint(os.path.join(path, filename)) for filename in os.listdir(path))]
+    path_stat = os.stat(path)
+    return [path, path_stat.st_size, path_stat.st_mtime_ns]
+
+class Pipeline:
+    def __init__(self, stages: list[Stage], state_path: str = pipeline_state_path):
+        self.stages = { stage.name: stage for stage in stages }
+        self.state_path = state_path
+        for stage in stages:
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise ValueError(f'Unknown dependency {dependency} of stage {stage.name}')
+        self.order = self.topological_order()
+
+    def topological_order(self) -> list[str]:
+        order = []
+        visiting = set()
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f'Dependency cycle through stage {name}')
+            visiting.add(name)
+            for dependency in self.stages[name].dependencies:
+                visit(dependency)
+            visiting.remove(name)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    # The targets and all the stages they depend on
+    def ancestors(self, targets: list[str]) -> set[str]:
+        selected = set()
+        def select(name: str):
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage {name}')
+            if name in selected:
+                return
+            selected.add(name)
+            for dependency in self.stages[name].dependencies:
+                select(dependency)
+        for target in targets:
+            select(target)
+        return selected
+
+    def fingerprint(self, name: str, fingerprints: dict[str, str]) -> str:
+        stage = self.stages[name]
+        stage_description = {
+            'name': name,
+            'env': { variable: os.getenv(variable) for variable in sorted(stage.env) },
+            'inputs': [ path_fingerprint(path) for path in sorted(stage.inputs) ],
+            'dependencies': { dependency: [ fingerprints[dependency], self.run_id(dependency) ] for dependency in sorted(stage.dependencies) },
+        }
+        return hashlib.sha256(json.dumps(stage_description, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def state_filename(self, name: str) -> str:
+        return f'{self.state_path}{name}.json'
+
+    # Time of the last successful run of a stage, the fingerprint of a dependency being the same before and after it runs again
+    def run_id(self, name: str) -> float | None:
+        state_filename = self.state_filename(name)
+        if not os.path.exists(state_filename):
+            return None
+        state_file = open(state_filename, 'r')
+        state = json.load(state_file)
+        state_file.close()
+        return state.get('finished_at')
+
+    def result_filename(self, name: str) -> str:
+        return f'{self.state_path}{name}.pickle'
+
+    # Returns the memoized result of a stage as a one-element tuple, or None if the stage must run
+    def memoized_result(self, name: str, fingerprint: str) -> tuple | None:
+        state_filename = self.state_filename(name)
+        if not os.path.exists(state_filename):
+            return None
+        state_file = open(state_filename, 'r')
+        state = json.load(state_file)
+        state_file.close()
+        if state.get('fingerprint') != fingerprint or not all(os.path.exists(output) for output in self.stages[name].outputs):
+            return None
+        if not state.get('has_result', False):
+            return (None,)
+        if not os.path.exists(self.result_filename(name)):
+            return None
+        result_file = open(self.result_filename(name), 'rb')
+        result = pickle.load(result_file)
+        result_file.close()
+        return (result,)
+
+    def memoize(self, name: str, fingerprint: str, result: Any, duration: float):
+        os.makedirs(self.state_path, exist_ok=True)
+        if result is not None:
+            result_file = open(self.result_filename(name) + '.tmp', 'wb')
+            pickle.dump(result, result_file)
+            result_file.close()
+            os.replace(self.result_filename(name) + '.tmp', self.result_filename(name))
+        state_file = open(self.state_filename(name), 'w')
+        json.dump({ 'fingerprint': fingerprint, 'has_result': result is not None, 'duration': duration, 'finished_at': time.time() }, state_file)
+        state_file.close()
+
+    def run_stage(self, name: str, fingerprint: str, dependency_results: dict[str, Any]) -> Any:
+        # A stage waiting for a worker may start after the cancellation, before its future is cancelled
+        check_cancelled()
+        logging.info(f'Stage {name} started')
+        start_time = time.monotonic()
+        memory_budget.stage_started(name)
+        try:
+            result = self.stages[name].function(dependency_results)
+        except StageCancelled:
+            metrics.record_stage(name, time.monotonic() - start_time, 'cancelled')
+            raise
+        except Exception:
+            metrics.record_stage(name, time.monotonic() - start_time, 'failed')
+            raise
+        finally:
+            memory_budget.stage_finished(name)
+        duration = time.monotonic() - start_time
+        metrics.record_stage(name, duration, 'done')
+        self.memoize(name, fingerprint, result, duration)
+        logging.info(f'Stage {name} done in {duration:.1f}s')
+        return result
+
+    # Runs the targets and their ancestors, or all the stages, and returns the status of each stage: done, memoized, failed, skipped or cancelled.
+    # A failed stage does not stop the independent stages, only the stages depending on it are skipped.
+    # Once cancel_event is set, the stages waiting to run are cancelled, and the run returns when the running stages have stopped.
+    # The stages run for the targets, in the order they are started when run one at a time
+    def selected_stages(self, targets: list[str] | None = None) -> list[str]:
+        selected = self.ancestors(targets) if targets else set(self.stages)
+        return [ name for name in self.order if name in selected ]
+
+    def run(self, targets: list[str] | None = None, force: bool = False, max_workers: int = 4) -> dict[str, str]:
+        remaining = self.selected_stages(targets)
+        fingerprints: dict[str, str] = {}
+        results: dict[str, Any] = {}
+        statuses: dict[str, str] = {}
+        running: dict[concurrent.futures.Future, str] = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(remaining) > 0 or len(running) > 0:
+                if cancel_event.is_set() and len(remaining) > 0:
+                    logging.warning(f'Run cancelled, stages {remaining} not run')
+                    for name in remaining:
+                        statuses[name] = 'cancelled'
+                    remaining = []
+                    # The stages submitted but waiting for a worker are cancelled too
+                    executor.shutdown(wait=False, cancel_futures=True)
+                for name in list(remaining):
+                    dependencies = self.stages[name].dependencies
+                    if any(statuses.get(dependency) in ('failed', 'skipped') for dependency in dependencies):
+                        logging.warning(f'Stage {name} skipped, a dependency failed')
+                        statuses[name] = 'skipped'
+                        metrics.record_stage(name, 0.0, 'skipped')
+                        remaining.remove(name)
+                        continue
+                    if not all(dependency in results for dependency in dependencies):
+                        continue
+                    remaining.remove(name)
+                    fingerprints[name] = self.fingerprint(name, fingerprints)
+                    memoized = None if force else self.memoized_result(name, fingerprints[name])
+                    if memoized != None:
+                        logging.info(f'Stage {name} is up to date')
+                        results[name] = memoized[0]
+                        statuses[name] = 'memoized'
+                        metrics.record_stage(name, 0.0, 'memoized')
+                        continue
+                    dependency_results = { dependency: results[dependency] for dependency in dependencies }
+                    running[executor.submit(self.run_stage, name, fingerprints[name], dependency_results)] = name
+                if len(running) == 0:
+                    # The stages made ready by memoized stages are submitted by the next iteration
+                    if len(remaining) > 0 and not any(all(dependency in results for dependency in self.stages[name].dependencies) for name in remaining):
+                        raise RuntimeError(f'Stages {remaining} can not be run')
+                    continue
+                # The cancellation is checked at least every second
+                done, _ = concurrent.futures.wait(running, timeout=1.0, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.cancelled():
+                        statuses[name] = 'cancelled'
+                        continue
+                    try:
+                        results[name] = future.result()
+                        statuses[name] = 'done'
+                    except StageCancelled:
+                        logging.warning(f'Stage {name} cancelled')
+                        statuses[name] = 'cancelled'
+                    except Exception as e:
+                        logging.exception(f'Stage {name} failed: {e}')
+                        statuses[name] = 'failed'
+        return statuses
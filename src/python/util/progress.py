@@ -0,0 +1,46 @@
+import logging
+import time
+
+from util.metrics import metrics
+
+# Counts the records processed by a loop and logs the throughput every interval seconds, instead of one log line per record.
+# The count is added to the entity metrics of the name at each report, not at each record.
+class ProgressReporter:
+    def __init__(self, name: str, interval: float = 10.0, total: int | None = None):
+        self.name = name
+        self.interval = interval
+        self.total = total
+        self.count = 0
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+        self.last_report_count = 0
+        self.metrics_count = 0
+        metrics.record_entities(name, 0)
+
+    def update(self, num_records: int = 1):
+        self.count += num_records
+        now = time.monotonic()
+        if now - self.last_report_time >= self.interval:
+            self.report(now)
+
+    def report(self, now: float | None = None):
+        if now is None:
+            now = time.monotonic()
+        interval_rate = (self.count - self.last_report_count) / max(now - self.last_report_time, 1e-9)
+        total_string = f'/{self.total}' if self.total != None else ''
+        logging.info('%s: %d%s records, %.0f records/s', self.name, self.count, total_string, interval_rate)
+        self.last_report_time = now
+        self.last_report_count = self.count
+        self.record_metrics()
+
+    def record_metrics(self):
+        metrics.record_entities(self.name, self.count - self.metrics_count)
+        self.metrics_count = self.count
+
+    def rate(self) -> float:
+        return self.count / max(time.monotonic() - self.start_time, 1e-9)
+
+    def close(self):
+        elapsed_time = time.monotonic() - self.start_time
+        self.record_metrics()
+        logging.info('%s: %d records in %.1fs (%.0f records/s)', self.name, self.count, elapsed_time, self.rate())
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import requests
+
+from util.metrics import metrics
+
+# Spaces the calls to wait() so that at most requests_per_second calls are let through per second, across all the threads sharing the limiter.
+# A rate of 0 disables the limit.
+class RateLimiter:
+    def __init__(self, requests_per_second: float = 0):
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_time)
+            self.next_time = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+# HTTP session that waits for its rate limiter before each request, to be given to API clients built on requests.
+# The latency of each request, without the wait, is recorded in the metrics of its host.
+class RateLimitedSession(requests.Session):
+    def __init__(self, limiter: RateLimiter):
+        super().__init__()
+        self.limiter = limiter
+
+    def request(self, method, url, *args, **kwargs):
+        self.limiter.wait()
+        start_time = time.monotonic()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            metrics.record_request(url, time.monotonic() - start_time, 'error')
+            raise
+        metrics.record_request(url, time.monotonic() - start_time, response.status_code)
+        return response
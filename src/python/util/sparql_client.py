@@ -0,0 +1,160 @@
+from typing import Iterator
+import logging
+import os
+import shutil
+import time
+
+from rdflib import BNode, Literal, URIRef, XSD
+from rdflib.term import Identifier
+from SPARQLWrapper import JSON, POST, TSV, SPARQLWrapper
+
+from util.cache import cache_filepath, cache_stats, request_fingerprint
+from util.files import open_text_file
+from util.json_stream import iter_json_array
+from util.metrics import metrics
+from util.ntriples import is_iri, is_literal, iri_value, literal_datatype, literal_value
+
+# SPARQL client sending the queries directly to the endpoints.
+# The raw responses are cached as they are received, and the bindings are parsed lazily from the cached file, one row at a time.
+sparql_cache_path = 'data/sparql_cache/'
+sparql_result_extensions = { JSON: 'json', TSV: 'tsv' }
+
+# Terms of the SPARQL 1.1 JSON results format
+def json_result_term(term: dict) -> Identifier:
+    if term['type'] == 'uri':
+        return URIRef(term['value'])
+    if term['type'] == 'bnode':
+        return BNode(term['value'])
+    datatype = term.get('datatype')
+    return Literal(term['value'], lang=term.get('xml:lang'), datatype=URIRef(datatype) if datatype != None else None)
+
+# Terms of the SPARQL 1.1 TSV results format, written in the Turtle syntax
+def tsv_result_term(term: str) -> Identifier | None:
+    if term == '':
+        return None
+    if is_iri(term):
+        return URIRef(iri_value(term))
+    if term.startswith('_:'):
+        return BNode(term[2:])
+    if is_literal(term):
+        datatype = literal_datatype(term)
+        if datatype != None:
+            return Literal(literal_value(term), datatype=URIRef(datatype))
+        language_index = term.rfind('"@')
+        if language_index != -1:
+            return Literal(literal_value(term), lang=term[language_index + 2:])
+        return Literal(literal_value(term))
+    # Abbreviated numbers and booleans
+    if term in ('true', 'false'):
+        return Literal(term, datatype=XSD.boolean)
+    if 'e' in term or 'E' in term:
+        return Literal(term, datatype=XSD.double)
+    if '.' in term:
+        return Literal(term, datatype=XSD.decimal)
+    return Literal(term, datatype=XSD.integer)
+
+# Result of a SELECT query, read from its cached response file.
+# Iterating over the result yields one dictionary per row, from variable name to term, the unbound variables being absent.
+class SparqlResult:
+    def __init__(self, result_filename: str, result_format: str):
+        self.result_filename = result_filename
+        self.result_format = result_format
+        self._vars: list[str] | None = None
+
+    @property
+    def vars(self) -> list[str]:
+        if self._vars is None:
+            if self.result_format == TSV:
+                result_file = open_text_file(self.result_filename)
+                header = result_file.readline().rstrip('\n')
+                result_file.close()
+                self._vars = [ variable.lstrip('?$') for variable in header.split('\t') ] if header != '' else []
+            else:
+                self._vars = list(iter_json_array(self.result_filename, key='vars', key_depth=2))
+        return self._vars
+
+    def __iter__(self) -> Iterator[dict[str, Identifier]]:
+        if self.result_format == TSV:
+            yield from self._iter_tsv()
+        else:
+            for binding in iter_json_array(self.result_filename, key='bindings', key_depth=2):
+                yield { variable: json_result_term(term) for variable, term in binding.items() }
+
+    def _iter_tsv(self) -> Iterator[dict[str, Identifier]]:
+        result_file = open_text_file(self.result_filename)
+        try:
+            header = result_file.readline().rstrip('\n')
+            variables = [ variable.lstrip('?$') for variable in header.split('\t') ]
+            for line in result_file:
+                line = line.rstrip('\n')
+                if line == '':
+                    continue
+                row = {}
+                for variable, term in zip(variables, line.split('\t')):
+                    result_term = tsv_result_term(term)
+                    if result_term != None:
+                        row[variable] = result_term
+                yield row
+        finally:
+            result_file.close()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+class SparqlClient:
+    def __init__(self, endpoint: str, result_format: str = JSON, cache_path: str = sparql_cache_path, timeout: int = 300):
+        self.endpoint = endpoint
+        self.result_format = result_format
+        self.cache_path = cache_path
+        self.timeout = timeout
+
+    def result_filepath(self, query: str) -> str:
+        fingerprint = request_fingerprint('POST', self.endpoint, { 'query': query, 'format': self.result_format })
+        return cache_filepath(self.cache_path, fingerprint, sparql_result_extensions[self.result_format])
+
+    # Sends the query by POST and copies the response to the cache file as it is received
+    def _send(self, query: str, result_filename: str):
+        sparql = SPARQLWrapper(self.endpoint)
+        sparql.setMethod(POST)
+        sparql.setQuery(query)
+        sparql.setReturnFormat(self.result_format)
+        sparql.setTimeout(self.timeout)
+        logging.info('Sending query to SPARQL endpoint %s', self.endpoint)
+        logging.debug(query)
+        start_time = time.monotonic()
+        try:
+            response = sparql.query().response
+        except Exception:
+            metrics.record_request(self.endpoint, time.monotonic() - start_time, 'error')
+            raise
+        os.makedirs(os.path.dirname(result_filename) or '.', exist_ok=True)
+        temporary_filename = result_filename + '.tmp'
+        with open(temporary_filename, 'wb') as result_file:
+            shutil.copyfileobj(response, result_file)
+        response.close()
+        # The latency includes the transfer of the response, which is the larger part for big results
+        metrics.record_request(self.endpoint, time.monotonic() - start_time, response.status)
+        os.replace(temporary_filename, result_filename)
+        cache_stats.record_write('sparql', os.path.getsize(result_filename))
+
+    def select(self, query: str) -> SparqlResult:
+        result_filename = self.result_filepath(query)
+        if os.path.exists(result_filename):
+            cache_stats.record_hit('sparql', os.path.getsize(result_filename))
+        else:
+            cache_stats.record_miss('sparql')
+            self._send(query, result_filename)
+        return SparqlResult(result_filename, self.result_format)
+
+    # Yields the rows of a query too large for one response, sent by pages of page_size rows.
+    # The query must not have a LIMIT or an OFFSET, and must be ordered for the pages to be consistent.
+    def select_pages(self, query: str, page_size: int = 10000) -> Iterator[dict[str, Identifier]]:
+        offset = 0
+        while True:
+            num_rows = 0
+            for row in self.select(f'{query}\nLIMIT {page_size}\nOFFSET {offset}'):
+                num_rows += 1
+                yield row
+            if num_rows < page_size:
+                return
+            offset += page_size
@@ -1,18 +1,21 @@
 import hashlib
 import os
 import uuid
+from typing import TYPE_CHECKING, Callable, Iterator
 from rdflib import Graph, URIRef, BNode, Namespace
-from rdflib.plugins.sparql import prepareQuery
-from rdflib.plugins.sparql.results.jsonresults import JSONResultParser, JSONResultSerializer
-from rdflib.query import Result, ResultRow
 import re
-from github import PaginatedList
 import json
 import logging
+import time
 
-import requests
+from util.cache import cache_filepath, read_cached_json, request_fingerprint, write_cached_json
+from util.metrics import metrics
 
 
+# PyGithub is only needed by the GitHub source, it is not imported with the helpers
+if TYPE_CHECKING:
+    from github import PaginatedList
+
 # Helper functions
 
 def sanitize_uri(s):
@@ -39,48 +42,72 @@ def create_uri(s):
 def create_bnode(prefix= ""):
     return BNode(prefix + str(uuid.uuid4()))
 
-def json_encode_paginated_list(paginated_list: PaginatedList.PaginatedList):
+# Iterates over the raw data of the items of a paginated list, page by page, and stops fetching pages once the limit is reached.
+# The first page may be given if it has already been fetched, and fetch_page can replace paginated_list.get_page to control when pages are requested.
+def iter_paginated_list(paginated_list: "PaginatedList.PaginatedList", limit: int | None = None, first_page: list | None = None, fetch_page: Callable[[int], list] | None = None) -> Iterator[dict]:
+    if fetch_page is None:
+        fetch_page = paginated_list.get_page
+    page_index = 0
+    page = first_page
+    num_items = 0
+    if page is None:
+        page = fetch_page(page_index)
+    total_count = paginated_list.totalCount
+    while len(page) > 0:
+        for item in page:
+            if limit is not None and num_items >= limit:
+                return
+            yield item.raw_data
+            num_items += 1
+        if (limit is not None and num_items >= limit) or num_items >= total_count:
+            return
+        page_index += 1
+        page = fetch_page(page_index)
+
+# The items fetched before an error are still encoded
+def json_encode_paginated_list(paginated_list: "PaginatedList.PaginatedList", limit: int | None = None):
     json_list = []
     try:
-        for item in paginated_list:
-            json_list.append(item.raw_data)
+        for raw_data in iter_paginated_list(paginated_list, limit=limit):
+            json_list.append(raw_data)
     except Exception as e:
         logging.error(f"Error: {e}")
-
     return json.JSONEncoder().encode(json_list)
 
-def sparql_cached(query: str) -> Result:
-    sparql_query_hash = hashlib.md5(query.encode()).hexdigest()
-    query_result_filename = f"data/sparql_cache/{sparql_query_hash}.json"
-
-    if(os.path.exists(query_result_filename)):
-        result_parser = JSONResultParser()
-        query_result_page = open(query_result_filename, 'r')
-        query_result = result_parser.parse(source=query_result_page)
-        query_result_page.close()
-        return query_result
-    else:
-        sparql_query = prepareQuery(query)
-        logging.info(f"Sending query to DBLP SPARQL endpoint: {query}")
-        query_result = Graph().query(sparql_query)
-        if len(query_result) > 0:
-            result_serializer = JSONResultSerializer(query_result)
-            query_result_file = open(query_result_filename, "x", encoding="utf-8")
-            result_serializer.serialize(query_result_file, encoding="utf-8")
-        return query_result
-    
-def api_cached_query(api_url: str, api_query_file_prefix: str ):
-    api_result = None
+# Writes the items of a paginated list to a JSON file as they are fetched, without keeping them in memory.
+# The file only appears once complete, so that an interrupted run does not leave a truncated cache file:
+# if a page can not be fetched, the error is raised and the partial file removed.
+def json_dump_paginated_list(paginated_list: "PaginatedList.PaginatedList", filename: str, limit: int | None = None, first_page: list | None = None, fetch_page: Callable[[int], list] | None = None) -> int:
+    num_items = 0
+    temporary_filename = filename + '.tmp'
+    try:
+        with open(temporary_filename, 'w') as json_file:
+            json_file.write('[')
+            for raw_data in iter_paginated_list(paginated_list, limit=limit, first_page=first_page, fetch_page=fetch_page):
+                if num_items > 0:
+                    json_file.write(', ')
+                json.dump(raw_data, json_file)
+                num_items += 1
+            json_file.write(']')
+    except BaseException:
+        os.remove(temporary_filename)
+        raise
+    os.replace(temporary_filename, filename)
+    return num_items
 
-    api_query_file = f"{api_query_file_prefix}{hashlib.md5((api_url.encode())).hexdigest()}.json"
-    if(os.path.exists(api_query_file)):
-        api_page = open(api_query_file, 'r')
-        api_result = json.load(api_page)
-        api_page.close()
-    else:
+# The source of the cached answers, for the cache statistics, is given by the cache directory, e.g. "hal/author" for "data/hal/author/"
+def api_cached_query(api_url: str, api_query_file_prefix: str, source: str | None = None):
+    if source == None:
+        source = api_query_file_prefix.strip("/").removeprefix("data/")
+    api_query_file = cache_filepath(api_query_file_prefix, request_fingerprint("GET", api_url))
+    legacy_api_query_file = f"{api_query_file_prefix}{hashlib.md5((api_url.encode())).hexdigest()}.json"
+    api_result = read_cached_json(source, api_query_file, legacy_filepath=legacy_api_query_file)
+    if api_result == None:
+        # requests is only imported when an answer is not cached
+        import requests
+        start_time = time.monotonic()
         api_response = requests.get(api_url)
+        metrics.record_request(api_url, time.monotonic() - start_time, api_response.status_code)
         api_result = api_response.json()
-        api_page = open(api_query_file, 'w')
-        json.dump(api_result, api_page)
-        api_page.close()
-    return api_result
\ No newline at end of file
+        write_cached_json(source, api_query_file, api_result)
+    return api_result